@@ -0,0 +1,74 @@
+import math
+import os
+import random
+
+FEEDS = ('CXI046', 'CXI249', 'CXI027')
+DISTRIBUTIONS = ('fixed', 'uniform', 'lognormal')
+
+# A fixed-width looking record, repeated to fill the files (real feeds are repetitive text)
+RECORD = b'046 0360 20261018 ACC0000123456 GBP 0000001234.56 CR SETTLED        \n'
+
+
+def file_sizes(count, mean_size, distribution, seed=0):
+    """Yield count file sizes in bytes following the distribution around mean_size."""
+    rng = random.Random(seed)
+    for _ in range(count):
+        if distribution == 'fixed':
+            yield mean_size
+        elif distribution == 'uniform':
+            yield int(rng.uniform(0.5, 1.5) * mean_size)
+        elif distribution == 'lognormal':
+            # sigma 1 with the location shifted so the mean stays mean_size
+            yield int(rng.lognormvariate(math.log(mean_size) - 0.5, 1.0))
+        else:
+            raise ValueError(f"Unknown size distribution: {distribution}")
+
+
+def feed_file_stem(index, feed):
+    """OL_0360_nn_hhmm_<feed> name that is unique for index < 1,000,000."""
+    return f"OL_0360_{index % 100:02d}_{(index // 100) % 10000:04d}_{feed}"
+
+
+def generate_feed_tree(source_path, count, mean_size, distribution='lognormal', seed=0):
+    """
+    Create count synthetic ISTAR .dat files (cycling through FEEDS) with their .trg files in source_path.
+
+    :return: Total number of data bytes written.
+    """
+    os.makedirs(source_path, exist_ok=True)
+    block = RECORD * (4 * 1024 * 1024 // len(RECORD) + 1)
+    total_bytes = 0
+
+    for index, size in enumerate(file_sizes(count, mean_size, distribution, seed)):
+        stem = feed_file_stem(index, FEEDS[index % len(FEEDS)])
+        with open(os.path.join(source_path, stem + '.dat'), 'wb') as f:
+            remaining = size
+            while remaining:
+                written = f.write(block[:min(remaining, len(block))])
+                remaining -= written
+        open(os.path.join(source_path, stem + '.trg'), 'wb').close()
+        total_bytes += size
+
+    return total_bytes
+
+
+def receiver_config(source_path, ops_shared_drive_path, gloss_core_path, concurrency=None):
+    """Build the receiver config routing every feed to the renamed ops copy and the plain gloss-core copy."""
+    config = {
+        'name': 'i-star cx receiver_system',
+        'servers': [{
+            'server_name': 'i-star-cx',
+            'source_path': source_path,
+            'files': [{
+                'file_name_pattern': f'OL_0360_nn_hhmm_{feed}.dat',
+                'destination': [
+                    {'path': ops_shared_drive_path, 'should_process': 'Rename',
+                     'process_config': {'rename_pattern': f'{feed}_YYMMDD_<nnnnn>_01(MMDD).csv'}},
+                    {'path': gloss_core_path, 'should_process': 'None'},
+                ],
+            } for feed in FEEDS],
+        }],
+    }
+    if concurrency:
+        config['concurrency'] = {'max_workers': concurrency}
+    return config
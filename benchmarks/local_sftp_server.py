@@ -0,0 +1,212 @@
+import hashlib
+import os
+import shlex
+import socket
+import subprocess
+import threading
+
+import paramiko
+from paramiko import SFTPAttributes, SFTPHandle, SFTPServer, SFTPServerInterface, ServerInterface
+from paramiko.sftp import SFTP_OK
+
+# Codecs of the remote decompression command the dispatcher sends (see dispatcher.compression)
+DECOMPRESS_CODECS = ('gzip', 'zstd', 'lz4')
+REJECTED_STATUS = 126
+
+
+def local_path(root, path):
+    """The file under root that a remote path names; remote paths never leave root."""
+    return os.path.join(root, os.path.normpath('/' + path).lstrip('/'))
+
+
+def is_decompress_script(args):
+    """Whether args are those of dispatcher.compression's remote_decompress_script."""
+    return (len(args) == 14 and args[0] in DECOMPRESS_CODECS
+            and [args[1], args[3], args[5], args[6], args[7], args[10], args[11], args[12]] ==
+            ['-dc', '>', '&&', 'mv', '-f', '&&', 'rm', '-f']
+            and args[4] == args[8] and args[2] == args[13])
+
+
+def is_prefix_hash(args):
+    """Whether args are those of the 'head -c <length> <file> | sha256sum' that verifies a resumed upload."""
+    return len(args) == 6 and args[:2] == ['head', '-c'] and args[2].isdigit() and args[4:] == ['|', 'sha256sum']
+
+
+class LocalSSHServer(ServerInterface):
+    """
+    Password-only SSH server interface. Exec requests only run the commands the dispatcher sends,
+    without a shell and with their remote paths inside the served root; anything else exits 126.
+    """
+
+    def __init__(self, username, password, root):
+        self.username = username
+        self.password = password
+        self.root = root
+
+    def check_auth_password(self, username, password):
+        if (username, password) == (self.username, self.password):
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def get_allowed_auths(self, username):
+        return 'password'
+
+    def check_channel_request(self, kind, chanid):
+        return paramiko.OPEN_SUCCEEDED
+
+    def check_channel_exec_request(self, channel, command):
+        command = command.decode(errors='replace')
+
+        def run():
+            try:
+                args = shlex.split(command)
+            except ValueError:
+                args = []
+            if is_decompress_script(args):
+                returncode, stdout, stderr = self.decompress(args[0], args[2], args[4], args[9])
+            elif is_prefix_hash(args):
+                returncode, stdout, stderr = self.prefix_hash(int(args[2]), args[3])
+            else:
+                returncode, stdout, stderr = REJECTED_STATUS, b'', f"Command not allowed: {command}\n".encode()
+            channel.sendall(stdout)
+            channel.sendall_stderr(stderr)
+            channel.send_exit_status(returncode)
+            # EOF rather than close: closing could overtake the reply to the exec request itself
+            channel.shutdown_write()
+
+        threading.Thread(target=run, daemon=True).start()
+        return True
+
+    def decompress(self, codec, compressed_path, partial_path, remote_path):
+        """'<codec> -dc <file> > <partial> && mv -f <partial> <final> && rm -f <file>'."""
+        compressed, partial = local_path(self.root, compressed_path), local_path(self.root, partial_path)
+        try:
+            with open(partial, 'wb') as out:
+                result = subprocess.run([codec, '-dc', compressed], stdout=out, stderr=subprocess.PIPE)
+            if result.returncode == 0:
+                os.replace(partial, local_path(self.root, remote_path))
+                os.remove(compressed)
+        except OSError as e:
+            return 1, b'', f"{e}\n".encode()
+        return result.returncode, b'', result.stderr
+
+
+    def prefix_hash(self, length, remote_path):
+        """'head -c <length> <file> | sha256sum', hashed in process."""
+        digest = hashlib.sha256()
+        try:
+            with open(local_path(self.root, remote_path), 'rb') as f:
+                digest.update(f.read(length))
+        except OSError as e:
+            return 1, b'', f"{e}\n".encode()
+        return 0, f"{digest.hexdigest()}  -\n".encode(), b''
+
+
+class LocalSFTPHandle(SFTPHandle):
+    def stat(self):
+        try:
+            return SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+    def chattr(self, attr):
+        return SFTP_OK
+
+
+class LocalSFTPServer(SFTPServerInterface):
+    """Serves root, with remote paths relative to it."""
+
+    def __init__(self, server, root):
+        super().__init__(server)
+        self.root = root
+
+    def local_path(self, path):
+        return local_path(self.root, path)
+
+    def list_folder(self, path):
+        try:
+            local = self.local_path(path)
+            attributes = []
+            for name in os.listdir(local):
+                attribute = SFTPAttributes.from_stat(os.stat(os.path.join(local, name)))
+                attribute.filename = name
+                attributes.append(attribute)
+            return attributes
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+    def stat(self, path):
+        try:
+            return SFTPAttributes.from_stat(os.stat(self.local_path(path)))
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+    lstat = stat
+
+    def open(self, path, flags, attr):
+        try:
+            fd = os.open(self.local_path(path), flags, 0o644)
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+        if flags & os.O_WRONLY:
+            mode = 'ab' if flags & os.O_APPEND else 'wb'
+        elif flags & os.O_RDWR:
+            mode = 'a+b' if flags & os.O_APPEND else 'r+b'
+        else:
+            mode = 'rb'
+
+        handle = LocalSFTPHandle(flags)
+        handle.readfile = handle.writefile = os.fdopen(fd, mode)
+        return handle
+
+    def remove(self, path):
+        return self.apply(os.remove, self.local_path(path))
+
+    def rename(self, oldpath, newpath):
+        return self.apply(os.rename, self.local_path(oldpath), self.local_path(newpath))
+
+    def posix_rename(self, oldpath, newpath):
+        return self.apply(os.replace, self.local_path(oldpath), self.local_path(newpath))
+
+    def mkdir(self, path, attr):
+        return self.apply(os.mkdir, self.local_path(path))
+
+    def rmdir(self, path):
+        return self.apply(os.rmdir, self.local_path(path))
+
+    def chattr(self, path, attr):
+        return SFTP_OK
+
+    @staticmethod
+    def apply(operation, *paths):
+        try:
+            operation(*paths)
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+        return SFTP_OK
+
+
+def start_local_sftp_server(root, username='bench', password='bench'):
+    """
+    Start an in-process SFTP server on 127.0.0.1 serving root, standing in for Gloss Core.
+
+    :return: Server entry usable as an SFTPDispatcher server config.
+    """
+    host_key = paramiko.RSAKey.generate(2048)
+
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(16)
+
+    def accept_loop():
+        while True:
+            connection, _ = listener.accept()
+            transport = paramiko.Transport(connection)
+            transport.add_server_key(host_key)
+            transport.set_subsystem_handler('sftp', SFTPServer, LocalSFTPServer, root)
+            transport.start_server(server=LocalSSHServer(username, password, root))
+
+    threading.Thread(target=accept_loop, daemon=True).start()
+    return {'host': '127.0.0.1', 'port': listener.getsockname()[1], 'username': username, 'password': password}
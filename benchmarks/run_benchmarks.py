@@ -0,0 +1,217 @@
+import argparse
+import importlib.util
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from benchmarks.feed_generator import DISTRIBUTIONS, generate_feed_tree, receiver_config
+from utils.transfer_scheduler import parse_size
+
+SCENARIOS = ('receiver', 'shared_drive', 'sftp')
+COMPARED_METRICS = ('files_per_second', 'mb_per_second')
+
+
+def default_workdir():
+    """Prefer tmpfs so the numbers measure the code rather than the disk."""
+    return '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+
+
+def io_counters():
+    """Read/write syscall counts of this process (Linux only, None elsewhere)."""
+    try:
+        with open('/proc/self/io') as f:
+            counters = dict(line.split(': ') for line in f.read().splitlines())
+        return int(counters['syscr']), int(counters['syscw'])
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def peak_rss_mb():
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    return maxrss / (1024 * 1024) if sys.platform == 'darwin' else maxrss / 1024
+
+
+def data_files(directory, extension):
+    """Return (count, total bytes) of the data files with a trigger in directory."""
+    count = total_bytes = 0
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.name.endswith(extension):
+                count += 1
+                total_bytes += entry.stat().st_size
+    return count, total_bytes
+
+
+def run_scenario(scenario, paths, options):
+    """Runs one scenario in a fresh process and returns its metrics."""
+    logging.basicConfig(level=options['log_level'])
+    logging.getLogger('paramiko').setLevel(logging.WARNING)
+
+    if scenario == 'receiver':
+        from receiver.istar_cx_receiver import IStarCXReceiver
+        config = receiver_config(paths['source'], paths['ops_shared_drive'], paths['gloss_core'],
+                                 options['concurrency'])
+        run = IStarCXReceiver(config).process_files
+    elif scenario == 'shared_drive':
+        from dispatcher.shared_drive_dispatcher import SharedDriveDispatcher
+        config = {'source_directory': paths['ops_shared_drive'], 'destination_type': 'shared_drive',
+                  'destination_details': {'shared_drive_path': paths['shared_drive']},
+                  'file_extension': '.csv', 'trigger_extension': '.trg', 'enabled': True}
+        run = SharedDriveDispatcher(config, 'BENCH').dispatch
+    else:
+        from benchmarks.local_sftp_server import start_local_sftp_server
+        from dispatcher.sftp_dispatcher import SFTPDispatcher
+        server_config = start_local_sftp_server(paths['sftp_root'])
+        server_config['max_channels'] = options['sftp_channels']
+        config = {'source_directory': paths['gloss_core'], 'destination_type': 'external_server',
+                  'destination_details': {'server_name': 'gloss-core-bench', 'destination_path': '/'},
+                  'file_extension': '.dat', 'trigger_extension': '.trg', 'enabled': True}
+        if options['compression']:
+            config['compression'] = {'codec': options['compression']}
+        run = SFTPDispatcher(config, 'BENCH', server_config).dispatch
+
+    io_before = io_counters()
+    started = time.perf_counter()
+    run()
+    elapsed = time.perf_counter() - started
+    io_after = io_counters()
+
+    metrics = {'seconds': round(elapsed, 4), 'peak_rss_mb': round(peak_rss_mb(), 1)}
+    if io_before and io_after:
+        metrics['read_syscalls'] = io_after[0] - io_before[0]
+        metrics['write_syscalls'] = io_after[1] - io_before[1]
+    return metrics
+
+
+def measure(scenario, paths, options, files, total_bytes):
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        metrics = executor.submit(run_scenario, scenario, paths, options).result()
+    seconds = max(metrics['seconds'], 1e-9)
+    metrics.update({
+        'files': files,
+        'bytes': total_bytes,
+        'files_per_second': round(files / seconds, 1),
+        'mb_per_second': round(total_bytes / seconds / 1024 ** 2, 2),
+    })
+    return metrics
+
+
+def compare(results, baseline, threshold):
+    """Print the change against the baseline and return the list of regressions."""
+    regressions = []
+    for scenario, metrics in results['scenarios'].items():
+        baseline_metrics = baseline.get('scenarios', {}).get(scenario)
+        if not baseline_metrics:
+            continue
+        for metric in COMPARED_METRICS:
+            before, after = baseline_metrics.get(metric), metrics.get(metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            flag = ''
+            if change < -threshold:
+                flag = '  REGRESSION'
+                regressions.append(f"{scenario}.{metric}")
+            print(f"{scenario:<14}{metric:<18}{before:>12}{after:>12}{change:>+9.1%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the receiver and dispatchers on a synthetic ISTAR feed.")
+    parser.add_argument('--files', type=int, default=1000, help="Number of .dat files to generate (default: 1000)")
+    parser.add_argument('--size', type=parse_size, default=parse_size('64KiB'),
+                        help="Mean file size, e.g. 4KiB, 64KiB, 2MiB (default: 64KiB)")
+    parser.add_argument('--distribution', choices=DISTRIBUTIONS, default='lognormal',
+                        help="File size distribution (default: lognormal)")
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--concurrency', type=int, default=None, help="Receiver concurrency.max_workers")
+    parser.add_argument('--sftp-channels', type=int, default=4, help="SFTP channels for the sftp scenario")
+    parser.add_argument('--compression', choices=('gzip', 'zstd', 'lz4'),
+                        help="Compress the uploads of the sftp scenario with this codec")
+    parser.add_argument('--workdir', default=default_workdir(), help="Where to build the trees (default: tmpfs)")
+    parser.add_argument('--output', help="Write the results as JSON to this file")
+    parser.add_argument('--baseline', help="JSON results of an earlier run to compare against")
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help="Relative slowdown flagged as a regression (default: 0.10)")
+    parser.add_argument('--log-level', default='WARNING', help="Log level while measuring (default: WARNING)")
+    parser.add_argument('--keep', action='store_true', help="Keep the generated trees")
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix='feed-bench-', dir=args.workdir)
+    paths = {name: os.path.join(root, name)
+             for name in ('source', 'ops_shared_drive', 'gloss_core', 'shared_drive', 'sftp_root')}
+    for path in paths.values():
+        os.makedirs(path, exist_ok=True)
+
+    options = {'concurrency': args.concurrency, 'sftp_channels': args.sftp_channels,
+               'compression': args.compression, 'log_level': args.log_level}
+    results = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': {'files': args.files, 'size': args.size, 'distribution': args.distribution,
+                       'concurrency': args.concurrency, 'sftp_channels': args.sftp_channels,
+                       'compression': args.compression, 'workdir': args.workdir},
+        'scenarios': {},
+    }
+
+    try:
+        print(f"Generating {args.files} files ({args.distribution}, mean {args.size} bytes) in {root}")
+        total_bytes = generate_feed_tree(paths['source'], args.files, args.size, args.distribution)
+
+        for scenario in SCENARIOS:
+            if scenario not in args.scenarios:
+                continue
+
+            if scenario == 'receiver':
+                files = args.files
+            elif scenario == 'shared_drive':
+                files, total_bytes = data_files(paths['ops_shared_drive'], '.csv')
+            else:
+                if importlib.util.find_spec('paramiko') is None:
+                    print("Skipping sftp: paramiko is not installed")
+                    continue
+                # The receiver copies no .trg to gloss-core, so publish one per file for the dispatcher
+                files, total_bytes = data_files(paths['gloss_core'], '.dat')
+                for name in os.listdir(paths['gloss_core']):
+                    if name.endswith('.dat'):
+                        open(os.path.join(paths['gloss_core'], name[:-len('.dat')] + '.trg'), 'wb').close()
+
+            if not files:
+                print(f"Skipping {scenario}: no input files (run the receiver scenario first)")
+                continue
+
+            metrics = measure(scenario, paths, options, files, total_bytes)
+            results['scenarios'][scenario] = metrics
+            print(f"{scenario:<14}{metrics['files_per_second']:>10} files/s {metrics['mb_per_second']:>10} MB/s "
+                  f"{metrics['seconds']:>9}s  peak RSS {metrics['peak_rss_mb']} MB")
+    finally:
+        if not args.keep:
+            shutil.rmtree(root, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"Regressions beyond {args.threshold:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
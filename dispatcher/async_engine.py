@@ -0,0 +1,117 @@
+import asyncio
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.logger import get_logger
+from utils.transfer_scheduler import WorkQueue
+
+# Ends a directory's listing on the queue between its listing thread and its dispatch
+LISTING_DONE = object()
+
+
+class AsyncDispatchEngine:
+    """
+    Runs a dispatch pass with every directory as its own asyncio task, so a slow SFTP directory no longer
+    holds up the shared-drive directories after it and a pass takes about as long as its slowest directory.
+
+    The listings and the blocking transfers run on a thread pool with a worker per directory; concurrency
+    and bandwidth per destination stay with the DestinationLimits the scheduler shares between directories.
+    A directory is listed on its own thread while it is dispatched: everything listed so far waits in one WorkQueue, and
+    the dispatcher takes the best priority batch (of at most discovery_batch_size files) from it each time,
+    so priority and deadline order hold across the whole listing. What remains is that a file can only
+    overtake others once it has been listed, and never a batch already in flight: an urgent file late in
+    a huge directory waits for the listing to reach it, not for the backlog listed before it.
+
+    A directory that exceeds its 'timeout' (seconds), counted from the start of its listing, or a pass
+    that is interrupted, is cancelled
+    cooperatively: the dispatcher stops before its next file or SFTP block and leaves the remaining
+    triggers for the next pass.
+    """
+
+    def __init__(self, dispatchers, scheduler):
+        self.dispatchers = dispatchers
+        self.scheduler = scheduler
+        self.executor = ThreadPoolExecutor(max_workers=max(1, len(dispatchers)), thread_name_prefix='dispatch')
+        self.logger = get_logger('dispatcher_logger')
+
+    def run_pass(self):
+        """Run one pass over every directory and return once all of them finished or were cancelled."""
+        if self.dispatchers:
+            asyncio.run(self.dispatch_all())
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+    async def dispatch_all(self):
+        await asyncio.gather(*(self.dispatch_directory(dispatcher) for dispatcher in self.dispatchers))
+
+    async def dispatch_directory(self, dispatcher):
+        future = asyncio.get_running_loop().run_in_executor(self.executor, self.run_directory, dispatcher)
+        try:
+            # Shielded: on a timeout the dispatcher is told to stop and is then waited for
+            await asyncio.wait_for(asyncio.shield(future), dispatcher.timeout)
+        except asyncio.TimeoutError:
+            self.logger.warning(f"Dispatch of {dispatcher.source_directory} exceeded its {dispatcher.timeout}s "
+                                f"timeout: cancelling")
+            dispatcher.cancelled.set()
+            await self.finish(dispatcher, future)
+        except asyncio.CancelledError:
+            dispatcher.cancelled.set()
+            await asyncio.shield(self.finish(dispatcher, future))
+            raise
+        except Exception as e:
+            self.logger.error(f"Error in processing {dispatcher.source_directory}: {e}")
+        finally:
+            if future.done():
+                dispatcher.cancelled.clear()
+
+    async def finish(self, dispatcher, future):
+        """Wait for a cancelled dispatcher to reach its next stopping point."""
+        try:
+            await future
+        except Exception as e:
+            self.logger.error(f"Error in processing {dispatcher.source_directory}: {e}")
+
+    def run_directory(self, dispatcher):
+        """
+        Dispatch the files of one directory in priority batches while it is still being listed (on an
+        executor thread), waiting for the listing only when everything listed so far has been dispatched.
+        The first batch is listed here, so a directory with nothing to dispatch starts no listing thread.
+        """
+        discovered = dispatcher.find_file_batches()
+        first_batch = next(discovered, None)
+        if not first_batch:
+            dispatcher.complete_pass()
+            return
+        listed = queue.Queue()
+        threading.Thread(target=self.list_directory, args=(discovered, listed), daemon=True,
+                         name=f'list-{dispatcher.source_directory.name}').start()
+        work = WorkQueue(self.scheduler, lambda file: file.name)
+        work.add(first_batch)
+        listing = True
+        while True:
+            while listing:
+                try:
+                    files = listed.get(block=not work)
+                except queue.Empty:
+                    break
+                if files is LISTING_DONE:
+                    listing = False
+                elif isinstance(files, Exception):
+                    raise files
+                else:
+                    work.add(files)
+            if not work or dispatcher.cancelled.is_set():
+                return
+            dispatcher.dispatch(work.take(dispatcher.discovery_batch_size))
+
+    @staticmethod
+    def list_directory(discovered, listed):
+        """Put a directory's discovery batches on the listed queue, then LISTING_DONE (or the error)."""
+        try:
+            for files in discovered:
+                listed.put(files)
+            listed.put(LISTING_DONE)
+        except Exception as e:
+            listed.put(e)
@@ -1,56 +1,315 @@
 import os
+import threading
+import time
 from abc import ABC, abstractmethod
 from pathlib import Path
+from utils.atomic_publish import Publisher
+from utils.checksum import new_hasher
+from utils.dedupe_index import DROP, DedupePolicy
+from utils.file_claims import CLAIM_MARKER, FileClaims
 from utils.logger import get_logger
+from utils.metrics import BACKLOG, BYTES, FILES, LAST_RUN
+from utils.scan_watermark import ScanWatermarks
+from utils.transfer_journal import TransferJournal
+from utils.tracing import stage
+from utils.transfer_scheduler import DestinationLimits
+
+# Data files handed on per discovery batch, while the rest of the directory is still being listed
+DISCOVERY_BATCH_SIZE = 256
+
+
+class DispatchCancelled(Exception):
+    """Raised inside a transfer when its dispatcher was cancelled (timeout or shutdown)."""
 
 
 class BaseDispatcher(ABC):
-    def __init__(self, config):
-        self.source_directory = Path(source_directory)
-        self.file_extension = file_extension
-        self.trigger_extension = trigger_extension
+    def __init__(self, config, environment):
+        self.config = config
+        self.environment = environment
+        self.source_directory = Path(config['source_directory'])
+        self.file_extension = config['file_extension']
+        self.trigger_extension = config['trigger_extension']
         self.logger = get_logger('dispatcher_logger')
 
+        # Optional journal so a rerun after a crash does not transfer already delivered files again
+        journal_path = config.get('journal_path')
+        self.journal = TransferJournal.open(journal_path, config.get('journal_hash', False)) if journal_path else None
+        # Identifies the destination in the journal, set by the concrete dispatchers
+        self.destination_key = None
+        # Concurrency / bandwidth limits of the destination, shared through the TransferScheduler by dispatcher.main
+        self.limits = DestinationLimits()
+        # Optional time limit of a pass over this directory, in seconds (see dispatcher.async_engine)
+        self.timeout = config.get('timeout')
+        # Set to stop the current dispatch between files; the remaining triggers stay for the next pass
+        self.cancelled = threading.Event()
+        self.discovery_batch_size = config.get('discovery_batch_size', DISCOVERY_BATCH_SIZE)
+        # Optional watermarks letting a pass skip listing an unchanged, idle directory. Not with claims:
+        # the claims of a dead node expire without the directory changing
+        watermark_path = config.get('watermark_path')
+        self.watermarks = ScanWatermarks.open(watermark_path) \
+            if watermark_path and not config.get('claims') else None
+
+        # Optional hash-while-copy ('sha256', 'xxh64', ...) with a '<file>.<algorithm>' sidecar at the destination
+        self.checksum = config.get('checksum')
+        self.checksum_sidecar = config.get('checksum_sidecar', False)
+        if self.checksum:
+            new_hasher(self.checksum)
+
+        # Local destination files are written under temp names and published by group-committed renames
+        self.publisher = Publisher.shared(config.get('publish'))
+
+        # Optional claiming of the trigger files, for several dispatcher nodes sharing the source directory
+        self.claims = FileClaims.from_config(config['claims'], 'dispatcher_logger') if config.get('claims') else None
+        # {data file: claim path} of the files claimed by the current dispatch call
+        self.claimed = {}
+
+        # Optional content-hash dedupe against what this destination already received (see utils.dedupe_index)
+        self.dedupe = DedupePolicy.from_config(config['dedupe']) if config.get('dedupe') else None
+        # {data file: ContentKey} of the files of the current dispatch call, indexed once delivered
+        self.content_keys = {}
+
     @abstractmethod
-    def dispatch(self, destination_details):
-        """Method to transfer files to the destination."""
+    def dispatch(self, files_to_transfer=None):
+        """
+        Method to transfer files to the destination.
+
+        :param files_to_transfer: Data files to transfer; when omitted the source directory is scanned.
+        """
         pass
 
+    def check_cancelled(self):
+        """Raise DispatchCancelled once the dispatcher has been cancelled."""
+        if self.cancelled.is_set():
+            raise DispatchCancelled(f"Dispatch of {self.source_directory} was cancelled")
+
+    def dispatch_trigger(self, trigger_name):
+        """Transfer the single data file announced by a trigger file landing in the source directory (watch mode)."""
+        data_file = (self.source_directory / trigger_name).with_suffix(self.file_extension)
+        if not data_file.exists():
+            self.logger.warning(f"Data file not found for trigger {trigger_name}")
+            return
+        self.dispatch([data_file])
+
+    def claim_files(self, files_to_transfer):
+        """With claims configured, keep only the files whose trigger this node claimed first."""
+        if self.claims is None:
+            return list(files_to_transfer)
+
+        claimed_files = []
+        for file in files_to_transfer:
+            claim_path = self.claims.claim(str(file.with_suffix(self.trigger_extension)))
+            if claim_path is None:
+                self.logger.info("Skipping %s: claimed by another node", file.name)
+                continue
+            self.claimed[file] = Path(claim_path)
+            claimed_files.append(file)
+        return claimed_files
+
+    def release_claims(self):
+        """Stop renewing the claims of files left untransferred; they lapse and are retried by any node."""
+        for claim_path in self.claimed.values():
+            self.claims.release(str(claim_path))
+        self.claimed = {}
+
+    def skip_delivered(self, files_to_transfer):
+        """
+        Split the files into those still to transfer and those the journal already records as delivered
+        to this destination. Returns (pending files, delivered files, {file: journal file_id}).
+        """
+        if self.journal is None:
+            return list(files_to_transfer), [], {}
+
+        pending_files, delivered_files, file_ids = [], [], {}
+        for file in files_to_transfer:
+            try:
+                file_ids[file] = self.journal.record_file(file)
+                if self.journal.is_done(file_ids[file], self.destination_key):
+                    self.logger.info("Skipping %s: already delivered to %s", file.name, self.destination_key)
+                    delivered_files.append(file)
+                    continue
+            except Exception as e:
+                self.logger.error(f"Error reading the transfer journal for {file.name}: {str(e)}")
+            pending_files.append(file)
+        return pending_files, delivered_files, file_ids
+
+    def skip_duplicates(self, files_to_transfer, file_ids):
+        """
+        With dedupe configured, split off the files whose content was already delivered to this destination
+        and whose feed drops duplicates: they are recorded as aliases of the earlier file and only need their
+        triggers deleted. Only recorded deliveries count, so two copies within one call are both sent.
+        Returns (files still to transfer, dropped duplicates).
+        """
+        if self.dedupe is None:
+            return list(files_to_transfer), []
+
+        index = self.dedupe.index
+        self.content_keys = {}
+        try:
+            index.evict(self.destination_key, self.dedupe.max_age_days, self.dedupe.max_entries)
+        except Exception as e:
+            self.logger.error(f"Error evicting old entries from the dedupe index: {str(e)}")
+
+        pending_files, duplicates = [], []
+        for file in files_to_transfer:
+            try:
+                key, original = index.find(self.destination_key, file, index.content_key(file))
+                self.content_keys[file] = key
+                if original is not None:
+                    policy = self.dedupe.policy_for(file.name)
+                    index.record_alias(self.destination_key, file, key, original, policy != DROP)
+                    if policy == DROP:
+                        self.logger.info("Skipping %s: same content as %s, already delivered to %s", file.name,
+                                         original, self.destination_key,
+                                         extra={'file': file, 'destination': self.destination_key})
+                        self.journal_state(file_ids, file)
+                        self.record_transfer(file, duplicate=True)
+                        duplicates.append(file)
+                        continue
+                    self.logger.info("Delivering %s although it has the same content as %s", file.name, original,
+                                     extra={'file': file, 'destination': self.destination_key})
+            except Exception as e:
+                self.logger.error(f"Error checking {file.name} against the dedupe index: {str(e)}")
+            pending_files.append(file)
+        return pending_files, duplicates
+
+    def record_delivery(self, file):
+        """Add the content of a delivered file to the dedupe index (when configured)."""
+        key = self.content_keys.pop(file, None)
+        if key is None:
+            return
+        try:
+            self.dedupe.index.record(self.destination_key, file, key)
+        except Exception as e:
+            self.logger.error(f"Error recording {file.name} in the dedupe index: {str(e)}")
+
+    def journal_state(self, file_ids, file, error=None, in_flight=False):
+        """Record the file's state for this destination in the journal (when one is configured)."""
+        if self.journal is None or file not in file_ids:
+            return
+        try:
+            if in_flight:
+                self.journal.mark_in_flight(file_ids[file], self.destination_key)
+            elif error is None:
+                self.journal.mark_done(file_ids[file], self.destination_key)
+            else:
+                self.journal.mark_failed(file_ids[file], self.destination_key, error)
+        except Exception as e:
+            self.logger.error(f"Error updating the transfer journal for {file.name}: {str(e)}")
+
     def find_files_to_transfer(self):
         """Find data files that have corresponding trigger files."""
+        return [file for batch in self.find_file_batches() for file in batch]
+
+    def find_file_batches(self, batch_size=None):
+        """
+        Generate the data files that have a trigger file, in batches of up to batch_size, from a single
+        os.scandir pass that pairs data and trigger files by name as it lists them: the first batch can be
+        transferred while the rest of a large directory is still being listed, and no file is stat'ed.
+        With a watermark_path, a directory unchanged since passes that found nothing is not listed at all.
+        """
+        batch_size = batch_size or self.discovery_batch_size
+        watermark_key = f"{os.path.abspath(self.source_directory)}|{self.file_extension}|{self.trigger_extension}"
         try:
-            files_to_transfer = []
-            files = os.listdir(self.source_directory)
-            # for file in files:
-            #     if file.endswith(self.file_extension):
-            #         trg_file = file.with_suffix(self.trigger_extension)
-            #         if trg_file.exists():
-            #             files_to_transfer.append(file)
-            #         else:
-            #             self.logger.warning(f"Trigger file not found for {file.name}")
-            # return files_to_transfer
-
-            for file in self.source_directory.glob(f"*{self.file_extension}"):
-                trg_file = file.with_suffix(self.trigger_extension)
-                if trg_file.exists():
-                    files_to_transfer.append(file)
+            directory_stat = os.stat(self.source_directory)
+            if self.watermarks is not None and self.watermarks.unchanged(watermark_key, directory_stat):
+                BACKLOG.set(0, pipeline='dispatcher', source=str(self.source_directory))
+                return
+
+            # Stems seen with only their data file or only their trigger file so far
+            data_stems, trigger_stems = set(), set()
+            found = 0
+            with os.scandir(self.source_directory) as entries:
+                while True:
+                    with stage('dispatcher', 'scan', feed=self.source_directory, destination=self.destination_key):
+                        batch = self.pair_entries(entries, data_stems, trigger_stems, batch_size)
+                    if batch:
+                        found += len(batch)
+                        yield batch
+                    if len(batch) < batch_size:
+                        break
+
+            for stem in sorted(data_stems):
+                self.logger.warning(f"Trigger file not found for {stem}{self.file_extension}")
+            BACKLOG.set(found, pipeline='dispatcher', source=str(self.source_directory))
+            if self.watermarks is not None:
+                if found:
+                    self.watermarks.clear(watermark_key)
                 else:
-                    self.logger.warning(f"Trigger file not found for {file.name}")
-            return files_to_transfer
+                    self.watermarks.record_empty(watermark_key, directory_stat)
         except Exception as e:
             self.logger.error(f"Error while finding files to transfer: {str(e)}")
             raise
 
+    def pair_entries(self, entries, data_stems, trigger_stems, limit):
+        """
+        Pull directory entries until limit data files have been paired with their trigger file, or the
+        listing ends. Claims left by dead nodes become triggers again on the way (see utils.file_claims).
+        """
+        paired = []
+        claim_marker = f"{self.trigger_extension}{CLAIM_MARKER}"
+        for entry in entries:
+            name = entry.name
+            if name.startswith('.'):
+                continue
+            if name.endswith(self.file_extension):
+                stem = name[:-len(self.file_extension)]
+                if stem in trigger_stems:
+                    trigger_stems.discard(stem)
+                    paired.append(self.source_directory / name)
+                else:
+                    data_stems.add(stem)
+            else:
+                if name.endswith(self.trigger_extension):
+                    trigger_names = [name]
+                elif self.claims is not None and claim_marker in name:
+                    trigger_names = self.claims.reclaim_expired(str(self.source_directory), [name])
+                else:
+                    continue
+                for trigger_name in trigger_names:
+                    stem = trigger_name[:-len(self.trigger_extension)]
+                    if stem in data_stems:
+                        data_stems.discard(stem)
+                        paired.append(self.source_directory / f"{stem}{self.file_extension}")
+                    else:
+                        trigger_stems.add(stem)
+            if len(paired) >= limit:
+                break
+        return paired
+
     def delete_trigger_files(self, files_to_transfer):
-        """Delete the trigger files corresponding to transferred files."""
+        """Delete the trigger files (or this node's claims on them) corresponding to transferred files."""
         for file in files_to_transfer:
+            trigger_file = self.claimed.get(file) or file.with_suffix(self.trigger_extension)
             try:
-                trigger_file = file.with_suffix(self.trigger_extension)
-                if trigger_file.exists():
+                with stage('dispatcher', 'trigger_delete', feed=self.source_directory,
+                           destination=self.destination_key, file=trigger_file):
                     trigger_file.unlink()
-                    self.logger.info(f"Deleted trigger file: {trigger_file}")
-                else:
-                    self.logger.warning(f"Trigger file {trigger_file} not found for deletion.")
+                self.logger.info("Deleted trigger file: %s", trigger_file)
+            except FileNotFoundError:
+                self.logger.warning(f"Trigger file {trigger_file} not found for deletion.")
             except Exception as e:
                 self.logger.error(f"Failed to delete trigger file for {file.name}: {str(e)}")
                 continue
+
+        # Every dispatch pass ends here
+        self.release_claims()
+        self.complete_pass()
+
+    def complete_pass(self):
+        """Record that a pass over the source directory completed (also when the scheduler had no work for it)."""
+        LAST_RUN.set(time.time(), pipeline='dispatcher', source=str(self.source_directory))
+
+    def record_transfer(self, file, error=None, duplicate=False):
+        """Count the file (and, on success, its bytes) for this source directory and destination."""
+        labels = {'pipeline': 'dispatcher', 'feed': str(self.source_directory), 'destination': self.destination_key}
+        if duplicate:
+            FILES.inc(outcome='duplicate', **labels)
+            return
+        if error is not None:
+            FILES.inc(outcome='failure', **labels)
+            return
+        FILES.inc(outcome='success', **labels)
+        try:
+            BYTES.inc(file.stat().st_size, **labels)
+        except OSError:
+            pass
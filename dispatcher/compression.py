@@ -0,0 +1,132 @@
+import queue
+import shlex
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+# codec -> (remote file extension, remote command writing the decompressed file to stdout, default level)
+CODECS = {
+    'gzip': ('.gz', 'gzip -dc', 6),
+    'zstd': ('.zst', 'zstd -dc', 3),
+    'lz4': ('.lz4', 'lz4 -dc', 0),
+}
+DEFAULT_WORKERS = 4
+# Compressed blocks a worker may run ahead of the upload of its file
+PREFETCH_BLOCKS = 8
+END_OF_STREAM = object()
+
+
+class LZ4Stream:
+    """Gives lz4's frame compressor the compress()/flush() interface of zlib and zstandard."""
+
+    def __init__(self, level):
+        self.compressor = lz4_frame.LZ4FrameCompressor(compression_level=level)
+        self.started = False
+
+    def compress(self, data):
+        if not self.started:
+            self.started = True
+            return self.compressor.begin() + self.compressor.compress(data)
+        return self.compressor.compress(data)
+
+    def flush(self):
+        if not self.started:
+            self.started = True
+            return self.compressor.begin() + self.compressor.flush()
+        return self.compressor.flush()
+
+
+class Compression:
+    """
+    The 'compression' setting of an SFTP directory: files are compressed block by block while they are
+    uploaded, by a pool of worker threads (zlib, zstandard and lz4 release the GIL while compressing).
+    """
+
+    def __init__(self, config):
+        self.codec = config.get('codec', 'gzip')
+        if self.codec not in CODECS:
+            raise ValueError(f"Unknown compression codec: {self.codec}")
+        if self.codec == 'zstd' and zstandard is None:
+            raise ValueError("zstd compression requires the 'zstandard' package")
+        if self.codec == 'lz4' and lz4_frame is None:
+            raise ValueError("lz4 compression requires the 'lz4' package")
+
+        self.extension, self.decompress_command, default_level = CODECS[self.codec]
+        self.level = config.get('level', default_level)
+        self.remote_decompress = config.get('remote_decompress', False)
+        self.executor = ThreadPoolExecutor(max_workers=config.get('workers', DEFAULT_WORKERS),
+                                           thread_name_prefix='compress')
+
+    def compressor(self):
+        if self.codec == 'gzip':
+            # wbits 31: gzip container, with a zero mtime so the output only depends on the input
+            return zlib.compressobj(self.level, zlib.DEFLATED, 31)
+        if self.codec == 'zstd':
+            return zstandard.ZstdCompressor(level=self.level).compressobj()
+        return LZ4Stream(self.level)
+
+    def compressed_blocks(self, local_file, block_size, hasher=None):
+        """
+        Yield the compressed content of local_file. A pool worker reads and compresses the file ahead
+        of the caller through a bounded queue, so compression overlaps with the upload and memory stays
+        at a few blocks per file. The uncompressed bytes are fed to hasher when one is given.
+        """
+        blocks = queue.Queue(maxsize=PREFETCH_BLOCKS)
+        cancelled = threading.Event()
+
+        def put(item):
+            # Give up once the consumer has gone away (e.g. the upload failed)
+            while not cancelled.is_set():
+                try:
+                    blocks.put(item, timeout=1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def produce():
+            try:
+                compressor = self.compressor()
+                with open(local_file, 'rb') as src:
+                    while True:
+                        data = src.read(block_size)
+                        if not data:
+                            break
+                        if hasher is not None:
+                            hasher.update(data)
+                        block = compressor.compress(data)
+                        if block and not put(block):
+                            return
+                if put(compressor.flush()):
+                    put(END_OF_STREAM)
+            except Exception as e:
+                put(e)
+
+        self.executor.submit(produce)
+        try:
+            while True:
+                item = blocks.get()
+                if item is END_OF_STREAM:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                if item:
+                    yield item
+        finally:
+            cancelled.set()
+
+    def remote_decompress_script(self, compressed_path, partial_path, remote_path):
+        """Shell command decompressing the uploaded file on the server and renaming it into place."""
+        partial_path = shlex.quote(partial_path)
+        return (f"{self.decompress_command} {shlex.quote(compressed_path)} > {partial_path} && "
+                f"mv -f {partial_path} {shlex.quote(remote_path)} && rm -f {shlex.quote(compressed_path)}")
@@ -1,8 +1,46 @@
+import sys
+
 from .shared_drive_dispatcher import SharedDriveDispatcher
-from .sftp_dispatcher import SFTPDispatcher
 from utils.server_config_loader import ServerConfigLoader
 import logging
 
+DESTINATION_TYPES = ('shared_drive', 'external_server')
+REQUIRED_DIRECTORY_KEYS = ('source_directory', 'destination_type', 'destination_details',
+                           'file_extension', 'trigger_extension', 'enabled')
+
+
+def compile_dispatcher_plan(config, validate=True):
+    """
+    Validate a dispatcher config: every directory needs the keys the dispatchers rely on and a known
+    destination type. Cached by utils.config_loader (validate=False for a config it already validated);
+    returns the config itself.
+
+    :raises ValueError: Listing every problem found.
+    """
+    if not validate:
+        return config
+    if not isinstance(config, dict) or not isinstance(config.get('directories'), list):
+        raise ValueError("Invalid dispatcher configuration: a 'directories' list is required")
+
+    problems = []
+    for index, directory_config in enumerate(config['directories']):
+        where = f"directories[{index}] {directory_config.get('source_directory', '')}".rstrip()
+        missing = [key for key in REQUIRED_DIRECTORY_KEYS if key not in directory_config]
+        if missing:
+            problems.append(f"{where}: missing {', '.join(missing)}")
+        elif directory_config['destination_type'] not in DESTINATION_TYPES:
+            problems.append(f"{where}: unknown destination type {directory_config['destination_type']}")
+        elif directory_config['destination_type'] == 'shared_drive' \
+                and 'shared_drive_path' not in directory_config['destination_details']:
+            problems.append(f"{where}: missing destination_details.shared_drive_path")
+        elif directory_config['destination_type'] == 'external_server' \
+                and 'server_name' not in directory_config['destination_details']:
+            problems.append(f"{where}: missing destination_details.server_name")
+
+    if problems:
+        raise ValueError("Invalid dispatcher configuration:\n  - " + "\n  - ".join(problems))
+    return config
+
 
 class DispatcherFactory:
     @staticmethod
@@ -22,8 +60,11 @@ class DispatcherFactory:
             if directory_config['destination_type'] == 'shared_drive':
                 return SharedDriveDispatcher(directory_config, environment)
             elif directory_config['destination_type'] == 'external_server':
-                server_config = ServerConfigLoader.get_server_info()  # Load external server details
-                return SFTPDispatcher(directory_config, environment), server_config
+                # Imported here so runs with only shared-drive directories never load paramiko
+                from .sftp_dispatcher import SFTPDispatcher
+                # Load external server details
+                server_config = ServerConfigLoader.get_server_info(directory_config['destination_details'], environment)
+                return SFTPDispatcher(directory_config, environment, server_config)
             else:
                 raise ValueError("Unknown destination type: {}".format(directory_config['destination_type']))
 
@@ -31,3 +72,10 @@ class DispatcherFactory:
             raise ValueError(f"Missing configuration key: {str(e)}")
         except Exception as e:
             raise RuntimeError(f"Error in DispatcherFactory: {str(e)}")
+
+    @staticmethod
+    def close_connections():
+        """Close the pooled SFTP sessions, if any SFTP dispatcher was created."""
+        sftp_pool = sys.modules.get(f"{__package__}.sftp_pool")
+        if sftp_pool is not None:
+            sftp_pool.connection_pool.close_all()
@@ -1,40 +1,104 @@
 # dispatcher/main.py
 
-import yaml
-import logging
-import sys
-from dispatcher.dispatcher_factory import DispatcherFactory
+import argparse
+import os
+
+from dispatcher.async_engine import AsyncDispatchEngine
+from dispatcher.dispatcher_factory import DispatcherFactory, compile_dispatcher_plan
+from utils.config_loader import load_config
 from utils.logger import setup_logging
+from utils.metrics import write_metrics
+from utils.transfer_scheduler import TransferScheduler
+from utils.tracing import add_profile_arguments, profiling
 
+METRICS_INTERVAL_SECONDS = 15
+# Top-level settings every directory inherits unless it sets its own
+RUN_WIDE_SETTINGS = ('journal_path', 'claims', 'dedupe', 'watermark_path', 'publish')
 
-def main():
-    if len(sys.argv) < 2:
-        print("Usage: python main.py <ENVIRONMENT>")
-        sys.exit(1)
 
-    environment = sys.argv[1]  # Fetch the environment parameter (DEV, ST, UAT, PROD)
+def parse_args():
+    parser = argparse.ArgumentParser(description="Dispatch staged feed files to the shared drive and external servers.")
+    parser.add_argument('environment', help="Environment to run against (DEV, ST, UAT, PROD)")
+    parser.add_argument('--watch', action='store_true',
+                        help="Keep running and dispatch each file as soon as its trigger lands (Linux inotify)")
+    parser.add_argument('--rescan-interval', type=float, default=300,
+                        help="Seconds between fallback full rescans in watch mode (default: 300)")
+    add_profile_arguments(parser)
+    return parser.parse_args()
+
+
+def build_dispatchers(config, environment):
+    """
+    Create the dispatcher of every enabled directory, sharing per-destination limits through one
+    TransferScheduler. Returns (dispatchers, scheduler).
+    """
+    # Orders the work of all directories by feed priority / deadline and shares the per-destination limits
+    scheduler = TransferScheduler.from_config(config.get('scheduler'))
+
+    dispatchers = []
+    for directory_config in config['directories']:
+        for key in RUN_WIDE_SETTINGS:
+            if config.get(key):
+                directory_config.setdefault(key, config[key])
+        dispatcher = DispatcherFactory.get_dispatcher(directory_config, environment)
+        if dispatcher:
+            dispatcher.limits = scheduler.destination_limits(dispatcher.destination_key, directory_config)
+            dispatchers.append(dispatcher)
+    return dispatchers, scheduler
+
+
+def main():
+    args = parse_args()
+    environment = args.environment  # Fetch the environment parameter (DEV, ST, UAT, PROD)
     setup_logging('config/dispatcher_logging.yaml')
 
-    # Load dispatcher config
+    # Load dispatcher config, validated once and cached while the YAML is unchanged
     try:
-        with open('config/dispatcher_config.yaml', 'r') as file:
-            config = yaml.safe_load(file)
+        config = load_config('config/dispatcher_config.yaml', compile_dispatcher_plan)
     except FileNotFoundError as e:
         raise RuntimeError("Dispatcher Configuration file not found : {}".format(str(e)))
-    except yaml.YAMLError as e:
-        raise RuntimeError("Error parsing YAML file : {}".format(str(e)))
+    except ValueError as e:
+        raise RuntimeError("Invalid Dispatcher configuration : {}".format(str(e)))
     except Exception as e:
         raise RuntimeError("Unknown error loading Dispatcher configuration : {}".format(str(e)))
 
-    directories = config['directories']
+    with profiling(args, 'dispatcher_logger'):
+        dispatchers, scheduler = build_dispatchers(config, environment)
+        # All directories are dispatched concurrently, each pass taking about as long as the slowest one
+        engine = AsyncDispatchEngine(dispatchers, scheduler)
+        metrics_textfile = config.get('metrics_textfile')
 
-    for directory_config in directories:
-        dispatcher = DispatcherFactory.get_dispatcher(directory_config, environment)
-        if dispatcher:
+        def on_rescan():
+            engine.run_pass()
+            if metrics_textfile:
+                write_metrics(metrics_textfile)
+
+        if not args.watch:
             try:
-                dispatcher.dispatch()
-            except Exception as e:
-                logging.getLogger('dispatcher_logger').error(f"Error in processing: {e}")
+                on_rescan()
+            finally:
+                engine.close()
+                DispatcherFactory.close_connections()
+            return
+
+        dispatchers_by_directory = {}
+        for dispatcher in dispatchers:
+            dispatchers_by_directory.setdefault(os.path.abspath(dispatcher.source_directory), []).append(dispatcher)
+
+        def on_trigger(directory, trigger_name):
+            for dispatcher in dispatchers_by_directory.get(directory, []):
+                if trigger_name.endswith(dispatcher.trigger_extension):
+                    dispatcher.dispatch_trigger(trigger_name)
+            if metrics_textfile:
+                write_metrics(metrics_textfile, METRICS_INTERVAL_SECONDS)
+
+        from utils.trigger_watcher import run_watch_loop
+        trigger_extensions = {dispatcher.source_directory: dispatcher.trigger_extension for dispatcher in dispatchers}
+        try:
+            run_watch_loop(trigger_extensions, on_trigger, on_rescan, args.rescan_interval, 'dispatcher_logger')
+        finally:
+            engine.close()
+            DispatcherFactory.close_connections()
 
 
 if __name__ == "__main__":
@@ -1,33 +1,93 @@
 import logging
 
 from .base_dispatcher import BaseDispatcher
-from sftp_helper import SFTPHelper
+from .compression import Compression
+from .sftp_helper import SFTPHelper
+
+DEFAULT_RETRY_ATTEMPTS = 3
+DEFAULT_RETRY_BACKOFF_SECONDS = 5
 
 
 class SFTPDispatcher(BaseDispatcher):
-    def __init__(self, config, environment):
-        self.config = config
-        self.environment = environment
+    def __init__(self, config, environment, server_config):
+        super().__init__(config, environment)
+        self.server_config = server_config
+        self.retry_attempts = config.get('retry_attempts', DEFAULT_RETRY_ATTEMPTS)
+        self.retry_backoff_seconds = config.get('retry_backoff_seconds', DEFAULT_RETRY_BACKOFF_SECONDS)
+        # Optional on-the-fly compression of the uploads (gzip, zstd or lz4)
+        self.compression = Compression(config['compression']) if config.get('compression') else None
+        destination_details = config['destination_details']
+        self.destination_key = f"sftp://{destination_details.get('server_name')}{destination_details['destination_path']}"
         self.logger = logging.getLogger('dispatcher_logger')
 
-    def dispatch(self, destination_details, server_config):
+    def dispatch(self, files_to_transfer=None):
         """Transfer files to an external server via SFTP."""
         try:
-            destination_path = destination_details['destination_path']
-            files_to_transfer = self.find_files_to_transfer()
-
-            with SFTPHelper(server_config) as sftp:
-                for file in files_to_transfer:
-                    try:
-                        sftp.upload_file(file, destination_path)
-                        self.logger.info(f"Transferred {file.name} to external server at {destination_path}")
-                    except Exception as e:
-                        self.logger.error(f"Failed to transfer {file.name} to {destination_path}: {str(e)}")
-                        continue  # Skip to next file
+            destination_path = self.config['destination_details']['destination_path']
+            if files_to_transfer is None:
+                files_to_transfer = self.find_files_to_transfer()
+            files_to_transfer = self.claim_files(files_to_transfer)
+
+            # Files the journal records as delivered only need their triggers deleted
+            pending_files, transferred_files, file_ids = self.skip_delivered(files_to_transfer)
+            # So do files whose content was already delivered, when their feed drops duplicates
+            pending_files, duplicates = self.skip_duplicates(pending_files, file_ids)
+            transferred_files.extend(duplicates)
+            for file in pending_files:
+                self.journal_state(file_ids, file, in_flight=True)
+
+            for attempt in range(1, self.retry_attempts + 1):
+                failures = self.upload(pending_files, destination_path)
+
+                for file in pending_files:
+                    if file not in failures:
+                        self.journal_state(file_ids, file)
+                        self.record_transfer(file)
+                        self.record_delivery(file)
+                        transferred_files.append(file)
+                        self.logger.info("Transferred %s to external server at %s", file.name, destination_path,
+                                         extra={'file': file, 'destination': self.destination_key})
+
+                pending_files = [file for file in pending_files if file in failures]
+                if not pending_files:
+                    break
+                if self.cancelled.is_set():
+                    # Interrupted uploads keep their '.part' and are resumed on the next pass
+                    self.logger.warning(f"Dispatch of {self.source_directory} cancelled: leaving "
+                                        f"{len(pending_files)} files for the next pass")
+                    break
+
+                if attempt == self.retry_attempts:
+                    for file in pending_files:
+                        self.journal_state(file_ids, file, error=failures[file])
+                        self.record_transfer(file, failures[file])
+                        self.logger.error(f"Failed to transfer {file.name} to {destination_path} after "
+                                          f"{attempt} attempts: {str(failures[file])}")
+                    break
+
+                # Partial uploads are resumed on the next attempt
+                delay = self.retry_backoff_seconds * 2 ** (attempt - 1)
+                self.logger.warning(f"Retrying {len(pending_files)} failed transfers to {destination_path} "
+                                    f"in {delay}s (attempt {attempt + 1} of {self.retry_attempts})")
+                self.cancelled.wait(delay)
 
             # Delete corresponding trigger files after successful transfer
-            self.delete_trigger_files(files_to_transfer)
+            self.delete_trigger_files(transferred_files)
 
         except Exception as e:
+            self.release_claims()
             self.logger.error(f"Error in SFTPDispatcher: {str(e)}")
             raise
+
+    def upload(self, files, destination_path):
+        """Upload the files in parallel over the server's pooled connection, returning the failures."""
+        server_name = self.config['destination_details'].get('server_name')
+        try:
+            with SFTPHelper(self.server_config, server_name, compression=self.compression,
+                            checksum=self.checksum, checksum_sidecar=self.checksum_sidecar,
+                            limits=self.limits, check_cancelled=self.check_cancelled,
+                            stage_labels={'feed': self.source_directory, 'destination': self.destination_key}) as sftp:
+                return sftp.upload_files(files, destination_path)
+        except Exception as e:
+            # Could not connect: every file failed this attempt
+            return {file: e for file in files}
@@ -1,40 +1,56 @@
-import paramiko
+import hashlib
+import os
+import shlex
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.checksum import new_hasher, sidecar_content, sidecar_path
 from utils.logger import get_logger
+from utils.tracing import stage
+from utils.transfer_scheduler import DestinationLimits
+from .base_dispatcher import DispatchCancelled
+from .sftp_pool import connection_pool
+
+DEFAULT_BLOCK_SIZE = 256 * 1024
+PARTIAL_SUFFIX = '.part'
+# Algorithms the SFTP 'check-file' extension can compute on the server
+REMOTE_CHECK_ALGORITHMS = ('md5', 'sha1', 'sha224', 'sha256', 'sha384', 'sha512')
+
 
 class SFTPHelper:
-    def __init__(self, server_config):
-        self.hostname = server_config['hostname']
-        self.username = server_config['username']
-        self.ssh_key_path = server_config['ssh_key_path']
-        self.port = server_config.get('port', 22)
-        self.sftp = None
+    def __init__(self, server_config, server_name=None, pool=connection_pool, compression=None,
+                 checksum=None, checksum_sidecar=False, limits=None, check_cancelled=None, stage_labels=None):
+        self.server_config = server_config
+        self.hostname = server_config.get('hostname', server_config.get('host'))
+        self.server_name = server_name or self.hostname
+        self.block_size = server_config.get('block_size', DEFAULT_BLOCK_SIZE)
+        self.pool = pool
+        self.compression = compression
+        self.checksum = checksum
+        self.checksum_sidecar = checksum_sidecar
+        self.limits = limits or DestinationLimits()
+        # Called before every file and block; raises to abandon the upload (its '.part' is resumed later)
+        self.check_cancelled = check_cancelled or (lambda: None)
+        # The feed and destination the connect and upload stages are timed under (see utils.tracing.stage)
+        self.stage_labels = stage_labels or {}
+        self.connection = None
         self.logger = get_logger('dispatcher_logger')
 
     def __enter__(self):
-        try:
-            self.client = paramiko.SSHClient()
-            self.client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            self.client.connect(
-                hostname=self.hostname,
-                username=self.username,
-                key_filename=self.ssh_key_path,
-                port=self.port
-            )
-            self.sftp = self.client.open_sftp()
-            return self
-        except paramiko.AuthenticationException as e:
-            self.logger.error(f"Authentication failed while connecting to {self.hostname}: {str(e)}")
-            raise
-        except paramiko.SSHException as e:
-            self.logger.error(f"Error establishing SSH connection to {self.hostname}: {str(e)}")
-            raise
-        except Exception as e:
-            self.logger.error(f"Unknown error connecting to {self.hostname}: {str(e)}")
-            raise
+        # Connection errors are logged by the pool; the session stays open for later directories
+        with stage('dispatcher', 'sftp_connect', server=self.server_name, **self.stage_labels):
+            self.connection = self.pool.get_connection(self.server_name, self.server_config)
+        return self
 
     def upload_file(self, local_file, remote_path):
         try:
-            self.sftp.put(local_file.as_posix(), remote_path)
+            with self.limits.slot(), self.connection.channel() as sftp, \
+                    stage('dispatcher', 'sftp_upload', file=local_file, remote_path=remote_path, **self.stage_labels):
+                if self.compression is None:
+                    self.put(sftp, local_file, remote_path)
+                else:
+                    self.put_compressed(sftp, local_file, remote_path)
+        except DispatchCancelled:
+            raise
         except FileNotFoundError as e:
             self.logger.error(f"File not found: {str(e)}")
             raise
@@ -42,8 +58,209 @@ class SFTPHelper:
             self.logger.error(f"Error uploading file {local_file} to {remote_path}: {str(e)}")
             raise
 
+    def upload_files(self, local_files, remote_directory):
+        """
+        Upload files in parallel, one per SFTP channel of the pooled connection.
+
+        :return: Dictionary of local file -> exception for the files that failed.
+        """
+        def upload(local_file):
+            self.check_cancelled()
+            self.upload_file(local_file, f"{remote_directory}/{local_file.name}")
+
+        failures = {}
+        with ThreadPoolExecutor(max_workers=self.connection.max_channels) as executor:
+            futures = {local_file: executor.submit(upload, local_file) for local_file in local_files}
+            for local_file, future in futures.items():
+                exception = future.exception()
+                if exception is not None:
+                    failures[local_file] = exception
+        return failures
+
+    def put(self, sftp, local_file, remote_path):
+        """
+        Upload to a temporary '.part' name and rename it into place once complete, so the receiving side
+        never sees a truncated file. A '.part' left by an interrupted upload is resumed from its size once
+        the already-sent prefix has been verified.
+        """
+        partial_path = remote_path + PARTIAL_SUFFIX
+        size = os.path.getsize(local_file)
+        offset = self.resume_offset(sftp, local_file, partial_path, size)
+        hasher = new_hasher(self.checksum) if self.checksum else None
+
+        with open(local_file, 'rb') as src, sftp.open(partial_path, 'r+' if offset else 'w') as remote:
+            if hasher is not None and offset:
+                # The resumed prefix is not sent again but still belongs in the checksum
+                self.hash_prefix(src, hasher, offset)
+            src.seek(offset)
+            remote.seek(offset)
+            # Pipelined writes: no round trip per block
+            remote.set_pipelined(True)
+            while True:
+                block = src.read(self.block_size)
+                if not block:
+                    break
+                self.check_cancelled()
+                if hasher is not None:
+                    hasher.update(block)
+                self.limits.throttle(len(block))
+                remote.write(block)
+
+        remote_size = sftp.stat(partial_path).st_size
+        if remote_size != size:
+            raise IOError(f"Size mismatch after upload of {local_file}: local {size}, remote {remote_size}")
+        self.verify_remote_checksum(sftp, partial_path, hasher)
+
+        self.rename_into_place(sftp, partial_path, remote_path)
+        self.upload_sidecar(sftp, remote_path, hasher)
+
+    def put_compressed(self, sftp, local_file, remote_path):
+        """
+        Upload the file compressed on the fly as '<remote path><codec extension>', through the same
+        '.part' + rename as put(). Compressed uploads are not resumed: an interrupted one starts again.
+        With remote_decompress the server then decompresses it to remote_path itself.
+        """
+        compressed_path = remote_path + self.compression.extension
+        partial_path = compressed_path + PARTIAL_SUFFIX
+        size = os.path.getsize(local_file)
+        written = 0
+        hasher = new_hasher(self.checksum) if self.checksum else None
+        # The checksum describes the file as it finally lands: decompressed, or the compressed upload
+        raw_hasher = hasher if self.compression.remote_decompress else None
+        compressed_hasher = None if self.compression.remote_decompress else hasher
+
+        with sftp.open(partial_path, 'w') as remote:
+            remote.set_pipelined(True)
+            for block in self.compression.compressed_blocks(local_file, self.block_size, raw_hasher):
+                self.check_cancelled()
+                if compressed_hasher is not None:
+                    compressed_hasher.update(block)
+                self.limits.throttle(len(block))
+                remote.write(block)
+                written += len(block)
+
+        remote_size = sftp.stat(partial_path).st_size
+        if remote_size != written:
+            raise IOError(f"Size mismatch after upload of {local_file}: sent {written}, remote {remote_size}")
+        self.verify_remote_checksum(sftp, partial_path, compressed_hasher)
+
+        self.rename_into_place(sftp, partial_path, compressed_path)
+        self.logger.debug("Uploaded %s as %s: %s -> %s bytes", local_file, compressed_path, size, written)
+
+        if not self.compression.remote_decompress:
+            self.upload_sidecar(sftp, compressed_path, hasher)
+            return
+
+        self.connection.run(self.compression.remote_decompress_script(
+            compressed_path, remote_path + PARTIAL_SUFFIX, remote_path))
+        remote_size = sftp.stat(remote_path).st_size
+        if remote_size != size:
+            raise IOError(f"Size mismatch after remote decompression of {local_file}: "
+                          f"local {size}, remote {remote_size}")
+        self.upload_sidecar(sftp, remote_path, hasher)
+
+    def hash_prefix(self, src, hasher, length):
+        remaining = length
+        while remaining:
+            block = src.read(min(self.block_size, remaining))
+            if not block:
+                break
+            hasher.update(block)
+            remaining -= len(block)
+
+    def verify_remote_checksum(self, sftp, partial_path, hasher):
+        """
+        Compare the checksum computed while uploading with one the server computes through the
+        'check-file' extension. Servers without the extension (or algorithms it does not offer) are
+        only checked by size.
+        """
+        if hasher is None or self.checksum not in REMOTE_CHECK_ALGORITHMS:
+            return
+        try:
+            with sftp.open(partial_path, 'r') as remote:
+                remote_digest = remote.check(self.checksum)
+        except IOError:
+            return
+
+        if remote_digest != hasher.digest():
+            try:
+                sftp.remove(partial_path)
+            except IOError:
+                pass
+            raise IOError(f"{self.checksum} mismatch after upload to {partial_path}")
+
+    def upload_sidecar(self, sftp, remote_path, hasher):
+        """Write the '<remote file>.<algorithm>' sidecar next to an uploaded file, when configured."""
+        if hasher is None:
+            return
+        digest = hasher.hexdigest()
+        self.logger.info("%s of %s: %s", self.checksum, remote_path, digest,
+                         extra={'file': remote_path, self.checksum: digest})
+        if not self.checksum_sidecar:
+            return
+
+        path = sidecar_path(remote_path, self.checksum)
+        with sftp.open(path + PARTIAL_SUFFIX, 'w') as remote:
+            remote.write(sidecar_content(remote_path, digest))
+        self.rename_into_place(sftp, path + PARTIAL_SUFFIX, path)
+
+    def rename_into_place(self, sftp, partial_path, remote_path):
+        try:
+            sftp.posix_rename(partial_path, remote_path)
+        except IOError:
+            # Server without the posix-rename extension: plain SFTP rename refuses to overwrite
+            try:
+                sftp.remove(remote_path)
+            except IOError:
+                pass
+            sftp.rename(partial_path, remote_path)
+
+    def resume_offset(self, sftp, local_file, partial_path, size):
+        """Return the offset to resume an earlier partial upload from, or 0 to start again."""
+        try:
+            partial_size = sftp.stat(partial_path).st_size
+        except IOError:
+            return 0
+
+        if partial_size == 0 or partial_size > size:
+            return 0
+
+        if not self.prefix_matches(sftp, local_file, partial_path, partial_size):
+            self.logger.warning(f"Partial upload {partial_path} does not match {local_file}, restarting from byte 0")
+            return 0
+
+        self.logger.info("Resuming upload of %s at byte %s of %s", local_file, partial_size, size)
+        return partial_size
+
+    def prefix_matches(self, sftp, local_file, partial_path, length):
+        """
+        Check the remote partial file against the first length bytes of the local file by comparing sha256
+        digests, so the prefix is only read on each side. The server computes its digest through the
+        'check-file' extension or, without it, with 'head -c | sha256sum' over the connection's exec
+        channel. A server offering neither cannot verify the prefix, so the upload starts again.
+        """
+        try:
+            with sftp.open(partial_path, 'r') as remote:
+                remote_digest = remote.check('sha256', 0, length)
+        except IOError:
+            remote_digest = self.remote_prefix_digest(partial_path, length)
+            if remote_digest is None:
+                return False
+
+        digest = hashlib.sha256()
+        with open(local_file, 'rb') as src:
+            self.hash_prefix(src, digest, length)
+        return digest.digest() == remote_digest
+
+    def remote_prefix_digest(self, partial_path, length):
+        """The sha256 of the first length bytes of a remote file, computed by the server, or None."""
+        try:
+            output = self.connection.run(f"head -c {int(length)} {shlex.quote(partial_path)} | sha256sum")
+            return bytes.fromhex(output.split()[0])
+        except Exception as e:
+            self.logger.warning(f"Unable to hash {partial_path} on {self.server_name}: {str(e)}")
+            return None
+
     def __exit__(self, exc_type, exc_value, traceback):
-        if self.sftp:
-            self.sftp.close()
-        if self.client:
-            self.client.close()
+        # Sessions are owned by the pool and reused by every directory going to the same server
+        self.connection = None
@@ -0,0 +1,137 @@
+import queue
+import threading
+from contextlib import contextmanager
+
+import paramiko
+from utils.logger import get_logger
+
+DEFAULT_MAX_CHANNELS = 4
+DEFAULT_WINDOW_SIZE = 64 * 1024 * 1024
+DEFAULT_MAX_PACKET_SIZE = 32 * 1024
+DEFAULT_KEEPALIVE_SECONDS = 30
+
+
+class SFTPServerConnection:
+    """
+    One SSH connection to a server carrying several SFTP channels.
+
+    Worker threads check a channel out with channel() so several files can be uploaded in parallel
+    over the same (already authenticated) transport.
+    """
+
+    def __init__(self, server_config):
+        self.hostname = server_config.get('hostname', server_config.get('host'))
+        self.username = server_config['username']
+        self.ssh_key_path = server_config.get('ssh_key_path')
+        self.passphrase = server_config.get('passphrase')
+        self.password = server_config.get('password')
+        self.port = server_config.get('port', 22)
+        self.max_channels = server_config.get('max_channels', DEFAULT_MAX_CHANNELS)
+        self.window_size = server_config.get('window_size', DEFAULT_WINDOW_SIZE)
+        self.max_packet_size = server_config.get('max_packet_size', DEFAULT_MAX_PACKET_SIZE)
+        self.keepalive = server_config.get('keepalive_seconds', DEFAULT_KEEPALIVE_SECONDS)
+        self.client = None
+        self.channels = queue.Queue()
+        self.logger = get_logger('dispatcher_logger')
+
+    def connect(self):
+        try:
+            self.client = paramiko.SSHClient()
+            self.client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+            self.client.connect(
+                hostname=self.hostname,
+                username=self.username,
+                key_filename=self.ssh_key_path,
+                passphrase=self.passphrase,
+                password=self.password,
+                port=self.port
+            )
+            transport = self.client.get_transport()
+            transport.set_keepalive(self.keepalive)
+
+            for _ in range(self.max_channels):
+                self.channels.put(paramiko.SFTPClient.from_transport(
+                    transport, window_size=self.window_size, max_packet_size=self.max_packet_size))
+
+            self.logger.info(f"Opened SSH connection to {self.hostname}:{self.port} with "
+                             f"{self.max_channels} SFTP channels")
+        except paramiko.AuthenticationException as e:
+            self.logger.error(f"Authentication failed while connecting to {self.hostname}: {str(e)}")
+            self.close()
+            raise
+        except paramiko.SSHException as e:
+            self.logger.error(f"Error establishing SSH connection to {self.hostname}: {str(e)}")
+            self.close()
+            raise
+        except Exception as e:
+            self.logger.error(f"Unknown error connecting to {self.hostname}: {str(e)}")
+            self.close()
+            raise
+
+    def is_active(self):
+        transport = self.client.get_transport() if self.client else None
+        return transport is not None and transport.is_active()
+
+    def run(self, command):
+        """
+        Run a shell command on the server over the SSH connection and return its output, raising
+        IOError when it fails.
+        """
+        _, stdout, stderr = self.client.exec_command(command)
+        output = stdout.read().decode(errors='replace')
+        exit_status = stdout.channel.recv_exit_status()
+        if exit_status != 0:
+            error = stderr.read().decode(errors='replace').strip()
+            raise IOError(f"Remote command exited with status {exit_status}: {command}: {error}")
+        return output
+
+    @contextmanager
+    def channel(self):
+        """Check an SFTP channel out for the duration of the block."""
+        sftp = self.channels.get()
+        try:
+            yield sftp
+        finally:
+            self.channels.put(sftp)
+
+    def close(self):
+        while not self.channels.empty():
+            self.channels.get_nowait().close()
+        if self.client:
+            self.client.close()
+            self.client = None
+
+
+class SFTPConnectionPool:
+    """Keeps one SFTPServerConnection per server entry so every directory going to a host reuses it."""
+
+    def __init__(self):
+        self.connections = {}
+        self.lock = threading.Lock()
+        self.logger = get_logger('dispatcher_logger')
+
+    def get_connection(self, server_name, server_config):
+        """Return the live connection for the server, (re)connecting when there is none."""
+        with self.lock:
+            connection = self.connections.get(server_name)
+            if connection is not None and connection.is_active():
+                return connection
+
+            if connection is not None:
+                self.logger.warning(f"SFTP connection to {server_name} was lost, reconnecting")
+                connection.close()
+
+            connection = SFTPServerConnection(server_config)
+            connection.connect()
+            self.connections[server_name] = connection
+            return connection
+
+    def close_all(self):
+        with self.lock:
+            for connection in self.connections.values():
+                connection.close()
+            self.connections.clear()
+
+
+# Shared by all SFTP dispatchers of a run (or of a long-running watch process)
+connection_pool = SFTPConnectionPool()
@@ -1,39 +1,117 @@
 from .base_dispatcher import BaseDispatcher
 from pathlib import Path
-import shutil
 import logging
+from utils.checksum import new_hasher, write_sidecar
+from utils.atomic_publish import discard, temp_path
+from utils.copy_strategies import CopyStrategy, default_copy_strategy
+from utils.file_utils import copy_file, hash_file, parallel_copy, PARALLEL_COPY_CHUNK_SIZE, PARALLEL_COPY_WORKERS
+from utils.tracing import stage
 
 
 class SharedDriveDispatcher(BaseDispatcher):
     def __init__(self, config, environment):
-        self.config = config
-        self.environment = environment
+        super().__init__(config, environment)
         self.logger = logging.getLogger('dispatcher_logger')
+        self.destination_key = config['destination_details']['shared_drive_path']
+        # Reflink / copy_file_range / hardlink choice for this directory (the default when not set)
+        self.copy_strategy = CopyStrategy(config['copy_strategies']) if config.get('copy_strategies') else None
+        # Optional large-file mode: files of at least 'threshold' bytes are copied as parallel ranges
+        large_files = config.get('large_files') or {}
+        self.large_file_threshold = large_files.get('threshold')
+        self.large_file_workers = large_files.get('workers', PARALLEL_COPY_WORKERS)
+        self.large_file_chunk_size = large_files.get('chunk_size', PARALLEL_COPY_CHUNK_SIZE)
 
-    def dispatch(self, destination_details):
+    def dispatch(self, files_to_transfer=None):
         """Transfer files to a shared drive."""
-        source_directory = self.config['source_directory']
         destination_details = self.config['destination_details']
-        file_extension = self.config['file_extension']
-        trigger_extension = self.config['trigger_extension']
 
         try:
             destination_path = Path(destination_details['shared_drive_path'])
             destination_path.mkdir(parents=True, exist_ok=True)
 
-            files_to_transfer = self.find_files_to_transfer()
+            if files_to_transfer is None:
+                files_to_transfer = self.find_files_to_transfer()
+            files_to_transfer = self.claim_files(files_to_transfer)
+
+            # Files the journal records as delivered only need their triggers deleted
+            files_to_transfer, transferred_files, file_ids = self.skip_delivered(files_to_transfer)
+            # So do files whose content was already delivered, when their feed drops duplicates
+            files_to_transfer, duplicates = self.skip_duplicates(files_to_transfer, file_ids)
+            transferred_files.extend(duplicates)
+
+            # (file, Future of its publication) of the files written in this call
+            published = []
             for file in files_to_transfer:
+                if self.cancelled.is_set():
+                    self.logger.warning(f"Dispatch of {self.source_directory} cancelled: leaving the remaining "
+                                        f"files for the next pass")
+                    break
                 dest_file = destination_path / file.name
                 try:
-                    shutil.copy2(file, dest_file)
-                    self.logger.info(f"Transferred {file.name} to shared drive at {destination_path}")
+                    self.journal_state(file_ids, file, in_flight=True)
+                    hasher = new_hasher(self.checksum) if self.checksum else None
+                    size = file.stat().st_size
+                    with self.limits.slot(), stage('dispatcher', 'copy', feed=self.source_directory,
+                                                   destination=self.destination_key, file=file, target=dest_file):
+                        self.limits.throttle(size)
+                        if self.large_file_threshold and size >= self.large_file_threshold:
+                            future = self.copy_large_file(file, dest_file, hasher)
+                        else:
+                            future = copy_file(file, dest_file, hasher, self.copy_strategy, self.publisher)
+                    if hasher is not None:
+                        self.logger.info("%s of %s: %s", self.checksum, dest_file, hasher.hexdigest(),
+                                         extra={'file': dest_file, self.checksum: hasher.hexdigest()})
+                        if self.checksum_sidecar:
+                            future = write_sidecar(dest_file, hasher.hexdigest(), self.checksum, self.publisher,
+                                                   future)
+                    published.append((file, future))
                 except Exception as e:
+                    self.journal_state(file_ids, file, error=e)
+                    self.record_transfer(file, e)
                     self.logger.error(f"Failed to transfer {file.name} to {destination_path}: {str(e)}")
                     continue  # Skip to next file
 
+            # The copies are group-committed: a file only counts as transferred once it is durably in place
+            failed = self.publisher.wait([future for _, future in published])
+            for file, future in published:
+                if future in failed:
+                    self.journal_state(file_ids, file, error=failed[future])
+                    self.record_transfer(file, failed[future])
+                    self.logger.error(f"Failed to publish {file.name} to {destination_path}: {str(failed[future])}")
+                    continue
+                self.journal_state(file_ids, file)
+                self.record_transfer(file)
+                self.record_delivery(file)
+                transferred_files.append(file)
+                self.logger.info("Transferred %s to shared drive at %s", file.name, destination_path,
+                                 extra={'file': file, 'destination': destination_path / file.name})
+
             # Delete corresponding trigger files after successful transfer
-            self.delete_trigger_files(files_to_transfer)
+            self.delete_trigger_files(transferred_files)
 
         except Exception as e:
+            self.release_claims()
             self.logger.error(f"Error in SharedDriveDispatcher: {str(e)}")
             raise
+
+    def copy_large_file(self, file, dest_file, hasher=None):
+        """
+        Copies a file above the large-file threshold. A kernel-side strategy (reflink, copy_file_range)
+        still wins when it works; otherwise the file is copied as parallel pread/pwrite ranges.
+        Returns the Future of its publication.
+        """
+        strategy = self.copy_strategy or default_copy_strategy
+        tmp = temp_path(dest_file)
+        try:
+            used = strategy.clone(str(file), tmp)
+        except Exception:
+            discard(tmp)
+            raise
+        if used is not None:
+            if hasher is not None:
+                hash_file(file, hasher)
+            return self.publisher.publish(tmp, dest_file)
+
+        self.logger.info(f"Copying {file.name} ({file.stat().st_size} bytes) as parallel ranges")
+        return parallel_copy(file, dest_file, self.large_file_workers, self.large_file_chunk_size, hasher,
+                             self.publisher)
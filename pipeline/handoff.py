@@ -0,0 +1,90 @@
+import os
+import queue
+import threading
+from pathlib import Path
+
+from utils.logger import get_logger
+
+# Most files one dispatch call takes from a queue, so an SFTP batch stays a sensible size
+DEFAULT_BATCH_SIZE = 32
+
+
+class DispatchHandoff:
+    """
+    Passes each file the receiver has staged straight to the dispatchers of its staging directory
+    (pipeline mode), instead of leaving it for a dispatcher rescan. Every dispatcher has its own queue
+    and thread, so uploads run while later files are still being received. The staging directory and
+    its trigger files stay the durable handoff: whatever is still there after a crash is picked up by
+    the next rescan.
+    """
+
+    def __init__(self, dispatchers, batch_size=DEFAULT_BATCH_SIZE):
+        self.batch_size = batch_size
+        self.logger = get_logger('dispatcher_logger')
+        # Staging directory -> [(dispatcher, its queue)]
+        self.routes = {}
+        self.threads = []
+        for dispatcher in dispatchers:
+            files = queue.Queue()
+            self.routes.setdefault(os.path.abspath(dispatcher.source_directory), []).append((dispatcher, files))
+            self.threads.append(threading.Thread(target=self.run_dispatcher, args=(dispatcher, files),
+                                                 name=f"dispatch-{dispatcher.destination_key}", daemon=True))
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, data_file):
+        """
+        Queue a staged data file for every dispatcher reading its directory, once its trigger file is
+        in place (as the dispatcher's own scan requires). Called from the receiver's worker threads.
+        """
+        data_file = Path(data_file)
+        for dispatcher, files in self.routes.get(os.path.abspath(data_file.parent), []):
+            if data_file.name.endswith(dispatcher.file_extension) and \
+                    data_file.with_suffix(dispatcher.trigger_extension).exists():
+                files.put(data_file)
+
+    def wait(self):
+        """Block until every queued file has been dispatched."""
+        for routes in self.routes.values():
+            for _, files in routes:
+                files.join()
+
+    def close(self):
+        """Dispatch what is still queued, then stop the dispatcher threads."""
+        for routes in self.routes.values():
+            for _, files in routes:
+                files.put(None)
+        for thread in self.threads:
+            if thread.is_alive():
+                thread.join()
+
+    def run_dispatcher(self, dispatcher, files):
+        """Dispatch the queued files, taking whatever else is already waiting into the same call."""
+        while True:
+            file = files.get()
+            if file is None:
+                files.task_done()
+                return
+
+            batch = [file]
+            while len(batch) < self.batch_size:
+                try:
+                    file = files.get_nowait()
+                except queue.Empty:
+                    break
+                if file is None:
+                    # Leave the stop marker for the next round, after this batch
+                    files.task_done()
+                    files.put(None)
+                    break
+                batch.append(file)
+
+            try:
+                dispatcher.dispatch(batch)
+            except Exception as e:
+                self.logger.error(f"Error dispatching {len(batch)} handed-off files: {e}")
+            finally:
+                for _ in batch:
+                    files.task_done()
@@ -0,0 +1,102 @@
+# pipeline/main.py
+
+import argparse
+
+from dispatcher.async_engine import AsyncDispatchEngine
+from dispatcher.dispatcher_factory import DispatcherFactory, compile_dispatcher_plan
+from dispatcher.main import build_dispatchers
+from pipeline.handoff import DispatchHandoff
+from receiver.receiver_factory import ReceiverFactory
+from receiver.routing_plan import compile_receiver_plan
+from utils.config_loader import load_config
+from utils.logger import setup_logging
+from utils.metrics import write_metrics
+from utils.tracing import add_profile_arguments, profiling
+
+METRICS_INTERVAL_SECONDS = 15
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Receive ISTAR-CX feed files and dispatch them in one process.")
+    parser.add_argument('environment', help="Environment to run against (DEV, ST, UAT, PROD)")
+    parser.add_argument('--watch', action='store_true',
+                        help="Keep running and process each file as soon as its .trg lands (Linux inotify)")
+    parser.add_argument('--rescan-interval', type=float, default=300,
+                        help="Seconds between fallback full rescans in watch mode (default: 300)")
+    add_profile_arguments(parser)
+    return parser.parse_args()
+
+
+def load_plan(path, name, compile_plan):
+    try:
+        return load_config(path, compile_plan)
+    except FileNotFoundError as e:
+        raise RuntimeError("{} Configuration file not found : {}".format(name, str(e)))
+    except ValueError as e:
+        raise RuntimeError("Invalid {} configuration : {}".format(name, str(e)))
+    except Exception as e:
+        raise RuntimeError("Unknown error loading {} configuration : {}".format(name, str(e)))
+
+
+def main():
+    args = parse_args()
+    setup_logging('config/pipeline_logging.yaml')
+
+    receiver_plan = load_plan('config/receiver_config.yaml', 'Receiver', compile_receiver_plan)
+    receiver_config = receiver_plan.config
+    dispatcher_config = load_plan('config/dispatcher_config.yaml', 'Dispatcher', compile_dispatcher_plan)
+
+    with profiling(args, 'receiver_logger'):
+        dispatchers, scheduler = build_dispatchers(dispatcher_config, args.environment)
+        engine = AsyncDispatchEngine(dispatchers, scheduler)
+        receivers = [ReceiverFactory.get_receiver(config, matchers)
+                     for config, matchers in zip(receiver_config['receivers'], receiver_plan.matchers)]
+
+        # Completed destination files go from the receivers straight to the dispatchers of their staging directory
+        handoff = DispatchHandoff(dispatchers)
+        for receiver in receivers:
+            receiver.handoff = handoff.submit
+        handoff.start()
+
+        metrics_textfiles = {config['metrics_textfile'] for config in (receiver_config, dispatcher_config)
+                             if config.get('metrics_textfile')}
+
+        def export_metrics(interval=None):
+            for metrics_textfile in metrics_textfiles:
+                write_metrics(metrics_textfile, interval)
+
+        def on_rescan():
+            for receiver in receivers:
+                receiver.process_files()
+            handoff.wait()
+            # Anything staged but not dispatched (earlier crash, failed uploads) is retried from the staging directories
+            engine.run_pass()
+            export_metrics()
+
+        if not args.watch:
+            try:
+                on_rescan()
+            finally:
+                handoff.close()
+                engine.close()
+                DispatcherFactory.close_connections()
+            return
+
+        def on_trigger(directory, trg_file):
+            for receiver in receivers:
+                receiver.process_trigger(directory, trg_file)
+            export_metrics(METRICS_INTERVAL_SECONDS)
+
+        from utils.trigger_watcher import run_watch_loop
+        source_paths = {server['source_path']: '.trg'
+                        for config in receiver_config['receivers'] for server in config.get('servers', [])}
+        try:
+            run_watch_loop(source_paths, on_trigger, on_rescan, args.rescan_interval, 'receiver_logger')
+        finally:
+            handoff.close()
+            engine.close()
+            DispatcherFactory.close_connections()
+
+
+if __name__ == "__main__":
+    main()
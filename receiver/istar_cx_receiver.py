@@ -1,73 +1,346 @@
 import os
-import re
-import shutil
+import time
+from collections import namedtuple
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, ThreadPoolExecutor, wait
 from pathlib import Path
+from threading import BoundedSemaphore
 
 from receiver.base_receiver import BaseReceiver
+from receiver.routing_plan import build_combined_matcher
+from utils.atomic_publish import Publisher, discard, temp_path
+from utils.checksum import new_hasher, write_sidecar
+from utils.copy_strategies import CopyStrategy
+from utils.file_claims import CLAIM_MARKER, FileClaims
+from utils.file_utils import fan_out_copy
 from utils.logger import get_logger
+from utils.metrics import BACKLOG, BYTES, FILES, LAST_RUN
+from utils.tracing import stage, tracer
+from utils.transfer_journal import TransferJournal
+from utils.transfer_scheduler import FeedPolicy, TransferScheduler
 from receiver.transformers.transformer_factory import TransformerFactory
 
+# What plan_file decided for one .dat file: the per-destination copy plans, the content-rewriting
+# transformers, whether every destination could be planned, its journal id and its feed pattern
+FilePlan = namedtuple('FilePlan', 'source_file_path copy_plans transforms planned file_id feed transformers')
+
 
 class IStarCXReceiver(BaseReceiver):
-    def __init__(self, config):
+    def __init__(self, config, combined_matchers=None):
         super().__init__(config)
         self.config = config
         self.logger = get_logger('receiver_logger')
         self.transformer_factory = TransformerFactory()
+        # One transformer per feed destination, shared by all of the feed's files
+        self.transformers = {}
 
-    def process_files(self):
-        # Iterate over all servers defined in the config
-        for server in self.config.get('servers', []):
-            source_path = server['source_path']
-            self.logger.info(f"Processing files from server: {server['server_name']} at path: {source_path}")
+        # Opt-in concurrency: a receiver-level pool size plus optional per-destination worker limits
+        self.max_workers = self.config.get('concurrency', {}).get('max_workers', 1)
+        self.destination_slots = self.build_destination_slots()
+        # Optional hash-while-copy per feed destination, with a '<data file>.<algorithm>' sidecar
+        self.destination_checksums = self.build_destination_checksums()
+        # Per feed destination 'copy_strategies' pinning or forbidding reflink, hardlink, copy_file_range or copy
+        self.destination_copy_strategies = self.build_destination_copy_strategies()
+        # Precompiled by the routing plan when the config came through utils.config_loader
+        self.combined_matchers = dict(combined_matchers or {})
 
-            for file_config in server.get('files', []):
-                file_name_pattern = file_config['file_name_pattern']
+        # Orders the discovered files by feed priority / deadline and holds the per-destination bandwidth caps
+        self.scheduler = TransferScheduler.from_config(self.config.get('scheduler'), pipeline='receiver')
+        self.destination_limits = self.build_destination_limits()
+
+        # Optional journal so a rerun after a crash skips the destinations a file already reached
+        journal_path = self.config.get('journal_path')
+        self.journal = TransferJournal.open(journal_path, self.config.get('journal_hash', False)) \
+            if journal_path else None
 
-                # Convert the file pattern with placeholders into a regex pattern
-                regex_pattern = self.convert_pattern_to_regex(file_name_pattern)
+        # Optional claiming of the .trg files, for several receiver nodes sharing one source directory
+        self.claims = FileClaims.from_config(self.config['claims'], 'receiver_logger') \
+            if self.config.get('claims') else None
+
+        # Writes every destination file under a temp name and publishes the group-committed renames
+        self.publisher = Publisher.shared(self.config.get('publish'))
+
+        # Pipeline mode: called with each staged data file once its destination is complete (see pipeline.main)
+        self.handoff = None
+
+    def process_files(self):
+        executor = None
+        in_flight = {}
+        # Sequentially written files waiting for their publication, completed a batch at a time
+        written = []
+        if self.max_workers > 1:
+            executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='receiver')
+            self.logger.info(f"Processing files concurrently with {self.max_workers} workers")
 
-                # Get all files in the source directory that match the pattern
-                matched_files = self.get_matching_files(source_path, regex_pattern)
+        try:
+            # Iterate over all servers defined in the config
+            for server in self.config.get('servers', []):
+                source_path = server['source_path']
+                self.logger.info(f"Processing files from server: {server['server_name']} at path: {source_path}")
 
-                if not matched_files:
-                    self.logger.warning(f"No matching files found for pattern: {file_name_pattern}")
+                # Validate the source directory once per server rather than once per file
+                if not self.validate_directory(source_path):
                     continue
 
-                for dat_file in matched_files:
-                    trg_file = self.get_trg_file(dat_file)
+                file_configs = server.get('files', [])
+
+                # Scan the source directory once and route every file through a single combined matcher
+                matched_files, trg_stems = self.build_source_index(source_path, file_configs)
+
+                work = []
+                for index, file_config in enumerate(file_configs):
+                    file_name_pattern = file_config['file_name_pattern']
+                    BACKLOG.set(sum(1 for dat_file in matched_files[index] if Path(dat_file).stem in trg_stems),
+                                pipeline='receiver', feed=file_name_pattern)
 
-                    # Check if the .trg file exists
-                    if not os.path.exists(os.path.join(source_path, trg_file)):
-                        self.logger.warning(f"Skipping {dat_file}: corresponding .trg file {trg_file} not found.")
+                    if not matched_files[index]:
+                        self.logger.warning(f"No matching files found for pattern: {file_name_pattern}")
                         continue
 
-                    self.logger.info(f"Processing file: {dat_file} with .trg file: {trg_file}")
-                    # Process the file by copying it to the destination(s)
-                    self.copy_and_process_file(source_path, dat_file, file_config)
+                    for dat_file in matched_files[index]:
+                        # Check if the .trg file exists
+                        if Path(dat_file).stem not in trg_stems:
+                            self.logger.warning(f"Skipping {dat_file}: corresponding .trg file "
+                                                f"{self.get_trg_file(dat_file)} not found.")
+                            continue
+                        work.append((dat_file, file_config))
+
+                # Urgent feeds first: by priority, then deadline, keeping the file order within a feed
+                for dat_file, file_config in self.scheduler.order(work, lambda item: item[0], self.feed_policy):
+                    if executor is None:
+                        self.process_file_pair(source_path, dat_file, file_config, written)
+                        if len(written) >= self.publisher.batch_files:
+                            self.complete_written(written)
+                        continue
+
+                    trg_file_path = self.claim_trigger(source_path, dat_file)
+                    if trg_file_path is None:
+                        continue
+                    self.logger.info("Processing file: %s with .trg file: %s", dat_file, self.get_trg_file(dat_file))
+
+                    # Plan in file order on this thread, so sequence numbers keep the file order per
+                    # rename prefix, and leave the copying to the pool
+                    file_plan = self.plan_file(source_path, dat_file, file_config, trg_file_path)
+                    future = executor.submit(self.execute_file_plan, dat_file, file_plan)
+                    in_flight[future] = (dat_file, trg_file_path, file_config['file_name_pattern'])
+
+                    # Bound the number of planned-but-unfinished files
+                    if len(in_flight) >= 2 * self.max_workers:
+                        self.complete_finished(in_flight, FIRST_COMPLETED)
+        finally:
+            self.complete_written(written)
+            if executor is not None:
+                self.complete_finished(in_flight, ALL_COMPLETED)
+                executor.shutdown()
+
+        LAST_RUN.set(time.time(), pipeline='receiver')
+
+    @staticmethod
+    def feed_policy(item):
+        """The priority / deadline a file entry sets for its pattern, or None to use the scheduler's feed rules."""
+        file_config = item[1]
+        if 'priority' not in file_config and 'deadline' not in file_config:
+            return None
+        return FeedPolicy.from_config(file_config, file_config['file_name_pattern'])
+
+    def process_trigger(self, source_path, trg_file):
+        """
+        Processes the single file pair announced by a .trg landing in source_path (watch mode).
+        """
+        source_path = os.path.abspath(source_path)
+        dat_file = trg_file[:-len('.trg')] + '.dat'
+
+        for server in self.config.get('servers', []):
+            if os.path.abspath(server['source_path']) != source_path:
+                continue
+
+            file_configs = server.get('files', [])
+            match = self.get_combined_matcher(server['source_path'], file_configs).match(dat_file)
+            if not match:
+                continue
+
+            if not os.path.exists(os.path.join(source_path, dat_file)):
+                self.logger.warning(f"Skipping {trg_file}: corresponding .dat file {dat_file} not found.")
+                return
+
+            self.process_file_pair(server['source_path'], dat_file, file_configs[int(match.lastgroup[1:])])
+            return
+
+    def process_file_pair(self, source_path, dat_file, file_config, written=None):
+        """
+        Copies one .dat file (and its .trg) to all destinations and removes the source .trg on success.
+        With a written list the file is only written and added to it, for complete_written() to finish
+        once its publication was group-committed with the files after it.
+        """
+        trg_file_path = self.claim_trigger(source_path, dat_file)
+        if trg_file_path is None:
+            return
+        self.logger.info("Processing file: %s with .trg file: %s", dat_file, self.get_trg_file(dat_file))
+
+        # Process the file by copying it to the destination(s)
+        if written is not None:
+            file_plan = self.plan_file(source_path, dat_file, file_config, trg_file_path)
+            written.append((dat_file, trg_file_path, file_plan, self.write_file_plan(dat_file, file_plan)))
+            return
+        succeeded = self.copy_and_process_file(source_path, dat_file, file_config, trg_file_path)
+        self.complete_file(dat_file, trg_file_path, succeeded, file_config['file_name_pattern'])
+
+    def complete_written(self, written):
+        """
+        Waits for the publication of the sequentially written files and completes them in order.
+        """
+        for dat_file, trg_file_path, file_plan, result in written:
+            try:
+                succeeded = self.finish_file_plan(dat_file, file_plan, *result)
+            except Exception as e:
+                self.logger.error(f"Unexpected error processing {dat_file}: {str(e)}")
+                succeeded = False
+            self.complete_file(dat_file, trg_file_path, succeeded, file_plan.feed)
+        written.clear()
+
+    def claim_trigger(self, source_path, dat_file):
+        """
+        Returns the path of the file's .trg or, with claims enabled, of this node's claim on it.
+        Returns None when another node claimed the file first.
+        """
+        trg_file_path = os.path.join(source_path, self.get_trg_file(dat_file))
+        if self.claims is None:
+            return trg_file_path
+        claim_path = self.claims.claim(trg_file_path)
+        if claim_path is None:
+            self.logger.info("Skipping %s: claimed by another node", dat_file)
+        return claim_path
+
+    def complete_finished(self, in_flight, return_when):
+        """
+        Waits for in-flight files and removes the .trg of every file whose destinations all succeeded.
+        """
+        done, _ = wait(list(in_flight), return_when=return_when)
+        for future in done:
+            dat_file, trg_file_path, feed = in_flight.pop(future)
+            try:
+                succeeded = future.result()
+            except Exception as e:
+                self.logger.error(f"Unexpected error processing {dat_file}: {str(e)}")
+                succeeded = False
+            self.complete_file(dat_file, trg_file_path, succeeded, feed)
+
+    def complete_file(self, dat_file, trg_file_path, succeeded, feed=''):
+        """
+        Removes the source .trg (or claim) once every destination has the file, otherwise keeps it for the
+        next run. A kept claim is no longer renewed, so it lapses and any node retries the file.
+        """
+        if succeeded:
+            # After processing, remove the .trg file
+            self.remove_trg_file(trg_file_path, feed)
+        else:
+            self.logger.warning(f"Keeping .trg file {trg_file_path}: {dat_file} failed for at least one destination.")
+        if self.claims is not None:
+            self.claims.release(trg_file_path)
+
+    def build_destination_slots(self):
+        """
+        Builds a semaphore per destination path that sets 'max_workers', limiting concurrent writes to it.
+        """
+        destination_slots = {}
+        for server in self.config.get('servers', []):
+            for file_config in server.get('files', []):
+                for destination in file_config.get('destination', []):
+                    if 'max_workers' in destination:
+                        destination_slots.setdefault(Path(destination['path']),
+                                                     BoundedSemaphore(destination['max_workers']))
+        return destination_slots
 
-                    # After processing, remove the .trg file
-                    trg_file_path = os.path.join(source_path, trg_file)
-                    self.remove_trg_file(trg_file_path)
+    def build_destination_limits(self):
+        """
+        Maps each destination path that sets 'bandwidth' to its (scheduler-shared) limits.
+        Concurrency per destination stays with 'max_workers'.
+        """
+        destination_limits = {}
+        for server in self.config.get('servers', []):
+            for file_config in server.get('files', []):
+                for destination in file_config.get('destination', []):
+                    if destination.get('bandwidth'):
+                        path = Path(destination['path'])
+                        destination_limits[path] = self.scheduler.destination_limits(
+                            str(path), {'bandwidth': destination['bandwidth']})
+        return destination_limits
+
+    def build_destination_copy_strategies(self):
+        """
+        Maps the (feed pattern, destination path) of each destination that sets 'copy_strategies' to its
+        CopyStrategy; the others use the default.
+        """
+        destination_copy_strategies = {}
+        for server in self.config.get('servers', []):
+            for file_config in server.get('files', []):
+                for destination in file_config.get('destination', []):
+                    if destination.get('copy_strategies'):
+                        destination_copy_strategies[(file_config['file_name_pattern'], Path(destination['path']))] = \
+                            CopyStrategy(destination['copy_strategies'])
+        return destination_copy_strategies
 
-    def convert_pattern_to_regex(self, file_name_pattern):
+    def build_destination_checksums(self):
         """
-        Converts a file name pattern with 'nn' and 'hhmm' to a regex pattern.
+        Maps the (feed pattern, destination path) of each destination that sets 'checksum' to (algorithm,
+        write a sidecar), checking that the algorithm is available. Keyed by feed as well, since feeds
+        sharing a destination directory need not share its checksum settings.
         """
-        # Replace 'nn' with regex for two digits and 'hhmm' with regex for four digits
-        regex_pattern = file_name_pattern.replace('nn', r'\d{2}').replace('hhmm', r'\d{4}')
-        return re.compile(regex_pattern)
+        destination_checksums = {}
+        for server in self.config.get('servers', []):
+            for file_config in server.get('files', []):
+                for destination in file_config.get('destination', []):
+                    if destination.get('checksum'):
+                        new_hasher(destination['checksum'])
+                        destination_checksums[(file_config['file_name_pattern'], Path(destination['path']))] = (
+                            destination['checksum'], destination.get('checksum_sidecar', False))
+        return destination_checksums
+
+    def get_combined_matcher(self, source_path, file_configs):
+        """
+        Returns the combined matcher of a server's file configs, compiling it on first use.
+        """
+        matcher = self.combined_matchers.get(source_path)
+        if matcher is None:
+            matcher = self.combined_matchers[source_path] = build_combined_matcher(file_configs)
+        return matcher
 
-    def get_matching_files(self, source_path, regex_pattern):
+    def build_source_index(self, source_path, file_configs):
         """
-        Returns a list of files in the source_path that match the regex pattern.
+        Scans the source_path once and returns the .dat files grouped by the index of the
+        file config whose pattern they match, together with the set of .trg file stems
+        (including those of expired claims, which are restored on the way).
         """
+        matched_files = [[] for _ in file_configs]
+        trg_stems = set()
+        claim_names = []
+        if not file_configs:
+            return matched_files, trg_stems
+
+        matcher = self.get_combined_matcher(source_path, file_configs)
         try:
-            files = os.listdir(source_path)
-            return [f for f in files if regex_pattern.match(f) and f.endswith('.dat')]
+            with stage('receiver', 'scan', directory=source_path), os.scandir(source_path) as entries:
+                for entry in entries:
+                    name = entry.name
+                    if name.endswith('.trg'):
+                        trg_stems.add(name[:-len('.trg')])
+                    elif name.endswith('.dat'):
+                        match = matcher.match(name)
+                        if match:
+                            matched_files[int(match.lastgroup[1:])].append(name)
+                    elif self.claims is not None and CLAIM_MARKER in name:
+                        claim_names.append(name)
         except Exception as e:
             self.logger.error(f"Error listing files in {source_path}: {str(e)}")
-            return []
+
+        # Claims left by dead nodes become triggers again and are processed in this pass
+        if claim_names:
+            for trg_file in self.claims.reclaim_expired(source_path, claim_names):
+                trg_stems.add(trg_file[:-len('.trg')])
+
+        # Keep a deterministic (name, i.e. nn/hhmm) order instead of the directory order
+        for files in matched_files:
+            files.sort()
+        return matched_files, trg_stems
 
     def get_trg_file(self, dat_file):
         """
@@ -75,58 +348,340 @@ class IStarCXReceiver(BaseReceiver):
         """
         return dat_file.replace('.dat', '.trg')
 
-    def copy_and_process_file(self, source_path, dat_file, file_config):
+    def copy_and_process_file(self, source_path, dat_file, file_config, trg_file_path=None):
         """
         Copies the .dat file and the corresponding .trg file to each destination and processes the .dat file.
+        Plain copies are fanned out so every source file is read once for all destinations.
+        Returns True when every destination succeeded.
+        """
+        file_plan = self.plan_file(source_path, dat_file, file_config, trg_file_path)
+        return self.execute_file_plan(dat_file, file_plan)
+
+    def plan_file(self, source_path, dat_file, file_config, trg_file_path=None):
+        """
+        Resolves the transformer of every destination and plans its copies (allocating sequence numbers).
+        Returns (source file path, copy plans, content transforms, whether planning succeeded everywhere).
+        With a claimed .trg (trg_file_path), copies of the .trg are made from the claim instead.
         """
         source_file_path = Path(source_path) / dat_file
-        trg_file_path = source_file_path.with_suffix('.trg')  # Get the corresponding .trg file
+        source_trg_file = source_file_path.with_suffix('.trg')
 
-        # Validate the source directory using the BaseReceiver's method
-        if not self.validate_directory(source_path):
-            self.logger.error(f"Source directory {source_path} does not exist. Skipping file: {dat_file}")
-            return
+        # The source directory and the .trg file have already been checked against the source index
 
-        if not trg_file_path.exists():
-            self.logger.warning(f"Corresponding .trg file not found for {dat_file}. Skipping.")
-            return
+        # Per-destination ordered copy plans, e.g. [renamed .csv, renamed .trg] or [original .dat]
+        copy_plans = []
+        transforms = []
+        # The transformer of every copy plan, to settle what its planning reserved
+        transformers = {}
+        planned = True
+
+        file_id, completed_destinations = self.journal_lookup(source_file_path)
 
         for destination in file_config.get('destination', []):
             destination_path = Path(destination['path'])  # Convert destination to Path object
-            should_process = destination['should_process']
 
-            try:
-                # Get the last sequence number from the destination directory
-                # last_sequence_number = get_last_sequence_number(destination_path, dat_file)
-                # new_sequence_number = last_sequence_number + 1  # Increment for the new file
-
-                # Create the transformer instance based on the process type
-                transformer = self.transformer_factory.get_transformer(should_process, destination)
+            if str(destination_path) in completed_destinations:
+                self.logger.info("Skipping %s for destination %s: already delivered", dat_file, destination_path)
+                continue
 
-                # Add the new sequence number to the destination config before transformation
-                # destination['process_config']['new_sequence_number'] = new_sequence_number
+            try:
+                transformer = self.get_transformer(file_config, destination)
 
-                # Try-catch block for processing and copying
-                try:
-                    # Apply transformation (e.g., renaming) for the .dat file
-                    transformer.transform(source_file_path, destination.get('path'))
+                # Plan the copies (e.g. allocate the sequence number and build the new name)
+                planned_copies = transformer.plan_copies(source_file_path, destination.get('path'))
 
-                except Exception as process_error:
-                    # Log and skip this file, continue with the next one
-                    self.logger.error(f"Error processing file {dat_file} or {trg_file_path.name}: {process_error}")
-                    continue  # Continue to the next destination
+                if planned_copies is None:
+                    # Content-rewriting transformers cannot share the fan-out copy
+                    transforms.append((destination_path, transformer))
+                else:
+                    if trg_file_path is not None and trg_file_path != str(source_trg_file):
+                        planned_copies = [(trg_file_path, *step[1:]) if Path(step[0]) == source_trg_file else step
+                                          for step in planned_copies]
+                    copy_plans.append((destination_path, planned_copies))
+                    transformers[destination_path] = transformer
 
             except Exception as dest_error:
                 # Handle errors related to specific destination logic (e.g., sequence number retrieval)
                 self.logger.error(f"Failed to process {dat_file} for destination {destination_path}: {dest_error}")
-                continue  # Continue with the next file
+                planned = False
+                continue  # Continue with the next destination
+
+        return FilePlan(source_file_path, copy_plans, transforms, planned, file_id, file_config['file_name_pattern'],
+                        transformers)
+
+    def get_transformer(self, file_config, destination):
+        """
+        Returns the transformer of a feed destination, creating it (based on the process type) on first use.
+        Transformers keep no per-file state, so one instance serves every file and thread.
+        """
+        key = (file_config['file_name_pattern'], destination['path'], destination['should_process'])
+        transformer = self.transformers.get(key)
+        if transformer is None:
+            transformer = self.transformers[key] = self.transformer_factory.get_transformer(
+                destination['should_process'], destination)
+            transformer.publisher = self.publisher
+        return transformer
+
+    def journal_lookup(self, source_file_path):
+        """
+        Returns the journal file_id of the source file and the destinations it has already reached.
+        """
+        if self.journal is None:
+            return None, set()
+        try:
+            file_id = self.journal.record_file(source_file_path)
+            return file_id, self.journal.completed_destinations(file_id)
+        except Exception as e:
+            self.logger.error(f"Error reading the transfer journal for {source_file_path}: {str(e)}")
+            return None, set()
+
+    def journal_state(self, file_id, destination_path, target=None, error=None, in_flight=False):
+        """
+        Records a destination's state for the file in the journal (when one is configured).
+        """
+        if self.journal is None or file_id is None:
+            return
+        try:
+            if in_flight:
+                self.journal.mark_in_flight(file_id, str(destination_path), target)
+            elif error is None:
+                self.journal.mark_done(file_id, str(destination_path), target)
+            else:
+                self.journal.mark_failed(file_id, str(destination_path), error)
+        except Exception as e:
+            self.logger.error(f"Error updating the transfer journal for {destination_path}: {str(e)}")
+
+    def execute_file_plan(self, dat_file, file_plan):
+        """
+        Runs a planned file against its destinations and waits until its copies are published.
+        Returns True when every destination succeeded.
+        """
+        return self.finish_file_plan(dat_file, file_plan, *self.write_file_plan(dat_file, file_plan))
+
+    def write_file_plan(self, dat_file, file_plan):
+        """
+        Writes a planned file to its destinations, holding the worker slot of every limited destination.
+        Returns (whether the transforms succeeded, {destination path: exception} of the failed copies,
+        {destination path: Future of its last published file}) for finish_file_plan().
+        """
+        source_file_path, copy_plans, transforms, all_succeeded, file_id, feed, _ = file_plan
+        destination_paths = {destination_path for destination_path, _ in copy_plans + transforms}
+        slots = [self.destination_slots[path] for path in sorted(destination_paths) if path in self.destination_slots]
+
+        # One span per file in the trace, with the stages of its destinations nested inside
+        with tracer.span(dat_file, 'receiver', feed=feed):
+            for destination_path, planned_copies in copy_plans:
+                self.journal_state(file_id, destination_path, str(planned_copies[0][1]), in_flight=True)
+
+            # Acquire in a fixed (sorted) order so workers can never deadlock on each other's slots
+            for slot in slots:
+                slot.acquire()
+            try:
+                self.throttle(source_file_path, [destination_path for destination_path, _ in transforms])
+                for destination_path, transformer in transforms:
+                    self.journal_state(file_id, destination_path, in_flight=True)
+                    try:
+                        # Apply transformation for the .dat file
+                        with stage('receiver', 'transform', feed=feed, destination=destination_path):
+                            transformer.transform(source_file_path, str(destination_path))
+                        self.journal_state(file_id, destination_path)
+                        self.record_outcome(feed, destination_path, source_file_path)
+                    except Exception as process_error:
+                        # Log and skip this destination, continue with the next one
+                        self.logger.error(f"Error processing file {dat_file} for destination {destination_path}: "
+                                          f"{process_error}")
+                        self.journal_state(file_id, destination_path, error=process_error)
+                        self.record_outcome(feed, destination_path, error=process_error)
+                        all_succeeded = False
+
+                failures, published = self.fan_out_copies(dat_file, copy_plans, feed)
+                return all_succeeded, failures, published
+            finally:
+                for slot in reversed(slots):
+                    slot.release()
+
+    def finish_file_plan(self, dat_file, file_plan, all_succeeded, failures, published):
+        """
+        Waits for the publication of a written file's copies, then settles (e.g. commits or releases the
+        sequence number), journals and counts each destination and hands the complete ones off.
+        Returns True when every destination succeeded.
+        """
+        source_file_path, copy_plans, _, _, file_id, feed, transformers = file_plan
+        failed = self.publisher.wait(published.values())
+        for destination_path, future in published.items():
+            if future in failed and destination_path not in failures:
+                self.logger.error(f"Failed to publish {dat_file} to destination {destination_path}: {failed[future]}")
+                failures[destination_path] = failed[future]
+
+        for destination_path, planned_copies in copy_plans:
+            transformers[destination_path].settle_copies(planned_copies, failures.get(destination_path))
+            self.journal_state(file_id, destination_path, error=failures.get(destination_path))
+            self.record_outcome(feed, destination_path, source_file_path, failures.get(destination_path))
+        self.hand_off(copy_plans, failures)
+
+        return all_succeeded and not failures
+
+    def hand_off(self, copy_plans, failures):
+        """
+        Passes the data file of every destination that is complete (data file, sidecar and .trg in place)
+        to the handoff, when one is set. Files written by transform() are left to the dispatcher's rescan.
+        """
+        if self.handoff is None:
+            return
+        for destination_path, planned_copies in copy_plans:
+            if destination_path not in failures:
+                try:
+                    self.handoff(planned_copies[0][1])
+                except Exception as e:
+                    self.logger.error(f"Failed to hand {planned_copies[0][1]} off to the dispatcher: {str(e)}")
+
+    def throttle(self, source_file_path, destination_paths):
+        """
+        Charges the file's size up front to the bandwidth cap of every capped destination, waiting while it is
+        exceeded. Only for the transforms and writers, which write their output themselves; copies are
+        charged chunk by chunk (see bandwidth_throttle).
+        """
+        throttle = self.bandwidth_throttle(destination_paths)
+        if throttle is not None:
+            throttle(os.path.getsize(source_file_path))
+
+    def bandwidth_throttle(self, destination_paths):
+        """
+        Returns a callable charging an amount of bytes to the bandwidth cap of every capped destination,
+        waiting while it is exceeded, or None when none of them is capped.
+        """
+        limited = [self.destination_limits[path] for path in destination_paths if path in self.destination_limits]
+        if not limited:
+            return None
+
+        def throttle(amount):
+            for limits in limited:
+                limits.throttle(amount)
+        return throttle
+
+    def record_outcome(self, feed, destination_path, source_file_path=None, error=None):
+        """
+        Counts the file (and, on success, its bytes) for the feed pattern and destination.
+        """
+        labels = {'pipeline': 'receiver', 'feed': feed, 'destination': str(destination_path)}
+        if error is not None:
+            FILES.inc(outcome='failure', **labels)
+            return
+        FILES.inc(outcome='success', **labels)
+        try:
+            BYTES.inc(os.path.getsize(source_file_path), **labels)
+        except OSError:
+            pass
+
+    def fan_out_copies(self, dat_file, copy_plans, feed=None):
+        """
+        Executes the destinations' copy plans step by step. Within a step the copies sharing a source
+        file are done in one fan-out pass, steps with a writer are run on their own, and a destination
+        whose copy failed takes no further steps. Every file is written under a temp name and published after
+        the destination's previous one, so a .trg is never published before its data file is in place.
+        The first step (the data file) of a destination whose feed sets a 'checksum' is hashed on the same pass,
+        and the copies are charged to the bandwidth cap of their destinations chunk by chunk as they are read.
+        Returns a {destination path: exception} dict of the destinations that failed and a
+        {destination path: Future} dict of the publication of each destination's last file.
+        """
+        failed_destinations = {}
+        published = {}
+        pending = list(copy_plans)
+        step = 0
+
+        while pending:
+            copies_by_source = {}
+            writes = []
+            for destination_path, planned_copies in pending:
+                src, dst, *writer = planned_copies[step]
+                algorithm = None
+                if step == 0 and (feed, destination_path) in self.destination_checksums:
+                    algorithm = self.destination_checksums[(feed, destination_path)][0]
+                if writer:
+                    writes.append((src, dst, writer[0], destination_path, algorithm))
+                else:
+                    copies_by_source.setdefault((src, algorithm), []).append((dst, destination_path))
+
+            # Steps with a writer (e.g. record transformers) produce their destination file themselves
+            for src, dst, writer, destination_path, algorithm in writes:
+                tmp = temp_path(dst)
+                try:
+                    hasher = new_hasher(algorithm) if algorithm else None
+                    self.throttle(src, [destination_path])
+                    with stage('receiver', 'transform', feed=feed, destination=destination_path, file=dst):
+                        writer(src, tmp, hasher)
+                    published[destination_path] = self.publisher.publish(tmp, dst, published.get(destination_path))
+                    self.publish_checksum(feed, destination_path, dst, hasher, published)
+                    self.logger.info("Wrote %s to %s", Path(src).name, dst, extra={'file': src, 'destination': dst})
+                except Exception as e:
+                    discard(tmp)
+                    self.logger.error(f"Failed to process {dat_file} for destination {destination_path}: {e}")
+                    failed_destinations[destination_path] = e
+
+            for (src, algorithm), targets in copies_by_source.items():
+                tmps = {dst: temp_path(dst) for dst, _ in targets}
+                try:
+                    hasher = new_hasher(algorithm) if algorithm else None
+                    strategies = {tmps[dst]: self.destination_copy_strategies[(feed, destination_path)]
+                                  for dst, destination_path in targets
+                                  if (feed, destination_path) in self.destination_copy_strategies}
+                    throttles = {tmps[dst]: self.bandwidth_throttle([destination_path])
+                                 for dst, destination_path in targets}
+                    # One pass serves every destination of the group, so its time is counted under all of them
+                    with stage('receiver', 'copy', feed=feed,
+                               destination=','.join(sorted(str(destination_path) for _, destination_path in targets)),
+                               file=src, destinations=[dst for dst, _ in targets]):
+                        failures = fan_out_copy(src, list(tmps.values()), hasher=hasher, strategies=strategies,
+                                                throttles=throttles)
+                    failures = {dst: failures[tmp] for dst, tmp in tmps.items() if tmp in failures}
+                except Exception as e:
+                    failures = {dst: e for dst, _ in targets}
+
+                for dst, destination_path in targets:
+                    if dst not in failures:
+                        try:
+                            published[destination_path] = self.publisher.publish(
+                                tmps[dst], dst, published.get(destination_path))
+                            self.publish_checksum(feed, destination_path, dst, hasher, published)
+                        except Exception as e:
+                            failures[dst] = e
+
+                    if dst in failures:
+                        discard(tmps[dst])
+                        self.logger.error(f"Failed to process {dat_file} for destination {destination_path}: "
+                                          f"{failures[dst]}")
+                        failed_destinations[destination_path] = failures[dst]
+                    else:
+                        self.logger.info("Copied %s to %s", Path(src).name, dst,
+                                         extra={'file': src, 'destination': dst})
+
+            step += 1
+            pending = [(destination_path, planned_copies) for destination_path, planned_copies in pending
+                       if destination_path not in failed_destinations and step < len(planned_copies)]
+
+        return failed_destinations, published
+
+    def publish_checksum(self, feed, destination_path, dst, hasher, published):
+        """
+        Logs the checksum of a hashed data file and, when the destination asks for it, writes the
+        sidecar next to it, published after the data file and before its .trg.
+        """
+        if hasher is None:
+            return
+        algorithm, sidecar = self.destination_checksums[(feed, destination_path)]
+        digest = hasher.hexdigest()
+        self.logger.info("%s of %s: %s", algorithm, dst, digest, extra={'file': dst, algorithm: digest})
+        if sidecar:
+            published[destination_path] = write_sidecar(dst, digest, algorithm, self.publisher,
+                                                        published[destination_path])
 
-    def remove_trg_file(self, trg_file_path):
+    def remove_trg_file(self, trg_file_path, feed=''):
         """
         Removes the .trg file after the corresponding .dat file has been processed.
         """
         try:
-            os.remove(trg_file_path)
-            self.logger.info(f"Removed .trg file: {trg_file_path}")
+            with stage('receiver', 'trigger_delete', feed=feed, file=trg_file_path):
+                os.remove(trg_file_path)
+            self.logger.info("Removed .trg file: %s", trg_file_path)
         except Exception as e:
             self.logger.error(f"Failed to remove .trg file: {trg_file_path}: {str(e)}")
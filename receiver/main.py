@@ -1,25 +1,72 @@
-import yaml
+import argparse
+
 from receiver.receiver_factory import ReceiverFactory
+from receiver.routing_plan import compile_receiver_plan
+from utils.config_loader import load_config
 from utils.logger import setup_logging
+from utils.metrics import write_metrics
+from utils.tracing import add_profile_arguments, profiling
+
+METRICS_INTERVAL_SECONDS = 15
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Transfer ISTAR-CX feed files to their local destinations.")
+    parser.add_argument('--watch', action='store_true',
+                        help="Keep running and process each file as soon as its .trg lands (Linux inotify)")
+    parser.add_argument('--rescan-interval', type=float, default=300,
+                        help="Seconds between fallback full rescans in watch mode (default: 300)")
+    add_profile_arguments(parser)
+    return parser.parse_args()
+
 
 def main():
+    args = parse_args()
     setup_logging('../config/receiver_logging.yaml')
 
-    # Load configuration from YAML
+    # Load the configuration, validated and compiled into a routing plan (cached while the YAML is unchanged)
     try:
-        with open('../config/receiver_config.yaml', 'r') as config_file:
-            config = yaml.safe_load(config_file)
+        plan = load_config('../config/receiver_config.yaml', compile_receiver_plan)
     except FileNotFoundError as e:
         raise RuntimeError("Receiver Configuration file not found : {}".format(str(e)))
-    except yaml.YAMLError as e:
-        raise RuntimeError("Error parsing YAML file : {}".format(str(e)))
+    except ValueError as e:
+        raise RuntimeError("Invalid Receiver configuration : {}".format(str(e)))
     except Exception as e:
         raise RuntimeError("Unknown error loading Receiver configuration : {}".format(str(e)))
 
-    # Iterate over each receiver and process files
-    for receiver_config in config['receivers']:
-        receiver = ReceiverFactory.get_receiver(receiver_config)
-        receiver.process_files()
+    with profiling(args, 'receiver_logger'):
+        config = plan.config
+        receivers = [ReceiverFactory.get_receiver(receiver_config, matchers)
+                     for receiver_config, matchers in zip(config['receivers'], plan.matchers)]
+        metrics_textfile = config.get('metrics_textfile')
+
+        if not args.watch:
+            try:
+                # Iterate over each receiver and process files
+                for receiver in receivers:
+                    receiver.process_files()
+            finally:
+                if metrics_textfile:
+                    write_metrics(metrics_textfile)
+            return
+
+        def on_trigger(directory, trg_file):
+            for receiver in receivers:
+                receiver.process_trigger(directory, trg_file)
+            if metrics_textfile:
+                write_metrics(metrics_textfile, METRICS_INTERVAL_SECONDS)
+
+        def on_rescan():
+            for receiver in receivers:
+                receiver.process_files()
+            if metrics_textfile:
+                write_metrics(metrics_textfile)
+
+        from utils.trigger_watcher import run_watch_loop
+        source_paths = {server['source_path']: '.trg'
+                        for receiver_config in config['receivers'] for server in receiver_config.get('servers', [])}
+        run_watch_loop(source_paths, on_trigger, on_rescan, args.rescan_interval, 'receiver_logger')
+
 
 if __name__ == '__main__':
     main()
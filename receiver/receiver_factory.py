@@ -2,9 +2,9 @@ from receiver.istar_cx_receiver import IStarCXReceiver
 
 class ReceiverFactory:
     @staticmethod
-    def get_receiver(receiver_config):
+    def get_receiver(receiver_config, combined_matchers=None):
         receiver_name = receiver_config['name']
         if receiver_name == "i-star cx receiver_system":
-            return IStarCXReceiver(receiver_config)
+            return IStarCXReceiver(receiver_config, combined_matchers)
         else:
             raise ValueError(f"Unknown receiver type: {receiver_name}")
@@ -0,0 +1,103 @@
+import re
+from collections import namedtuple
+
+from receiver.transformers.transformer_factory import TransformerFactory
+
+# The validated receiver config and, per receiver, the combined file name matcher of each source path
+RoutingPlan = namedtuple('RoutingPlan', 'config matchers')
+
+# Validation builds every destination's transformer, so a change to them invalidates the cached plans
+PLAN_DEPENDENCIES = ('receiver.transformers',)
+
+
+def convert_pattern_to_regex(file_name_pattern):
+    """
+    Converts a file name pattern with 'nn' and 'hhmm' to a regex pattern.
+    """
+    # Replace 'nn' with regex for two digits and 'hhmm' with regex for four digits
+    regex_pattern = file_name_pattern.replace('nn', r'\d{2}').replace('hhmm', r'\d{4}')
+    return re.compile(regex_pattern)
+
+
+def build_combined_matcher(file_configs):
+    """
+    Combines the regex of every file name pattern into one alternation with a named group per pattern,
+    so each directory entry is routed with a single match call.
+    """
+    alternatives = [
+        f"(?P<p{index}>{convert_pattern_to_regex(file_config['file_name_pattern']).pattern})"
+        for index, file_config in enumerate(file_configs)
+    ]
+    return re.compile('|'.join(alternatives))
+
+
+def compile_receiver_plan(config, validate=True):
+    """
+    Validate a receiver config (every key the receivers rely on, the file name patterns and every
+    destination's transformer settings) and precompile its matchers. utils.config_loader caches the
+    validated config and rebuilds the plan from it with validate=False, which only compiles the matchers.
+
+    :raises ValueError: Listing every problem found.
+    """
+    if not validate:
+        return RoutingPlan(config, [build_receiver_matchers(receiver_config) for receiver_config in config['receivers']])
+
+    problems = []
+    if not isinstance(config, dict) or not isinstance(config.get('receivers'), list):
+        raise ValueError("Invalid receiver configuration: a 'receivers' list is required")
+
+    matchers = []
+    for receiver_index, receiver_config in enumerate(config['receivers']):
+        receiver_matchers = {}
+        matchers.append(receiver_matchers)
+        if 'name' not in receiver_config:
+            problems.append(f"receivers[{receiver_index}]: missing 'name'")
+        for server_index, server in enumerate(receiver_config.get('servers', [])):
+            where = f"receivers[{receiver_index}].servers[{server_index}]"
+            if 'source_path' not in server:
+                problems.append(f"{where}: missing 'source_path'")
+                continue
+            file_configs = server.get('files', [])
+            for file_config in file_configs:
+                problems.extend(validate_file_config(where, file_config))
+            if file_configs and not problems:
+                # The first server of a source path routes it, as when the matchers were compiled on first use
+                receiver_matchers.setdefault(server['source_path'], build_combined_matcher(file_configs))
+
+    if problems:
+        raise ValueError("Invalid receiver configuration:\n  - " + "\n  - ".join(problems))
+    return RoutingPlan(config, matchers)
+
+
+def build_receiver_matchers(receiver_config):
+    """The combined matcher of each source path of a validated receiver config."""
+    matchers = {}
+    for server in receiver_config.get('servers', []):
+        if server.get('files'):
+            # The first server of a source path routes it, as in compile_receiver_plan
+            matchers.setdefault(server['source_path'], build_combined_matcher(server['files']))
+    return matchers
+
+
+def validate_file_config(where, file_config):
+    problems = []
+    pattern = file_config.get('file_name_pattern')
+    if not pattern:
+        return [f"{where}: file entry without 'file_name_pattern'"]
+    try:
+        convert_pattern_to_regex(pattern)
+    except re.error as e:
+        problems.append(f"{where} {pattern}: invalid pattern: {str(e)}")
+
+    for destination in file_config.get('destination', []):
+        if 'path' not in destination or 'should_process' not in destination:
+            problems.append(f"{where} {pattern}: destination needs 'path' and 'should_process'")
+            continue
+        try:
+            # Builds (and so checks) the transformer the receiver will use for this destination
+            TransformerFactory.get_transformer(destination['should_process'], destination)
+        except (KeyError, TypeError, ValueError) as e:
+            detail = f"missing {e}" if isinstance(e, KeyError) else str(e)
+            problems.append(f"{where} {pattern} -> {destination['path']}: invalid "
+                            f"'{destination['should_process']}' settings: {detail}")
+    return problems
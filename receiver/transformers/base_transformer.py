@@ -1,6 +1,59 @@
 from abc import ABC, abstractmethod
 
+from utils.atomic_publish import Publisher, discard, temp_path
+from utils.file_utils import copy_file
+
+
 class BaseTransformer(ABC):
+    # The receiver's publisher (see utils.atomic_publish); the shared default one when not set
+    publisher = None
+
+    def plan_copies(self, src_file, dest_dir):
+        """
+        Return the (source file, destination file) copies this transformer would make, in order,
+        so the receiver can fan a source out to all destinations in one read. A step may carry a third
+        element, a writer(src, dst, hasher=None) callable that produces the destination file itself
+        instead of a plain copy. Transformers that rewrite the content return None and are run through
+        transform() instead.
+        """
+        return None
+
+    def publish_copies(self, planned_copies):
+        """
+        Make the planned copies in order, each under a temp name and published after the previous one (so
+        a .trg only appears once its data file is in place), and wait until the last one is published.
+        """
+        publisher = self.publisher or Publisher.shared()
+        published = None
+        try:
+            for src, dst, *writer in planned_copies:
+                if writer:
+                    tmp = temp_path(dst)
+                    try:
+                        writer[0](src, tmp)
+                    except Exception:
+                        discard(tmp)
+                        raise
+                    published = publisher.publish(tmp, dst, published)
+                else:
+                    published = copy_file(src, dst, publisher=publisher, after=published)
+            if published is not None:
+                publisher.wait([published])
+                published.result()
+        except Exception as e:
+            # Copies already staged are still published: settle once they are in place (or failed)
+            if published is not None:
+                publisher.wait([published])
+            self.settle_copies(planned_copies, e)
+            raise
+        self.settle_copies(planned_copies)
+
+    def settle_copies(self, planned_copies, error=None):
+        """
+        Called once the copies planned by plan_copies() are all published, or with the error when they are
+        not, e.g. to commit or release what planning reserved.
+        """
+
     @abstractmethod
     def transform(self, src_file, dest_dir):
         pass
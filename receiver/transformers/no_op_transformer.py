@@ -1,29 +1,36 @@
-import shutil
 import os
 from receiver.transformers.base_transformer import BaseTransformer
+from utils.logger import get_logger
 
 
 class NoOpTransformer(BaseTransformer):
+    def __init__(self):
+        self.logger = get_logger('receiver_logger')
+
+    def plan_copies(self, src_file, dest_dir):
+        """
+        The source file is copied to the destination directory under its original name.
+        """
+        # Ensure destination directory exists
+        if not os.path.exists(dest_dir):
+            os.makedirs(dest_dir)
+
+        # Get the original file name
+        file_name = os.path.basename(src_file)
+        return [(src_file, os.path.join(dest_dir, file_name))]
+
     def transform(self, src_file, dest_dir):
         """
         Simply copies the source file to the destination directory without renaming it.
         """
         try:
-            # Ensure destination directory exists
-            if not os.path.exists(dest_dir):
-                os.makedirs(dest_dir)
-
-            # Get the original file name
-            file_name = os.path.basename(src_file)
-            dest_file_path = os.path.join(dest_dir, file_name)
-
             # Perform the file copy
-            shutil.copy2(src_file, dest_file_path)
+            self.publish_copies(self.plan_copies(src_file, dest_dir))
 
             # Logging after successful copy
-            print(f"Copied file {file_name} to {dest_dir}")
+            self.logger.info("Copied file %s to %s", os.path.basename(src_file), dest_dir)
 
         except Exception as e:
             # Log or handle the error if something goes wrong during copying
-            print(f"Failed to copy file {src_file} to {dest_dir}: {e}")
+            self.logger.error("Failed to copy file %s to %s: %s", src_file, dest_dir, e)
             raise
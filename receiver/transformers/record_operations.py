@@ -0,0 +1,110 @@
+class RecordOperation:
+    """
+    One step of a RecordTransformer chain. Records are the lines of the file as bytes (without the line
+    ending) and are handed over in batches, so every operation works on a whole batch at once.
+    """
+
+    def header(self):
+        """Lines written before the first record."""
+        return []
+
+    def process(self, records):
+        """Return the records of the batch this operation keeps or produces."""
+        return records
+
+    def trailer(self, record_count):
+        """Lines written after the last record; record_count is the number of records written."""
+        return []
+
+
+class FilterRecords(RecordOperation):
+    """Keeps (include) or drops (exclude) the records whose field [start:end) has one of the given values."""
+
+    def __init__(self, config, encoding):
+        self.start = config['start']
+        self.end = config['end']
+        self.include = {value.encode(encoding) for value in config.get('include', [])} or None
+        self.exclude = {value.encode(encoding) for value in config.get('exclude', [])}
+
+    def process(self, records):
+        start, end, include, exclude = self.start, self.end, self.include, self.exclude
+        if include is not None:
+            records = [record for record in records if record[start:end] in include]
+        if exclude:
+            records = [record for record in records if record[start:end] not in exclude]
+        return records
+
+
+class FixedWidthToCsv(RecordOperation):
+    """
+    Splits fixed-width records into delimited fields. Each field is sliced column by column over the
+    whole batch and only the columns containing a delimiter or quote are quoted.
+    """
+
+    def __init__(self, config, encoding):
+        self.fields = config['fields']
+        self.slices = [(field['start'], field['end']) for field in self.fields]
+        self.delimiter = config.get('delimiter', ',').encode(encoding)
+        self.strip = config.get('strip', True)
+        self.with_header = config.get('header', False)
+        self.encoding = encoding
+
+    def header(self):
+        if not self.with_header:
+            return []
+        return [self.delimiter.join(field['name'].encode(self.encoding) for field in self.fields)]
+
+    def process(self, records):
+        if not records:
+            return records
+
+        columns = []
+        for start, end in self.slices:
+            column = [record[start:end] for record in records]
+            if self.strip:
+                column = [value.strip() for value in column]
+            if any(self.delimiter in value or b'"' in value for value in column):
+                column = [b'"' + value.replace(b'"', b'""') + b'"' for value in column]
+            columns.append(column)
+
+        return [self.delimiter.join(row) for row in zip(*columns)]
+
+
+class Header(RecordOperation):
+    """Writes fixed header lines."""
+
+    def __init__(self, config, encoding):
+        self.lines = [line.encode(encoding) for line in config['lines']]
+
+    def header(self):
+        return self.lines
+
+
+class Trailer(RecordOperation):
+    """Writes trailer lines; '{count}' is replaced by the number of records written."""
+
+    def __init__(self, config, encoding):
+        self.lines = config['lines']
+        self.encoding = encoding
+
+    def trailer(self, record_count):
+        return [line.replace('{count}', str(record_count)).encode(self.encoding) for line in self.lines]
+
+
+RECORD_OPERATIONS = {
+    'filter': FilterRecords,
+    'fixed_width_to_csv': FixedWidthToCsv,
+    'header': Header,
+    'trailer': Trailer,
+}
+
+
+def build_record_operations(operation_configs, encoding):
+    """Build the operation chain from the 'record_operations' list of a destination's process_config."""
+    operations = []
+    for operation_config in operation_configs:
+        operation_type = operation_config.get('type')
+        if operation_type not in RECORD_OPERATIONS:
+            raise ValueError(f"Unknown record operation type: {operation_type}")
+        operations.append(RECORD_OPERATIONS[operation_type](operation_config, encoding))
+    return operations
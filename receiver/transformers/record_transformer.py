@@ -0,0 +1,122 @@
+import os
+from pathlib import Path
+
+from receiver.transformers.base_transformer import BaseTransformer
+from receiver.transformers.record_operations import build_record_operations
+from receiver.transformers.rename_transformer import RenameTransformer
+from utils.logger import get_logger
+
+DEFAULT_READ_SIZE = 1024 * 1024
+DEFAULT_BATCH_SIZE = 10000
+
+
+class RecordTransformer(BaseTransformer):
+    """
+    Rewrites a feed file record by record through the destination's 'record_operations' chain
+    (filter, fixed_width_to_csv, header, trailer). The file is read in fixed-size chunks and handed
+    to the chain in batches of lines, so memory stays bounded whatever the file size.
+    """
+
+    def __init__(self, config):
+        process_config = config.get('process_config', {})
+        self.encoding = process_config.get('encoding', 'utf-8')
+        self.read_size = process_config.get('read_size', DEFAULT_READ_SIZE)
+        self.batch_size = process_config.get('batch_size', DEFAULT_BATCH_SIZE)
+        self.line_ending = process_config.get('line_ending', '\n').encode(self.encoding)
+        self.output_extension = process_config.get('output_extension')
+        self.operations = build_record_operations(process_config.get('record_operations', []), self.encoding)
+        # With a rename_pattern the output is named (and its .trg published) like the Rename transformer
+        self.renamer = RenameTransformer(config) if 'rename_pattern' in process_config else None
+        self.logger = get_logger('receiver_logger')
+
+    def plan_copies(self, src_file, dest_dir):
+        """
+        The data file step carries write_records as its writer, so the receiver streams the records
+        instead of copying the bytes; a renamed .trg still follows as a plain copy.
+        """
+        if self.renamer is not None:
+            planned_copies = self.renamer.plan_copies(src_file, dest_dir)
+            src, dat_dest_file = planned_copies[0]
+            return [(src, dat_dest_file, self.write_records)] + planned_copies[1:]
+
+        os.makedirs(dest_dir, exist_ok=True)
+        dest_file = Path(dest_dir) / Path(src_file).name
+        if self.output_extension:
+            dest_file = dest_file.with_suffix(self.output_extension)
+        return [(src_file, str(dest_file), self.write_records)]
+
+    def settle_copies(self, planned_copies, error=None):
+        if self.renamer is not None:
+            self.renamer.settle_copies(planned_copies, error)
+
+    def transform(self, src_file, dest_dir):
+        planned_copies = self.plan_copies(src_file, dest_dir)
+        self.publish_copies(planned_copies)
+        for src, dest_file, *_ in planned_copies:
+            self.logger.info(f"Successfully processed {src} into {dest_file}")
+
+    def write_records(self, src_file, dest_file, hasher=None):
+        """
+        Streams the records of src_file through the operation chain into dest_file, feeding the written
+        bytes to hasher when one is given. Returns the number of records written.
+        """
+        line_ending = self.line_ending
+        record_count = 0
+        written = 0
+
+        with open(src_file, 'rb') as src, open(dest_file, 'wb') as dest:
+            def write_lines(lines):
+                nonlocal written
+                data = line_ending.join(lines) + line_ending
+                dest.write(data)
+                written += len(data)
+                if hasher is not None:
+                    hasher.update(data)
+
+            header = [line for operation in self.operations for line in operation.header()]
+            if header:
+                write_lines(header)
+
+            for records in self.read_batches(src):
+                for operation in self.operations:
+                    records = operation.process(records)
+                    if not records:
+                        break
+                if records:
+                    write_lines(records)
+                    record_count += len(records)
+
+            trailer = [line for operation in self.operations for line in operation.trailer(record_count)]
+            if trailer:
+                write_lines(trailer)
+
+        if hasher is not None and os.path.getsize(dest_file) != written:
+            raise IOError(f"Size mismatch after writing {dest_file}: expected {written} bytes")
+
+        return record_count
+
+    def read_batches(self, src):
+        """
+        Yields the non-empty lines of src (without their line endings) in lists of at most batch_size,
+        reading read_size bytes at a time and carrying a partial last line over to the next chunk.
+        """
+        remainder = b''
+        while True:
+            chunk = src.read(self.read_size)
+            if not chunk:
+                break
+
+            buffer = remainder + chunk if remainder else chunk
+            lines = buffer.split(b'\n')
+            remainder = lines.pop()
+            # The buffer, not the chunk: a '\r' carried over in the remainder may end a line of this chunk
+            if b'\r' in buffer:
+                lines = [line[:-1] if line.endswith(b'\r') else line for line in lines]
+            lines = [line for line in lines if line]
+
+            for start in range(0, len(lines), self.batch_size):
+                yield lines[start:start + self.batch_size]
+
+        remainder = remainder.rstrip(b'\r')
+        if remainder:
+            yield [remainder]
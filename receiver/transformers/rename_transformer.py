@@ -1,21 +1,28 @@
 import os
 import re
 from datetime import datetime
-from pathlib import Path
 
 from receiver.transformers.base_transformer import BaseTransformer
-from utils.file_utils import copy_file
+from receiver.transformers.sequence_allocator import SequenceAllocator
 from utils.logger import get_logger
+from utils.tracing import stage
 
 
 class RenameTransformer(BaseTransformer):
     def __init__(self, config):
         self.rename_pattern = config['process_config']['rename_pattern']
+        # Recovers the date and sequence number from a name built by build_filename()
+        self.name_regex = re.compile(re.escape(self.rename_pattern).replace('YYMMDD', r'(?P<date>\d{6})')
+                                     .replace('<nnnnn>', r'(?P<sequence_number>\d{5})').replace('MMDD', r'\d{4}'))
         self.logger = get_logger('receiver_logger')
 
-    def transform(self, src_file, dest_dir):
-        sequence_number = self.get_last_sequence_number(dest_dir, self.rename_pattern)
-        new_dat_file_name = self.build_filename(self.rename_pattern, sequence_number)
+    def plan_copies(self, src_file, dest_dir):
+        """
+        Reserve the next sequence number and return the renamed .csv copy followed by its .trg copy.
+        """
+        now = datetime.now()
+        sequence_number = self.get_last_sequence_number(dest_dir, self.rename_pattern, now)
+        new_dat_file_name = self.build_filename(self.rename_pattern, sequence_number, now)
         new_trg_file_name = new_dat_file_name.replace('.csv', '.trg')
 
         src_trg_file = src_file.with_suffix('.trg')
@@ -23,58 +30,60 @@ class RenameTransformer(BaseTransformer):
         dat_dest_file = os.path.join(dest_dir, new_dat_file_name)
         trg_dest_file = os.path.join(dest_dir, new_trg_file_name)
 
-        copy_file(src_file, dat_dest_file)
-        copy_file(src_trg_file, trg_dest_file)
-
-        self.logger.info(f"Successfully copied and processed {src_file} and {dat_dest_file} to {dest_dir}")
-        self.logger.info(f"Successfully copied and processed {src_trg_file} and {trg_dest_file} to {dest_dir}")
-
-    from datetime import datetime
-    from pathlib import Path
-    import re
-
-    def get_last_sequence_number(self, dest_path, file_pattern):
-        """Find the latest sequence number from the destination files matching initials and current date."""
+        return [(src_file, dat_dest_file), (src_trg_file, trg_dest_file)]
+
+    def settle_copies(self, planned_copies, error=None):
+        """
+        Commit the sequence number of a published file, or release it for the next file when the renamed
+        data file did not make it into place.
+        """
+        dat_dest_file = planned_copies[0][1]
+        match = self.name_regex.fullmatch(os.path.basename(dat_dest_file))
+        prefix = self.sequence_prefix(self.rename_pattern)
+        if match is None or prefix is None:
+            return
+
+        dest_dir = os.path.dirname(dat_dest_file)
+        date, sequence_number = match.group('date'), int(match.group('sequence_number'))
         try:
-            path = Path(dest_path)
-            sequences = []
-
-            # Extract the initial part of the filename (before '_<nnnnn>')
-            initial_pattern = re.match(r'([A-Za-z0-9]+)_', file_pattern)
-            if not initial_pattern:
-                self.logger.error(f"Unable to extract initial part from file pattern: {file_pattern}")
-                return 1
-
-            initial_part = initial_pattern.group(1)
-
-            # Get current date in YYMMDD format
-            current_date = datetime.now().strftime("%y%m%d")
-
-            # Compile regex to match the initial part, current date, and extract <nnnnn> sequence number
-            sequence_regex = re.compile(rf'{initial_part}_{current_date}_(\d{{5}})_\d{{2}}\(\d{{4}}\)\.csv')
-
-            for file in path.iterdir():
-                if file.is_file() and file.name.endswith('.csv'):
-                    self.logger.debug(f"Trying to match pattern: {sequence_regex.pattern} with file: {file.name}")
-
-                    # Attempt to match the filename based on the initial part, date, and .csv
-                    match = sequence_regex.match(file.name)
-                    if match:
-                        seq_number = match.group(1)  # Extract the <nnnnn> part
-                        self.logger.debug(f"Found sequence number: {seq_number}")
-                        sequences.append(int(seq_number))
-                    else:
-                        self.logger.debug(f"No match for file: {file.name}")
+            allocator = SequenceAllocator(dest_dir)
+            if error is None or os.path.exists(dat_dest_file):
+                allocator.commit(prefix, date, sequence_number)
+            else:
+                allocator.release(prefix, date, sequence_number)
+        except Exception as e:
+            self.logger.error(f"Error settling sequence number {sequence_number} in {dest_dir}: {str(e)}")
 
-            # Return the max sequence number incremented by 1 or 00001 if none found
-            return max(sequences) + 1 if sequences else 1
+    def transform(self, src_file, dest_dir):
+        planned_copies = self.plan_copies(src_file, dest_dir)
+        self.publish_copies(planned_copies)
+        for src, dest_file in planned_copies:
+            self.logger.info(f"Successfully copied and processed {src} and {dest_file} to {dest_dir}")
+
+    def get_last_sequence_number(self, dest_path, file_pattern, now=None):
+        """Reserve the next sequence number for the file pattern's initials and the current date."""
+        initial_part = self.sequence_prefix(file_pattern)
+        if initial_part is None:
+            self.logger.error(f"Unable to extract initial part from file pattern: {file_pattern}")
+            return 1
 
+        try:
+            with stage('receiver', 'sequence_lookup', destination=dest_path, prefix=initial_part):
+                return SequenceAllocator(dest_path).next_sequence_number(
+                    initial_part, now, lambda sequence_number: self.build_filename(file_pattern, sequence_number, now))
         except Exception as e:
-            self.logger.error(f"Error getting last sequence number from {dest_path}: {str(e)}")
-            return 1
+            self.logger.error(f"Error allocating sequence number in {dest_path}: {str(e)}")
+            raise
+
+    @staticmethod
+    def sequence_prefix(file_pattern):
+        """The initial part of the file pattern (before '_YYMMDD_<nnnnn>'), which sequence numbers are kept per."""
+        initial_pattern = re.match(r'([A-Za-z0-9]+)_', file_pattern)
+        return initial_pattern.group(1) if initial_pattern else None
 
-    def build_filename(self, pattern, seq_num):
+    def build_filename(self, pattern, seq_num, now=None):
         """Generate a new filename based on the pattern and sequence number."""
-        date = datetime.now().strftime('%y%m%d')
-        mmdd = datetime.now().strftime('%m%d')
+        now = now or datetime.now()
+        date = now.strftime('%y%m%d')
+        mmdd = now.strftime('%m%d')
         return pattern.replace('YYMMDD', date).replace('<nnnnn>', f'{seq_num:05d}').replace('MMDD', mmdd)
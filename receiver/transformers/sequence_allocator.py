@@ -0,0 +1,157 @@
+import fcntl
+import json
+import os
+import re
+import socket
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+from utils.atomic_publish import process_alive
+from utils.logger import get_logger
+
+STATE_FILE_NAME = '.sequence_state.json'
+LOCK_FILE_NAME = '.sequence_state.lock'
+HOST_NAME = socket.gethostname()
+
+
+class SequenceAllocator:
+    """
+    Hands out the <nnnnn> sequence numbers used by the rename pattern.
+
+    The last number given out for each (prefix, YYMMDD) is kept in a small JSON state file inside the
+    destination directory, so allocating a number does not need to list the directory. A number is
+    reserved when a file is planned and settled once its copies were published: commit() keeps it,
+    release() gives it back. Numbers always follow the file order, so only the highest numbers given out
+    are rolled back; a lower released number stays a gap rather than going to a later file.
+
+    The state is rebuilt from a single directory scan (never going below the numbers it already gave
+    out) when it is missing, unreadable or belongs to a previous day, when a reservation of a process of
+    this host that died is found, and when the file of the next number already exists, e.g. it was added
+    by hand or by another tool. Other changes to the directory, like the dispatcher deleting triggers,
+    do not cause a scan.
+    """
+
+    def __init__(self, dest_dir):
+        self.dest_dir = Path(dest_dir)
+        self.state_file = self.dest_dir / STATE_FILE_NAME
+        self.lock_file = self.dest_dir / LOCK_FILE_NAME
+        self.logger = get_logger('receiver_logger')
+
+    def next_sequence_number(self, prefix, now=None, file_name=None):
+        """
+        Atomically reserve the next sequence number for the prefix and the current date.
+
+        :param file_name: Optional callable returning the file name of a number, checked to not exist yet.
+        """
+        current_date = (now or datetime.now()).strftime('%y%m%d')
+
+        with self.locked():
+            state = self.load_state()
+            entry = state.get(prefix)
+
+            if self.is_stale(entry, current_date, file_name):
+                entry = self.rebuild_entry(prefix, entry, current_date)
+
+            sequence_number = entry['last'] = entry['last'] + 1
+            entry['reserved'][str(sequence_number)] = [HOST_NAME, os.getpid()]
+            state[prefix] = entry
+            self.save_state(state)
+
+        return sequence_number
+
+    def commit(self, prefix, date, sequence_number):
+        """Keep a reserved number: the file it was given to is published."""
+        self.settle(prefix, date, sequence_number, released=False)
+
+    def release(self, prefix, date, sequence_number):
+        """Give a reserved number back because its file was not published."""
+        self.settle(prefix, date, sequence_number, released=True)
+
+    def settle(self, prefix, date, sequence_number, released):
+        with self.locked():
+            state = self.load_state()
+            entry = state.get(prefix)
+            # Numbers of a previous day, or dropped by a rebuild, have nothing left to settle
+            if not self.is_entry(entry) or entry['date'] != date:
+                return
+            if entry['reserved'].pop(str(sequence_number), None) is None:
+                return
+
+            if released:
+                # Only the highest numbers go back; a lower one is kept as a gap until those above it are
+                # released too, so no later file is ever numbered below a published one
+                entry['released'].append(sequence_number)
+                while entry['last'] in entry['released']:
+                    entry['released'].remove(entry['last'])
+                    entry['last'] -= 1
+            self.save_state(state)
+
+    def is_stale(self, entry, current_date, file_name):
+        if not self.is_entry(entry) or entry['date'] != current_date:
+            return True
+        for host, pid in entry['reserved'].values():
+            if host == HOST_NAME and not process_alive(pid):
+                # Crashed while copying: its file may have been published without being committed
+                return True
+        # A file numbered behind its back; one stat rather than listing the directory on every change
+        return file_name is not None and (self.dest_dir / file_name(entry['last'] + 1)).exists()
+
+    @staticmethod
+    def is_entry(entry):
+        return isinstance(entry, dict) and {'date', 'last', 'released', 'reserved'} <= entry.keys()
+
+    def rebuild_entry(self, prefix, entry, current_date):
+        """Rescan the directory, keeping today's numbers still reserved by live processes."""
+        last_sequence_number = self.scan_last_sequence_number(prefix, current_date)
+        reserved = {}
+        if isinstance(entry, dict) and entry.get('date') == current_date:
+            reserved = {number: [host, pid] for number, (host, pid) in entry.get('reserved', {}).items()
+                        if host != HOST_NAME or process_alive(pid)}
+            last_sequence_number = max([last_sequence_number, entry.get('last', 0), *map(int, reserved)])
+        self.logger.info(f"Rebuilt sequence state for {prefix}_{current_date} in {self.dest_dir}: "
+                         f"last sequence number is {last_sequence_number}")
+        return {'date': current_date, 'last': last_sequence_number, 'released': [], 'reserved': reserved}
+
+    @contextmanager
+    def locked(self):
+        """Hold an exclusive lock on the destination's sequence state."""
+        self.dest_dir.mkdir(parents=True, exist_ok=True)
+        with open(self.lock_file, 'a') as lock:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+
+    def load_state(self):
+        """Load the state file, treating a missing or corrupt file as empty state."""
+        try:
+            with open(self.state_file, 'r') as f:
+                state = json.load(f)
+            return state if isinstance(state, dict) else {}
+        except FileNotFoundError:
+            return {}
+        except (ValueError, OSError) as e:
+            self.logger.warning(f"Ignoring unreadable sequence state {self.state_file}: {str(e)}")
+            return {}
+
+    def save_state(self, state):
+        """Write the state file atomically so a crash never leaves it half written."""
+        tmp_file = self.state_file.with_name(f"{STATE_FILE_NAME}.{os.getpid()}.tmp")
+        with open(tmp_file, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_file, self.state_file)
+
+    def scan_last_sequence_number(self, prefix, current_date):
+        """Find the highest sequence number already used for the prefix and date with one directory scan."""
+        sequence_regex = re.compile(rf'{re.escape(prefix)}_{current_date}_(\d{{5}})_\d{{2}}\(\d{{4}}\)\.csv')
+        last_sequence_number = 0
+
+        with os.scandir(self.dest_dir) as entries:
+            for entry in entries:
+                match = sequence_regex.match(entry.name)
+                if match:
+                    last_sequence_number = max(last_sequence_number, int(match.group(1)))
+
+        return last_sequence_number
@@ -1,5 +1,5 @@
-from receiver.transformers.base_transformer import BaseTransformer
 from receiver.transformers.no_op_transformer import NoOpTransformer
+from receiver.transformers.record_transformer import RecordTransformer
 from receiver.transformers.rename_transformer import RenameTransformer
 
 class TransformerFactory:
@@ -9,5 +9,7 @@ class TransformerFactory:
             return RenameTransformer(config)
         elif type == 'None':
             return NoOpTransformer()  # No transformation needed
+        elif type == 'Records':
+            return RecordTransformer(config)
         else:
             raise ValueError(f"Unknown transformer type: {type}")
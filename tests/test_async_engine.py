@@ -0,0 +1,128 @@
+import asyncio
+import logging
+import threading
+import time
+from pathlib import Path
+
+from dispatcher.async_engine import AsyncDispatchEngine
+from utils.transfer_scheduler import TransferScheduler
+
+
+class FakeDispatcher:
+    """
+    Lists its batches (after listing_delay seconds) and records what it dispatches; a dispatch takes
+    dispatch_delay seconds, stopping early when cancelled.
+    """
+
+    def __init__(self, name, batches, listing_delay=0, dispatch_delay=0, timeout=None):
+        self.source_directory = Path(name)
+        self.batches = batches
+        self.listing_delay = listing_delay
+        self.dispatch_delay = dispatch_delay
+        self.timeout = timeout
+        self.discovery_batch_size = 100
+        self.cancelled = threading.Event()
+        self.dispatched = []
+        self.passes_completed = 0
+
+    def find_file_batches(self):
+        time.sleep(self.listing_delay)
+        if isinstance(self.batches, Exception):
+            raise self.batches
+        for batch in self.batches:
+            yield [Path(name) for name in batch]
+
+    def dispatch(self, files):
+        self.cancelled.wait(self.dispatch_delay)
+        if not self.cancelled.is_set():
+            self.dispatched.append([file.name for file in files])
+
+    def complete_pass(self):
+        self.passes_completed += 1
+
+
+def run_pass(*dispatchers, feeds=()):
+    engine = AsyncDispatchEngine(list(dispatchers), TransferScheduler(feeds))
+    try:
+        engine.run_pass()
+    finally:
+        engine.close()
+
+
+def test_every_directory_is_dispatched_in_priority_order():
+    urgent_last = FakeDispatcher('a', [['B.dat', 'URGENT.dat']])
+    empty = FakeDispatcher('b', [])
+
+    run_pass(urgent_last, empty, feeds=[{'pattern': 'URGENT*', 'priority': 1}])
+
+    assert urgent_last.dispatched == [['URGENT.dat'], ['B.dat']]
+    assert (empty.dispatched, empty.passes_completed) == ([], 1)
+
+
+def test_a_slow_directory_does_not_hold_up_the_others():
+    slow = FakeDispatcher('slow', [['S.dat']], dispatch_delay=0.5)
+    fast = FakeDispatcher('fast', [['F.dat']])
+
+    started = time.monotonic()
+    run_pass(slow, fast)
+
+    assert time.monotonic() - started < 0.9
+    assert slow.dispatched == [['S.dat']] and fast.dispatched == [['F.dat']]
+
+
+def test_a_directory_over_its_timeout_is_cancelled(caplog):
+    stuck = FakeDispatcher('stuck', [['S.dat']], dispatch_delay=30, timeout=0.2)
+    other = FakeDispatcher('other', [['O.dat']])
+
+    started = time.monotonic()
+    with caplog.at_level(logging.WARNING, logger='dispatcher_logger'):
+        run_pass(stuck, other)
+
+    assert time.monotonic() - started < 5
+    assert stuck.dispatched == [] and other.dispatched == [['O.dat']]
+    assert 'exceeded its 0.2s timeout' in caplog.text
+    # Cleared for the next pass once the dispatcher stopped
+    assert not stuck.cancelled.is_set()
+
+
+def test_the_timeout_covers_the_first_listing():
+    slow_listing = FakeDispatcher('slow', [['S.dat'], ['T.dat']], listing_delay=0.5, timeout=0.2)
+
+    run_pass(slow_listing)
+
+    # Cancelled while its first batch was being listed, so nothing is dispatched until the next pass
+    assert slow_listing.dispatched == []
+
+
+def test_an_interrupted_pass_cancels_its_directories():
+    stuck = FakeDispatcher('stuck', [['S.dat']], dispatch_delay=30)
+    engine = AsyncDispatchEngine([stuck], TransferScheduler())
+
+    async def interrupt():
+        task = asyncio.ensure_future(engine.dispatch_all())
+        await asyncio.sleep(0.2)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            return True
+        return False
+
+    started = time.monotonic()
+    try:
+        assert asyncio.run(interrupt())
+    finally:
+        engine.close()
+    assert time.monotonic() - started < 5
+    assert stuck.dispatched == []
+
+
+def test_a_failing_listing_is_logged_and_the_others_go_on(caplog):
+    broken = FakeDispatcher('broken', OSError('share offline'))
+    other = FakeDispatcher('other', [['O.dat']])
+
+    with caplog.at_level(logging.ERROR, logger='dispatcher_logger'):
+        run_pass(broken, other)
+
+    assert 'Error in processing broken: share offline' in caplog.text
+    assert other.dispatched == [['O.dat']]
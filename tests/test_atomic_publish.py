@@ -0,0 +1,94 @@
+import os
+import subprocess
+import sys
+import time
+
+from utils.atomic_publish import Publisher, sweep_parts, temp_path
+from utils.file_utils import copy_file
+
+
+def dead_pid():
+    process = subprocess.run([sys.executable, '-c', 'import os; print(os.getpid())'], capture_output=True, text=True)
+    return int(process.stdout)
+
+
+def part(directory, name, pid, age=0):
+    path = directory / f'.{name}.{pid}.part'
+    path.touch()
+    if age:
+        old = time.time() - age
+        os.utime(path, (old, old))
+    return path
+
+
+def test_a_trigger_follows_its_data_file(tmp_path):
+    publisher = Publisher(batch_ms=5)
+    data, trigger = str(tmp_path / 'F.dat'), str(tmp_path / 'F.trg')
+    for path in (data, trigger):
+        with open(temp_path(path), 'w') as f:
+            f.write('x')
+
+    published = publisher.publish(temp_path(data), data)
+    assert publisher.publish(temp_path(trigger), trigger, published).result() == trigger
+    assert sorted(os.listdir(tmp_path)) == ['F.dat', 'F.trg']
+
+
+def test_a_trigger_is_dropped_when_its_data_file_failed(tmp_path):
+    publisher = Publisher(batch_ms=5)
+    trigger = str(tmp_path / 'F.trg')
+    with open(temp_path(trigger), 'w') as f:
+        f.write('x')
+
+    published = publisher.publish(str(tmp_path / 'missing.part'), str(tmp_path / 'F.dat'))
+    failed = publisher.publish(temp_path(trigger), trigger, published)
+
+    assert publisher.wait([published, failed]).keys() == {published, failed}
+    assert os.listdir(tmp_path) == []
+
+
+def test_sweep_removes_only_old_parts_of_dead_processes(tmp_path):
+    pid = dead_pid()
+    stale = part(tmp_path, 'A.dat', pid, age=3600)
+    recent = part(tmp_path, 'B.dat', pid)
+    running = part(tmp_path, 'C.dat', os.getppid(), age=3600)
+    own = part(tmp_path, 'D.dat', os.getpid(), age=3600)
+    (tmp_path / 'E.part').touch()
+
+    assert sweep_parts(str(tmp_path)) == 1
+
+    assert not stale.exists()
+    assert recent.exists() and running.exists() and own.exists() and (tmp_path / 'E.part').exists()
+
+
+def test_a_publisher_sweeps_a_directory_on_its_first_publish(tmp_path):
+    stale = part(tmp_path, 'A.dat', dead_pid(), age=3600)
+    publisher = Publisher(fsync=False)
+    dst = str(tmp_path / 'F.dat')
+    open(temp_path(dst), 'w').close()
+
+    publisher.publish(temp_path(dst), dst).result()
+    assert not stale.exists()
+
+    # Only once per directory
+    stale = part(tmp_path, 'B.dat', dead_pid(), age=3600)
+    open(temp_path(dst), 'w').close()
+    publisher.publish(temp_path(dst), dst).result()
+    assert stale.exists()
+
+
+def test_a_copy_appears_only_once_complete(tmp_path, monkeypatch):
+    (tmp_path / 'src').mkdir()
+    (tmp_path / 'dst').mkdir()
+    src, dst = tmp_path / 'src' / 'F.dat', str(tmp_path / 'dst' / 'F.dat')
+    src.write_bytes(os.urandom(64 * 1024))
+    names = []
+    replace = os.replace
+    monkeypatch.setattr(os, 'replace', lambda partial, target: names.append(sorted(os.listdir(tmp_path / 'dst')))
+                        or replace(partial, target))
+
+    copy_file(str(src), dst, publisher=Publisher(fsync=False)).result()
+
+    # Only the temp name is visible until the rename
+    assert names == [[os.path.basename(temp_path(dst))]]
+    assert os.listdir(tmp_path / 'dst') == ['F.dat']
+    assert (tmp_path / 'dst' / 'F.dat').read_bytes() == src.read_bytes()
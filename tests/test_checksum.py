@@ -0,0 +1,66 @@
+import hashlib
+import os
+import shutil
+import subprocess
+
+import pytest
+
+from dispatcher.shared_drive_dispatcher import SharedDriveDispatcher
+from receiver.istar_cx_receiver import IStarCXReceiver
+from utils.atomic_publish import Publisher
+from utils.checksum import new_hasher, write_sidecar
+
+
+def test_hashers_come_from_hashlib_or_xxhash():
+    assert new_hasher('sha256').name == 'sha256'
+    with pytest.raises(ValueError, match='Unknown checksum algorithm'):
+        new_hasher('sha257')
+
+
+def test_a_sidecar_is_in_sha256sum_format(tmp_path):
+    data_file = tmp_path / 'F.csv'
+    data_file.write_bytes(b'records\n')
+    digest = hashlib.sha256(b'records\n').hexdigest()
+
+    write_sidecar(str(data_file), digest, 'sha256', Publisher(fsync=False)).result()
+
+    assert sorted(os.listdir(tmp_path)) == ['F.csv', 'F.csv.sha256']
+    assert (tmp_path / 'F.csv.sha256').read_text() == f"{digest}  F.csv\n"
+    if shutil.which('sha256sum'):
+        subprocess.run(['sha256sum', '-c', 'F.csv.sha256'], cwd=tmp_path, check=True, capture_output=True)
+
+
+def test_the_receiver_hashes_the_data_file_while_copying_it(tmp_path):
+    source, destination = tmp_path / 'src', tmp_path / 'dst'
+    source.mkdir()
+    content = os.urandom(3 * 1024 * 1024)
+    (source / 'OL_0360_01_0930_CXI046.dat').write_bytes(content)
+    (source / 'OL_0360_01_0930_CXI046.trg').touch()
+
+    IStarCXReceiver({'name': 'receiver', 'servers': [{
+        'server_name': 'i-star-cx', 'source_path': str(source),
+        'files': [{'file_name_pattern': 'OL_0360_nn_hhmm_CXI046.dat', 'destination': [
+            {'path': str(destination), 'should_process': 'None', 'checksum': 'sha256', 'checksum_sidecar': True}]}],
+    }]}).process_files()
+
+    assert sorted(os.listdir(destination)) == ['OL_0360_01_0930_CXI046.dat', 'OL_0360_01_0930_CXI046.dat.sha256']
+    assert (destination / 'OL_0360_01_0930_CXI046.dat.sha256').read_text() == \
+        f"{hashlib.sha256(content).hexdigest()}  OL_0360_01_0930_CXI046.dat\n"
+
+
+def test_the_shared_drive_dispatcher_writes_a_sidecar_next_to_the_file(tmp_path):
+    source, destination = tmp_path / 'src', tmp_path / 'dst'
+    source.mkdir()
+    destination.mkdir()
+    (source / 'F.csv').write_bytes(b'records\n')
+    (source / 'F.trg').touch()
+
+    SharedDriveDispatcher({'source_directory': str(source),
+                           'destination_details': {'shared_drive_path': str(destination)},
+                           'file_extension': '.csv', 'trigger_extension': '.trg',
+                           'checksum': 'md5', 'checksum_sidecar': True}, 'TEST').dispatch()
+
+    assert sorted(os.listdir(destination)) == ['F.csv', 'F.csv.md5']
+    digest = hashlib.md5(b'records\n').hexdigest()
+    assert (destination / 'F.csv.md5').read_text() == f"{digest}  F.csv\n"
+    assert os.listdir(source) == ['F.csv']
@@ -0,0 +1,46 @@
+import gzip
+import hashlib
+import os
+
+import pytest
+
+from dispatcher.compression import Compression
+
+
+@pytest.fixture
+def local_file(tmp_path):
+    path = tmp_path / 'F.dat'
+    path.write_bytes(b'046 0360 20261018 ACC0000123456 GBP 0000001234.56\n' * 20000 + os.urandom(1000))
+    return path
+
+
+def decompressor(codec):
+    """The decompression of the codec, skipping the test when its package is not installed."""
+    if codec == 'gzip':
+        return gzip.decompress
+    if codec == 'zstd':
+        return pytest.importorskip('zstandard').ZstdDecompressor().decompressobj().decompress
+    return pytest.importorskip('lz4.frame').decompress
+
+
+@pytest.mark.parametrize('codec', ['gzip', 'zstd', 'lz4'])
+def test_compressed_blocks_round_trip(local_file, codec):
+    decompress = decompressor(codec)
+    hasher = hashlib.sha256()
+
+    compressed = b''.join(Compression({'codec': codec}).compressed_blocks(local_file, 64 * 1024, hasher))
+
+    assert len(compressed) < local_file.stat().st_size
+    assert decompress(compressed) == local_file.read_bytes()
+    assert hasher.hexdigest() == hashlib.sha256(local_file.read_bytes()).hexdigest()
+
+
+def test_a_read_error_reaches_the_uploader(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        list(Compression({'codec': 'gzip'}).compressed_blocks(tmp_path / 'missing.dat', 1024))
+
+
+def test_unknown_codec_is_rejected():
+    with pytest.raises(ValueError):
+        Compression({'codec': 'brotli'})
+
@@ -0,0 +1,104 @@
+import json
+import os
+
+import pytest
+import yaml
+
+from utils.config_loader import load_config, plan_cache_path
+
+CONFIG = "directories:\n  - source_directory: ops\n    enabled: true\n"
+# The validate flag of every plan compile_plan built
+compiled = []
+
+
+def compile_plan(config, validate=True):
+    compiled.append(validate)
+    if validate and 'directories' not in config:
+        raise ValueError("Missing 'directories'")
+    return {'validated': validate, **config}
+
+
+@pytest.fixture
+def config_path(tmp_path):
+    compiled.clear()
+    path = tmp_path / 'dispatcher_config.yaml'
+    path.write_text(CONFIG)
+    return str(path)
+
+
+@pytest.fixture
+def yaml_loads(monkeypatch):
+    loads = []
+    safe_load = yaml.safe_load
+    monkeypatch.setattr(yaml, 'safe_load', lambda content: loads.append(content) or safe_load(content))
+    return loads
+
+
+def test_an_unchanged_config_is_neither_parsed_nor_validated_again(config_path, yaml_loads):
+    first = load_config(config_path, compile_plan)
+    second = load_config(config_path, compile_plan)
+
+    assert first['directories'] == second['directories'] == [{'source_directory': 'ops', 'enabled': True}]
+    assert len(yaml_loads) == 1
+    assert compiled == [True, False]
+    assert os.path.exists(plan_cache_path(config_path))
+
+
+def test_a_touched_but_identical_config_is_matched_by_its_hash(config_path, yaml_loads):
+    load_config(config_path, compile_plan)
+    os.utime(config_path, (0, 0))
+
+    load_config(config_path, compile_plan)
+
+    assert len(yaml_loads) == 1
+    assert compiled == [True, False]
+
+
+def test_a_changed_config_is_validated_again(config_path, yaml_loads):
+    load_config(config_path, compile_plan)
+    with open(config_path, 'w') as f:
+        f.write("receivers: []\n")
+
+    with pytest.raises(ValueError, match="Missing 'directories'"):
+        load_config(config_path, compile_plan)
+    assert len(yaml_loads) == 2
+
+
+def test_a_cache_of_other_code_is_not_used(config_path, yaml_loads):
+    load_config(config_path, compile_plan)
+    cache_path = plan_cache_path(config_path)
+    with open(cache_path) as f:
+        cached = json.load(f)
+    cached['key'][-1] = 'digest of an older version'
+    with open(cache_path, 'w') as f:
+        json.dump(cached, f)
+
+    load_config(config_path, compile_plan)
+
+    assert compiled == [True, True]
+
+
+def test_a_corrupt_cache_is_ignored(config_path, yaml_loads):
+    with open(plan_cache_path(config_path), 'w') as f:
+        f.write('{not json')
+
+    assert load_config(config_path, compile_plan)['validated']
+    assert load_config(config_path, compile_plan)['validated'] is False
+
+
+def test_a_config_json_cannot_hold_is_not_cached(tmp_path):
+    path = tmp_path / 'receiver_config.yaml'
+    path.write_text("start: 2026-10-18\n")
+
+    assert str(load_config(str(path))['start']) == '2026-10-18'
+    assert not os.path.exists(plan_cache_path(str(path)))
+
+
+def test_bad_yaml_and_missing_configs_are_reported(tmp_path):
+    path = tmp_path / 'broken.yaml'
+    path.write_text("directories: [\n")
+
+    with pytest.raises(ValueError, match='Error parsing YAML file'):
+        load_config(str(path))
+    with pytest.raises(FileNotFoundError):
+        load_config(str(tmp_path / 'missing.yaml'))
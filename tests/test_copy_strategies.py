@@ -0,0 +1,98 @@
+import os
+
+import pytest
+
+from dispatcher.shared_drive_dispatcher import SharedDriveDispatcher
+from utils.copy_strategies import CopyStrategy, default_copy_strategy
+from utils.file_utils import fan_out_copy
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / 'src' / 'F.dat'
+    path.parent.mkdir()
+    path.write_bytes(os.urandom(3 * 1024 * 1024 + 17))
+    return path
+
+
+def destinations(tmp_path, count):
+    paths = []
+    for index in range(count):
+        directory = tmp_path / f'dst{index}'
+        directory.mkdir()
+        paths.append(str(directory / 'F.dat'))
+    return paths
+
+
+def test_the_default_strategy_is_not_tried_across_devices(source, tmp_path, monkeypatch):
+    dsts = destinations(tmp_path, 2)
+    cloned = []
+    monkeypatch.setattr(default_copy_strategy, 'same_device', lambda src, dst: False)
+    monkeypatch.setattr(default_copy_strategy, 'clone', lambda src, dst: cloned.append(dst))
+
+    assert fan_out_copy(source, dsts) == {}
+
+    assert cloned == []
+    for dst in dsts:
+        with open(dst, 'rb') as f:
+            assert f.read() == source.read_bytes()
+
+
+def test_a_pinned_strategy_is_tried_across_devices(source, tmp_path, monkeypatch):
+    [dst] = destinations(tmp_path, 1)
+    strategy = CopyStrategy(['copy_file_range', 'copy'])
+    calls = []
+    monkeypatch.setattr(strategy, 'device', lambda directory: hash(directory))
+    clone = strategy.clone
+    monkeypatch.setattr(strategy, 'clone', lambda src, dst: calls.append(dst) or clone(src, dst))
+
+    assert fan_out_copy(source, [dst], strategies={dst: strategy}) == {}
+
+    assert calls == [dst]
+    with open(dst, 'rb') as f:
+        assert f.read() == source.read_bytes()
+
+
+def test_hardlink_is_only_used_on_the_same_device(source, tmp_path):
+    [dst] = destinations(tmp_path, 1)
+    strategy = CopyStrategy(['hardlink', 'copy'])
+
+    assert strategy.clone(str(source), dst) == 'hardlink'
+    assert os.stat(dst).st_ino == source.stat().st_ino
+
+    strategy.devices[os.path.dirname(dst)] = -1
+    os.remove(dst)
+    assert strategy.clone(str(source), dst) is None
+
+
+def test_a_hardlink_left_at_the_destination_is_not_written_through(source, tmp_path):
+    [dst] = destinations(tmp_path, 1)
+    other = tmp_path / 'other.dat'
+    other.write_bytes(b'must stay')
+    os.link(other, dst)
+
+    assert fan_out_copy(source, [dst], strategies={dst: CopyStrategy(['copy_file_range', 'copy'])}) == {}
+
+    assert other.read_bytes() == b'must stay'
+    with open(dst, 'rb') as f:
+        assert f.read() == source.read_bytes()
+
+
+def test_unknown_strategy_is_rejected():
+    with pytest.raises(ValueError):
+        CopyStrategy(['rsync'])
+
+
+def test_the_shared_drive_dispatcher_copies_through_its_strategy(source, tmp_path):
+    source.with_suffix('.trg').touch()
+    destination = tmp_path / 'shared'
+    destination.mkdir()
+    dispatcher = SharedDriveDispatcher({'source_directory': str(source.parent),
+                                        'destination_details': {'shared_drive_path': str(destination)},
+                                        'file_extension': '.dat', 'trigger_extension': '.trg',
+                                        'copy_strategies': ['hardlink', 'copy']}, 'TEST')
+
+    dispatcher.dispatch()
+
+    assert os.listdir(destination) == ['F.dat']
+    assert (destination / 'F.dat').stat().st_ino == source.stat().st_ino
@@ -0,0 +1,96 @@
+import os
+
+import pytest
+
+from dispatcher.shared_drive_dispatcher import SharedDriveDispatcher
+from utils.dedupe_index import DELIVER, DROP, FINGERPRINT_WINDOW, DedupeIndex, DedupePolicy
+
+
+@pytest.fixture
+def index(tmp_path):
+    return DedupeIndex(str(tmp_path / 'dedupe.db'))
+
+
+def write(path, content):
+    path.write_bytes(content)
+    return path
+
+
+def deliver(index, path, destination='/gc'):
+    key, original = index.find(destination, path, index.content_key(path))
+    if original is None:
+        index.record(destination, path, key)
+    return original
+
+
+def test_same_content_under_another_name_is_a_duplicate(index, tmp_path):
+    first = write(tmp_path / 'F_1200.dat', b'records\n' * 10)
+    second = write(tmp_path / 'F_1215.dat', b'records\n' * 10)
+
+    assert deliver(index, first) is None
+    assert deliver(index, second) == 'F_1200.dat'
+    # Per destination
+    assert deliver(index, second, '/ops') is None
+
+
+def test_large_files_differing_only_in_the_middle_are_not_duplicates(index, tmp_path):
+    head, tail = os.urandom(FINGERPRINT_WINDOW), os.urandom(FINGERPRINT_WINDOW)
+    first = write(tmp_path / 'A.dat', head + b'a' * 1000 + tail)
+    second = write(tmp_path / 'B.dat', head + b'b' * 1000 + tail)
+    third = write(tmp_path / 'C.dat', head + b'a' * 1000 + tail)
+
+    assert index.content_key(first).fingerprint == index.content_key(second).fingerprint
+    assert index.content_key(first).sha256 is None
+    assert deliver(index, first) is None
+    assert deliver(index, second) is None
+    assert deliver(index, third) == 'A.dat'
+
+
+def test_an_earlier_file_that_changed_since_cannot_be_confirmed(index, tmp_path):
+    head, tail = os.urandom(FINGERPRINT_WINDOW), os.urandom(FINGERPRINT_WINDOW)
+    first = write(tmp_path / 'A.dat', head + b'a' * 1000 + tail)
+    assert deliver(index, first) is None
+    stat = first.stat()
+    write(first, head + b'z' * 1000 + tail)
+    os.utime(first, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+
+    assert deliver(index, write(tmp_path / 'B.dat', head + b'a' * 1000 + tail)) is None
+
+
+def test_evict_keeps_the_newest_entries(index, tmp_path):
+    for number in range(5):
+        deliver(index, write(tmp_path / f'F{number}.dat', b'%d' % number))
+
+    assert index.evict('/gc', max_entries=2) == 3
+    assert deliver(index, write(tmp_path / 'G0.dat', b'0')) is None
+    assert deliver(index, write(tmp_path / 'G4.dat', b'4')) == 'F4.dat'
+
+
+def test_policy_per_feed(index):
+    policy = DedupePolicy(index, DROP, [{'pattern': 'CXI046_*', 'duplicates': DELIVER}])
+
+    assert policy.policy_for('CXI046_1.csv') == DELIVER
+    assert policy.policy_for('CXI027_1.csv') == DROP
+    with pytest.raises(ValueError):
+        DedupePolicy(index, 'keep')
+
+
+def test_dispatcher_drops_a_duplicate_and_deletes_its_trigger(tmp_path):
+    source, destination = tmp_path / 'src', tmp_path / 'dst'
+    source.mkdir()
+    destination.mkdir()
+    config = {'source_directory': str(source), 'destination_type': 'shared_drive',
+              'destination_details': {'shared_drive_path': str(destination)},
+              'file_extension': '.dat', 'trigger_extension': '.trg', 'enabled': True,
+              'dedupe': {'index_path': str(tmp_path / 'dedupe.db')}}
+    dispatcher = SharedDriveDispatcher(config, 'TEST')
+
+    for name in ('F_1200', 'F_1215'):
+        (source / f'{name}.dat').write_bytes(b'same records\n')
+        (source / f'{name}.trg').touch()
+        dispatcher.dispatch()
+
+    assert sorted(os.listdir(destination)) == ['F_1200.dat']
+    assert sorted(os.listdir(source)) == ['F_1200.dat', 'F_1215.dat']
+    [(_, _, name, original, delivered)] = dispatcher.dedupe.index.aliases()
+    assert (name, original, delivered) == ('F_1215.dat', 'F_1200.dat', 0)
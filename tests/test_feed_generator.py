@@ -0,0 +1,19 @@
+import os
+
+from benchmarks.feed_generator import generate_feed_tree, receiver_config
+from receiver.routing_plan import compile_receiver_plan
+
+
+def test_every_generated_file_has_a_trigger_and_a_route(tmp_path):
+    total_bytes = generate_feed_tree(str(tmp_path / 'src'), 30, 2048, 'uniform')
+
+    names = os.listdir(tmp_path / 'src')
+    data_files = [name for name in names if name.endswith('.dat')]
+    assert len(data_files) == 30
+    assert sorted(name[:-len('.trg')] for name in names if name.endswith('.trg')) == \
+        sorted(name[:-len('.dat')] for name in data_files)
+    assert sum(os.path.getsize(tmp_path / 'src' / name) for name in data_files) == total_bytes
+
+    config = receiver_config(str(tmp_path / 'src'), str(tmp_path / 'ops'), str(tmp_path / 'gloss'), concurrency=4)
+    [matchers] = compile_receiver_plan({'receivers': [config]}).matchers
+    assert all(matchers[str(tmp_path / 'src')].match(name) for name in data_files)
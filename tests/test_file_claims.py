@@ -0,0 +1,110 @@
+import os
+import threading
+import time
+
+import pytest
+
+from receiver.istar_cx_receiver import IStarCXReceiver
+from utils.file_claims import CLAIM_MARKER, FileClaims
+
+
+@pytest.fixture
+def trigger(tmp_path):
+    path = tmp_path / 'F.trg'
+    path.touch()
+    return str(path)
+
+
+def age(path, seconds):
+    old = time.time() - seconds
+    os.utime(path, (old, old))
+
+
+def test_only_one_node_wins_a_trigger(trigger):
+    first, second = FileClaims('node-a'), FileClaims('node-b')
+
+    claim_path = first.claim(trigger)
+
+    assert claim_path == f"{trigger}{CLAIM_MARKER}node-a"
+    assert second.claim(trigger) is None
+    assert not os.path.exists(trigger)
+    assert FileClaims.trigger_path(claim_path) == trigger
+
+
+def test_a_claim_starts_a_fresh_lease(trigger):
+    age(trigger, 3600)
+    claims = FileClaims('node-a', lease_seconds=60)
+
+    claim_path = claims.claim(trigger)
+
+    assert time.time() - os.stat(claim_path).st_mtime < 60
+    assert FileClaims('node-b', lease_seconds=60).reclaim_expired(
+        os.path.dirname(trigger), [os.path.basename(claim_path)]) == []
+
+
+def test_an_expired_claim_is_restored_to_its_trigger(trigger):
+    claim_path = FileClaims('dead-node', lease_seconds=60).claim(trigger)
+    age(claim_path, 120)
+
+    restored = FileClaims('node-b', lease_seconds=60).reclaim_expired(
+        os.path.dirname(trigger), [os.path.basename(claim_path)])
+
+    assert restored == [os.path.basename(trigger)]
+    assert os.path.exists(trigger)
+    assert not os.path.exists(claim_path)
+
+
+def test_a_node_never_reclaims_what_it_holds(trigger):
+    claims = FileClaims('node-a', lease_seconds=60)
+    claim_path = claims.claim(trigger)
+    age(claim_path, 120)
+    directory, name = os.path.dirname(trigger), os.path.basename(claim_path)
+
+    assert claims.reclaim_expired(directory, [name]) == []
+
+    claims.release(claim_path)
+    assert claims.reclaim_expired(directory, [name]) == [os.path.basename(trigger)]
+
+
+def test_held_claims_are_renewed(trigger):
+    claims = FileClaims('node-a', lease_seconds=0.3)
+    claim_path = claims.claim(trigger)
+    age(claim_path, 120)
+
+    deadline = time.time() + 5
+    while time.time() - os.stat(claim_path).st_mtime > 60 and time.time() < deadline:
+        time.sleep(0.05)
+
+    assert time.time() - os.stat(claim_path).st_mtime < 60
+
+
+def test_node_names_cannot_contain_a_path_separator():
+    with pytest.raises(ValueError):
+        FileClaims(f'a{os.sep}b')
+
+
+def test_two_receiver_nodes_copy_each_file_once(tmp_path):
+    source = tmp_path / 'src'
+    source.mkdir()
+    for index in range(8):
+        (source / f'OL_0360_0{index}_0930_CXI046.dat').write_bytes(b'records')
+        (source / f'OL_0360_0{index}_0930_CXI046.trg').touch()
+
+    def receiver(node):
+        return IStarCXReceiver({'name': 'receiver', 'claims': {'node': node}, 'servers': [{
+            'server_name': 'i-star-cx', 'source_path': str(source),
+            'files': [{'file_name_pattern': 'OL_0360_nn_hhmm_CXI046.dat', 'destination': [
+                {'path': str(tmp_path / node), 'should_process': 'None'}]}],
+        }]})
+
+    nodes = [receiver('node-a'), receiver('node-b')]
+    threads = [threading.Thread(target=node.process_files) for node in nodes]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    copied = [name for node in ('node-a', 'node-b') if (tmp_path / node).exists()
+              for name in os.listdir(tmp_path / node)]
+    assert sorted(copied) == [f'OL_0360_0{index}_0930_CXI046.dat' for index in range(8)]
+    assert not any(name.endswith('.trg') or CLAIM_MARKER in name for name in os.listdir(source))
@@ -0,0 +1,93 @@
+import builtins
+import hashlib
+import os
+
+import pytest
+
+import utils.file_utils
+from utils.atomic_publish import Publisher
+from utils.copy_strategies import CopyStrategy
+from utils.file_utils import fan_out_copy, parallel_copy
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / 'src' / 'F.dat'
+    path.parent.mkdir()
+    path.write_bytes(os.urandom(3 * 1024 * 1024 + 17))
+    return path
+
+
+def destinations(tmp_path, count):
+    paths = []
+    for index in range(count):
+        directory = tmp_path / f'dst{index}'
+        directory.mkdir()
+        paths.append(str(directory / 'F.dat'))
+    return paths
+
+
+def user_space(dsts):
+    """Leave every destination to the user-space copy, as between two filesystems."""
+    return {dst: CopyStrategy('copy') for dst in dsts}
+
+
+def test_fan_out_reads_the_source_once_for_every_destination(source, tmp_path, monkeypatch):
+    dsts = destinations(tmp_path, 3)
+    hasher = hashlib.sha256()
+    opened = []
+
+    def counting_open(file, mode='r', *args, **kwargs):
+        opened.append((str(file), mode))
+        return builtins.open(file, mode, *args, **kwargs)
+
+    monkeypatch.setattr(utils.file_utils, 'open', counting_open, raising=False)
+
+    assert fan_out_copy(source, dsts, buffer_size=64 * 1024, hasher=hasher, strategies=user_space(dsts)) == {}
+
+    assert [mode for file, mode in opened if file == str(source)] == ['rb']
+    content = source.read_bytes()
+    for dst in dsts:
+        with open(dst, 'rb') as f:
+            assert f.read() == content
+    assert hasher.hexdigest() == hashlib.sha256(content).hexdigest()
+
+
+def test_a_failing_destination_does_not_affect_the_others(source, tmp_path):
+    dsts = destinations(tmp_path, 2) + [str(tmp_path / 'missing' / 'F.dat')]
+
+    failures = fan_out_copy(source, dsts, strategies=user_space(dsts))
+
+    assert list(failures) == [dsts[2]]
+    for dst in dsts[:2]:
+        with open(dst, 'rb') as f:
+            assert f.read() == source.read_bytes()
+
+
+@pytest.mark.parametrize('chunk_size', [512 * 1024, 64 * 1024])
+def test_parallel_copy_hashes_the_ranges_it_reads(source, tmp_path, monkeypatch, chunk_size):
+    [dst] = destinations(tmp_path, 1)
+    hasher = hashlib.sha256()
+    read = []
+    pread = os.pread
+    monkeypatch.setattr(os, 'pread', lambda fd, length, offset: read.append(length) or pread(fd, length, offset))
+
+    parallel_copy(source, dst, workers=3, chunk_size=chunk_size, hasher=hasher,
+                  publisher=Publisher(fsync=False)).result()
+
+    content = source.read_bytes()
+    assert sum(read) == len(content)
+    with open(dst, 'rb') as f:
+        assert f.read() == content
+    assert hasher.hexdigest() == hashlib.sha256(content).hexdigest()
+
+
+def test_parallel_copy_of_an_empty_file(tmp_path):
+    [dst] = destinations(tmp_path, 1)
+    (tmp_path / 'empty.dat').touch()
+    hasher = hashlib.sha256()
+
+    parallel_copy(tmp_path / 'empty.dat', dst, hasher=hasher, publisher=Publisher(fsync=False)).result()
+
+    assert os.path.getsize(dst) == 0
+    assert hasher.hexdigest() == hashlib.sha256(b'').hexdigest()
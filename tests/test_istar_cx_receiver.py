@@ -0,0 +1,59 @@
+from datetime import datetime
+
+from receiver.istar_cx_receiver import IStarCXReceiver
+
+RENAME_PATTERN = 'CXI046_YYMMDD_<nnnnn>_01(MMDD).csv'
+
+
+def receiver_config(source, ops, gloss, **settings):
+    return dict({'name': 'receiver', 'servers': [{
+        'server_name': 'i-star-cx',
+        'source_path': str(source),
+        'files': [{'file_name_pattern': 'OL_0360_nn_hhmm_CXI046.dat', 'destination': [
+            {'path': str(ops), 'should_process': 'Rename', 'process_config': {'rename_pattern': RENAME_PATTERN}},
+            {'path': str(gloss), 'should_process': 'None'},
+        ]}],
+    }]}, **settings)
+
+
+def write_feed(source, count):
+    source.mkdir()
+    names = []
+    for index in range(count):
+        names.append(f'OL_0360_{index:02}_0930_CXI046')
+        (source / f'{names[-1]}.dat').write_bytes(b'%d\n' % index * 1000)
+        (source / f'{names[-1]}.trg').touch()
+    return names
+
+
+def published(directory):
+    return sorted(path.name for path in directory.iterdir() if not path.name.startswith('.'))
+
+
+def test_one_file_is_copied_to_every_destination(tmp_path):
+    source, ops, gloss = tmp_path / 'src', tmp_path / 'ops', tmp_path / 'gloss'
+    [name] = write_feed(source, 1)
+
+    IStarCXReceiver(receiver_config(source, ops, gloss)).process_files()
+
+    renamed = RENAME_PATTERN.replace('YYMMDD', datetime.now().strftime('%y%m%d')) \
+        .replace('<nnnnn>', '00001').replace('MMDD', datetime.now().strftime('%m%d'))
+    assert published(ops) == [renamed, renamed.replace('.csv', '.trg')]
+    assert published(gloss) == [f'{name}.dat']
+    assert (ops / renamed).read_bytes() == (gloss / f'{name}.dat').read_bytes() == (source / f'{name}.dat').read_bytes()
+    assert published(source) == [f'{name}.dat']
+
+
+def test_concurrent_workers_keep_the_file_order_in_the_sequence_numbers(tmp_path):
+    source, ops, gloss = tmp_path / 'src', tmp_path / 'ops', tmp_path / 'gloss'
+    names = write_feed(source, 12)
+
+    IStarCXReceiver(receiver_config(source, ops, gloss, concurrency={'max_workers': 4})).process_files()
+
+    renamed = [name for name in published(ops) if name.endswith('.csv')]
+    assert len(renamed) == 12
+    for number, name in enumerate(names, start=1):
+        [data_file] = [renamed_file for renamed_file in renamed if f'_{number:05}_' in renamed_file]
+        assert (ops / data_file).read_bytes() == (source / f'{name}.dat').read_bytes()
+        assert (gloss / f'{name}.dat').exists()
+    assert published(source) == [f'{name}.dat' for name in names]
@@ -0,0 +1,43 @@
+import gzip
+
+import pytest
+
+pytest.importorskip('paramiko')
+
+from benchmarks.local_sftp_server import start_local_sftp_server
+from dispatcher.compression import Compression
+from dispatcher.sftp_pool import SFTPConnectionPool
+
+
+@pytest.fixture
+def sftp_pool():
+    pool = SFTPConnectionPool()
+    yield pool
+    pool.close_all()
+
+
+def test_only_the_decompress_script_is_run(tmp_path, sftp_pool):
+    connection = sftp_pool.get_connection('exec', start_local_sftp_server(str(tmp_path)))
+    (tmp_path / 'F.dat.gz').write_bytes(gzip.compress(b'records'))
+
+    for command in ['touch escaped', 'gzip -dc F.dat.gz > F.dat.part; touch escaped',
+                    'gzip -dc F.dat.gz > /tmp/x.part && mv -f /tmp/y.part F.dat && rm -f F.dat.gz']:
+        with pytest.raises(IOError, match='status 126'):
+            connection.run(command)
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['F.dat.gz']
+
+    connection.run(Compression({'codec': 'gzip'}).remote_decompress_script('/F.dat.gz', '/F.dat.part', '/F.dat'))
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['F.dat']
+    assert (tmp_path / 'F.dat').read_bytes() == b'records'
+
+
+def test_each_server_serves_its_own_root(tmp_path, sftp_pool):
+    roots = [tmp_path / 'a', tmp_path / 'b']
+    for root in roots:
+        root.mkdir()
+        (root / 'name').write_text(root.name)
+
+    for root in roots:
+        connection = sftp_pool.get_connection(root.name, start_local_sftp_server(str(root)))
+        with connection.channel() as sftp, sftp.open('/../../name') as remote:
+            assert remote.read() == root.name.encode()
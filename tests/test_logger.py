@@ -0,0 +1,111 @@
+import json
+import logging
+import queue
+import threading
+
+import utils.logger
+from utils.logger import JsonFormatter, NonBlockingQueueHandler, RateLimitFilter, SampleFilter
+from utils.metrics import LOG_RECORDS_DROPPED
+
+
+def make_record(level=logging.DEBUG, msg='Checked %s', args=('F.dat',), name='receiver_logger', **extra):
+    record = logging.LogRecord(name, level, __file__, 1, msg, args, None)
+    record.__dict__.update(extra)
+    return record
+
+
+def dropped_count(name):
+    return LOG_RECORDS_DROPPED.values.get(LOG_RECORDS_DROPPED.key({'logger': name}), 0)
+
+
+def test_records_are_queued_unformatted():
+    class Unformattable:
+        def __str__(self):
+            raise AssertionError('formatted on the hot path')
+
+    handler = NonBlockingQueueHandler(queue.Queue())
+    record = make_record(args=(Unformattable(),))
+
+    handler.handle(record)
+
+    assert handler.queue.get_nowait() is record
+
+
+def test_a_full_queue_drops_records_below_warning():
+    handler = NonBlockingQueueHandler(queue.Queue(1))
+    before = dropped_count('drop_test_logger')
+
+    handler.handle(make_record(name='drop_test_logger'))
+    handler.handle(make_record(logging.INFO, name='drop_test_logger'))
+
+    assert handler.queue.qsize() == 1
+    assert handler.dropped == 1
+    assert dropped_count('drop_test_logger') == before + 1
+
+
+def test_warnings_wait_for_room_in_a_full_queue():
+    handler = NonBlockingQueueHandler(queue.Queue(1))
+    handler.handle(make_record())
+    warning = make_record(logging.WARNING, 'Failed to copy %s')
+
+    thread = threading.Thread(target=handler.handle, args=(warning,))
+    thread.start()
+    thread.join(0.1)
+    assert thread.is_alive()
+
+    handler.queue.get_nowait()
+    thread.join(5)
+    assert handler.queue.get_nowait() is warning
+    assert handler.dropped == 0
+
+
+def test_drops_are_reported_once_the_queue_has_room(monkeypatch):
+    handler = NonBlockingQueueHandler(queue.Queue(2))
+    for _ in range(4):
+        handler.handle(make_record())
+    for _ in range(2):
+        handler.queue.get_nowait()
+
+    # Within the report interval the drops are only counted
+    handler.handle(make_record())
+    assert handler.queue.qsize() == 1
+    handler.queue.get_nowait()
+
+    monkeypatch.setattr(utils.logger, 'DROPPED_REPORT_INTERVAL', 0)
+    handler.handle(make_record())
+
+    report = handler.queue.queue[-1]
+    assert (report.levelno, report.getMessage()) == \
+        (logging.WARNING, 'Dropped 2 log records below WARNING: the logging queue was full')
+    assert handler.unreported == 0
+
+
+def test_json_lines_carry_the_extra_fields():
+    line = JsonFormatter().format(make_record(logging.INFO, destination='/gloss', bytes=7))
+
+    entry = json.loads(line)
+    assert entry['message'] == 'Checked F.dat'
+    assert (entry['level'], entry['logger'], entry['destination'], entry['bytes']) == \
+        ('INFO', 'receiver_logger', '/gloss', 7)
+
+
+def test_sampling_lets_one_in_every_n_debug_records_through():
+    sample = SampleFilter(every=10)
+
+    passed = [sample.filter(make_record()) for _ in range(25)]
+
+    assert passed.count(True) == 3
+    assert sample.filter(make_record(logging.INFO))
+
+
+def test_rate_limiting_counts_the_suppressed_records():
+    limit = RateLimitFilter(rate=0.001, burst=2)
+
+    passed = [limit.filter(make_record(logging.INFO)) for _ in range(5)]
+    assert passed == [True, True, False, False, False]
+    assert limit.filter(make_record(logging.WARNING))
+
+    limit.buckets['receiver_logger'] = (1, *limit.buckets['receiver_logger'][1:])
+    record = make_record(logging.INFO)
+    assert limit.filter(record)
+    assert record.suppressed == 3
@@ -0,0 +1,78 @@
+import logging
+
+from receiver.istar_cx_receiver import IStarCXReceiver
+from receiver.transformers.no_op_transformer import NoOpTransformer
+from utils.metrics import STAGE_SECONDS, MetricsRegistry
+from utils.tracing import stage
+
+
+def test_a_registry_renders_the_prometheus_text_format(tmp_path):
+    registry = MetricsRegistry()
+    files = registry.counter('files_total', 'Files.')
+    seconds = registry.histogram('seconds', 'Seconds.', buckets=(1, 5))
+    registry.gauge('unused', 'Never set.')
+
+    files.inc(feed='a"b', destination='/d')
+    files.inc(2, feed='a"b', destination='/d')
+    seconds.observe(3, stage='copy')
+    registry.write_textfile(str(tmp_path / 'feed.prom'))
+
+    assert (tmp_path / 'feed.prom').read_text() == '\n'.join([
+        '# HELP files_total Files.',
+        '# TYPE files_total counter',
+        'files_total{destination="/d",feed="a\\"b"} 3',
+        '# HELP seconds Seconds.',
+        '# TYPE seconds histogram',
+        'seconds_bucket{stage="copy",le="1"} 0',
+        'seconds_bucket{stage="copy",le="5"} 1',
+        'seconds_bucket{stage="copy",le="+Inf"} 1',
+        'seconds_sum{stage="copy"} 3.0',
+        'seconds_count{stage="copy"} 1',
+    ]) + '\n'
+
+
+def stage_counts(**labels):
+    """Observation count of feed_stage_duration_seconds per (stage, feed, destination) matching labels."""
+    counts = {}
+    for key, values in STAGE_SECONDS.values.items():
+        key = dict(key)
+        if all(key[name] == value for name, value in labels.items()):
+            counts[(key['stage'], key['feed'], key['destination'])] = values[-1]
+    return counts
+
+
+def test_stages_are_timed_per_feed_and_destination():
+    with stage('test', 'copy', feed='F', destination='/one', file='F.dat'):
+        pass
+    with stage('test', 'copy', feed='F', destination='/two'):
+        pass
+    with stage('test', 'scan', directory='/src'):
+        pass
+
+    assert stage_counts(pipeline='test') == {('copy', 'F', '/one'): 1, ('copy', 'F', '/two'): 1, ('scan', '', ''): 1}
+
+
+def test_the_receiver_times_its_stages_per_feed_and_destination(tmp_path):
+    source, destination = tmp_path / 'src', tmp_path / 'dst'
+    source.mkdir()
+    (source / 'OL_0360_01_0930_CXI046.dat').write_bytes(b'records')
+    (source / 'OL_0360_01_0930_CXI046.trg').touch()
+    feed = 'OL_0360_nn_hhmm_CXI046.dat'
+
+    IStarCXReceiver({'name': 'receiver', 'servers': [{
+        'server_name': 'i-star-cx', 'source_path': str(source),
+        'files': [{'file_name_pattern': feed, 'destination': [{'path': str(destination), 'should_process': 'None'}]}],
+    }]}).process_files()
+
+    counts = stage_counts(pipeline='receiver', feed=feed)
+    assert counts[('copy', feed, str(destination))] >= 1
+    assert counts[('trigger_delete', feed, '')] >= 1
+
+
+def test_no_op_copies_are_logged_through_the_receiver_logger(tmp_path, caplog):
+    (tmp_path / 'F.dat').write_bytes(b'records')
+
+    with caplog.at_level(logging.INFO, logger='receiver_logger'):
+        NoOpTransformer().transform(tmp_path / 'F.dat', str(tmp_path / 'dst'))
+
+    assert ('receiver_logger', logging.INFO, f"Copied file F.dat to {tmp_path / 'dst'}") in caplog.record_tuples
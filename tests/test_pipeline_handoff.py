@@ -0,0 +1,98 @@
+import os
+
+from dispatcher.shared_drive_dispatcher import SharedDriveDispatcher
+from pipeline.handoff import DispatchHandoff
+from receiver.istar_cx_receiver import IStarCXReceiver
+
+
+def shared_drive_dispatcher(staging, share, file_extension):
+    share.mkdir()
+    return SharedDriveDispatcher({'source_directory': str(staging),
+                                  'destination_details': {'shared_drive_path': str(share)},
+                                  'file_extension': file_extension, 'trigger_extension': '.trg'}, 'TEST')
+
+
+class RecordingDispatcher:
+    """Stands in for a dispatcher, recording the batches it is handed."""
+
+    def __init__(self, source_directory, fail=False):
+        self.source_directory = str(source_directory)
+        self.destination_key = self.source_directory
+        self.file_extension = '.dat'
+        self.trigger_extension = '.trg'
+        self.fail = fail
+        self.batches = []
+
+    def dispatch(self, files=None):
+        self.batches.append([file.name for file in files])
+        if self.fail:
+            raise IOError('share unavailable')
+
+
+def test_staged_files_are_dispatched_without_a_rescan(tmp_path):
+    source, ops, gloss = tmp_path / 'src', tmp_path / 'ops', tmp_path / 'gloss'
+    source.mkdir()
+    for index in range(3):
+        (source / f'OL_0360_0{index}_0930_CXI046.dat').write_bytes(b'records %d' % index)
+        (source / f'OL_0360_0{index}_0930_CXI046.trg').touch()
+    dispatchers = [shared_drive_dispatcher(ops, tmp_path / 'share1', '.csv'),
+                   shared_drive_dispatcher(gloss, tmp_path / 'share2', '.dat')]
+    receiver = IStarCXReceiver({'name': 'receiver', 'servers': [{
+        'server_name': 'i-star-cx', 'source_path': str(source),
+        'files': [{'file_name_pattern': 'OL_0360_nn_hhmm_CXI046.dat', 'destination': [
+            {'path': str(ops), 'should_process': 'Rename',
+             'process_config': {'rename_pattern': 'CXI046_YYMMDD_<nnnnn>_01(MMDD).csv'}},
+            {'path': str(gloss), 'should_process': 'None'}]}],
+    }]})
+    handoff = DispatchHandoff(dispatchers)
+    receiver.handoff = handoff.submit
+    handoff.start()
+    try:
+        receiver.process_files()
+        handoff.wait()
+    finally:
+        handoff.close()
+
+    assert len([name for name in os.listdir(tmp_path / 'share1') if name.endswith('.csv')]) == 3
+    # The triggers of the dispatched files are gone, so a rescan does not send them again
+    assert [name for name in os.listdir(ops) if name.endswith('.trg')] == []
+    # A plain copy stages no trigger, so it waits for the dispatcher's own scan
+    assert os.listdir(tmp_path / 'share2') == []
+    assert len(os.listdir(gloss)) == 3
+
+
+def test_only_triggered_files_of_a_routed_directory_are_queued(tmp_path):
+    staging, other = tmp_path / 'staging', tmp_path / 'other'
+    staging.mkdir()
+    other.mkdir()
+    for directory in (staging, other):
+        (directory / 'F.dat').touch()
+        (directory / 'F.trg').touch()
+    (staging / 'G.dat').touch()
+    dispatcher = RecordingDispatcher(staging)
+    handoff = DispatchHandoff([dispatcher])
+    handoff.start()
+
+    for data_file in (staging / 'F.dat', staging / 'G.dat', other / 'F.dat', staging / 'F.trg'):
+        handoff.submit(data_file)
+    handoff.wait()
+    handoff.close()
+
+    assert dispatcher.batches == [['F.dat']]
+
+
+def test_a_failing_dispatch_does_not_stop_the_handoff(tmp_path):
+    dispatcher = RecordingDispatcher(tmp_path, fail=True)
+    for name in ('F', 'G'):
+        (tmp_path / f'{name}.dat').touch()
+        (tmp_path / f'{name}.trg').touch()
+    handoff = DispatchHandoff([dispatcher])
+    handoff.start()
+
+    handoff.submit(tmp_path / 'F.dat')
+    handoff.wait()
+    handoff.submit(tmp_path / 'G.dat')
+    handoff.wait()
+    handoff.close()
+
+    assert dispatcher.batches == [['F.dat'], ['G.dat']]
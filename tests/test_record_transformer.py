@@ -0,0 +1,78 @@
+import hashlib
+import io
+
+import pytest
+
+from receiver.transformers.record_transformer import RecordTransformer
+
+
+def transformer(read_size=1024, batch_size=10000, **process_config):
+    return RecordTransformer({'process_config': dict(process_config, read_size=read_size, batch_size=batch_size)})
+
+
+def read_all(transformer, content):
+    return [line for batch in transformer.read_batches(io.BytesIO(content)) for line in batch]
+
+
+@pytest.mark.parametrize('read_size', [1, 2, 3, 4, 5, 7, 1024])
+def test_crlf_is_stripped_whatever_the_chunk_boundaries(read_size):
+    content = b'abc\r\nxyz\r\n\r\nlast\r\n'
+
+    assert read_all(transformer(read_size), content) == [b'abc', b'xyz', b'last']
+
+
+def test_crlf_split_across_two_chunks():
+    batches = list(transformer(read_size=4).read_batches(io.BytesIO(b'abc\r\nxyz\r\n')))
+
+    assert batches == [[b'abc'], [b'xyz']]
+
+
+def test_a_last_line_without_line_ending_is_kept():
+    assert read_all(transformer(read_size=3), b'one\ntwo\r\nthree\r') == [b'one', b'two', b'three']
+
+
+def test_a_carriage_return_inside_a_line_is_kept():
+    assert read_all(transformer(read_size=2), b'a\rb\nc\n') == [b'a\rb', b'c']
+
+
+def test_lines_are_batched():
+    content = b''.join(b'%d\n' % i for i in range(25))
+    batches = list(transformer(read_size=7, batch_size=10).read_batches(io.BytesIO(content)))
+
+    assert all(len(batch) <= 10 for batch in batches)
+    assert [line for batch in batches for line in batch] == [b'%d' % i for i in range(25)]
+
+
+def test_write_records_runs_the_operation_chain(tmp_path):
+    source = tmp_path / 'F.dat'
+    source.write_bytes(b'046ACC0000001\r\n999ACC0000002\r\n046ACC,000003\r\n')
+    records = transformer(read_size=5, record_operations=[
+        {'type': 'filter', 'start': 0, 'end': 3, 'include': ['046']},
+        {'type': 'fixed_width_to_csv', 'header': True,
+         'fields': [{'name': 'record_type', 'start': 0, 'end': 3}, {'name': 'account', 'start': 3, 'end': 13}]},
+        {'type': 'header', 'lines': ['# CXI046']},
+        {'type': 'trailer', 'lines': ['TRAILER,{count}']},
+    ])
+    destination = tmp_path / 'F.csv'
+    hasher = hashlib.sha256()
+
+    assert records.write_records(source, destination, hasher) == 2
+    content = destination.read_bytes()
+    assert content == b'record_type,account\n# CXI046\n046,ACC0000001\n046,"ACC,000003"\nTRAILER,2\n'
+    assert hasher.hexdigest() == hashlib.sha256(content).hexdigest()
+
+
+def test_records_are_planned_as_a_writer_step(tmp_path):
+    source = tmp_path / 'F.dat'
+    source.write_bytes(b'x\n')
+    records = transformer(output_extension='.csv')
+
+    [(src, dst, writer)] = records.plan_copies(source, str(tmp_path / 'out'))
+
+    assert (src, dst) == (source, str(tmp_path / 'out' / 'F.csv'))
+    assert writer == records.write_records
+
+
+def test_unknown_operation_is_rejected():
+    with pytest.raises(ValueError):
+        transformer(record_operations=[{'type': 'sort'}])
@@ -0,0 +1,89 @@
+import pytest
+
+from receiver.istar_cx_receiver import IStarCXReceiver
+from receiver.routing_plan import build_combined_matcher, compile_receiver_plan
+
+FILE_CONFIGS = [
+    {'file_name_pattern': 'OL_0360_nn_hhmm_CXI046.dat'},
+    {'file_name_pattern': 'OL_0360_nn_hhmm_CXI249.dat'},
+]
+
+
+def receiver_config(source, destination):
+    return {'receivers': [{'name': 'receiver', 'servers': [{
+        'server_name': 'i-star-cx',
+        'source_path': str(source),
+        'files': [dict(file_config, destination=[{'path': str(destination), 'should_process': 'None'}])
+                  for file_config in FILE_CONFIGS],
+    }]}]}
+
+
+def test_the_combined_matcher_routes_each_name_to_its_pattern():
+    matcher = build_combined_matcher(FILE_CONFIGS)
+
+    assert matcher.match('OL_0360_01_0930_CXI046.dat').lastgroup == 'p0'
+    assert matcher.match('OL_0360_01_0930_CXI249.dat').lastgroup == 'p1'
+    assert matcher.match('OL_0360_1_0930_CXI046.dat') is None
+    assert matcher.match('OL_0360_01_0930_CXI027.dat') is None
+
+
+def test_a_plan_lists_every_problem_of_the_config(tmp_path):
+    config = receiver_config(tmp_path, tmp_path)
+    server = config['receivers'][0]['servers'][0]
+    server['files'].append({'file_name_pattern': 'OL_(nn.dat'})
+    server['files'].append({'file_name_pattern': 'OL_nn.dat',
+                            'destination': [{'path': str(tmp_path), 'should_process': 'Rename'}]})
+    config['receivers'].append({'servers': [{'server_name': 'no source path'}]})
+
+    with pytest.raises(ValueError) as error:
+        compile_receiver_plan(config)
+
+    message = str(error.value)
+    assert 'OL_(nn.dat: invalid pattern' in message
+    assert "invalid 'Rename' settings" in message
+    assert "receivers[1]: missing 'name'" in message
+    assert "receivers[1].servers[0]: missing 'source_path'" in message
+
+
+def test_an_unvalidated_plan_compiles_the_same_matchers(tmp_path):
+    config = receiver_config(tmp_path, tmp_path)
+
+    validated = compile_receiver_plan(config)
+    rebuilt = compile_receiver_plan(validated.config, validate=False)
+
+    assert [{path: matcher.pattern for path, matcher in matchers.items()} for matchers in rebuilt.matchers] == \
+        [{path: matcher.pattern for path, matcher in matchers.items()} for matchers in validated.matchers]
+
+
+def test_one_scan_indexes_the_data_files_and_their_triggers(tmp_path):
+    for name in ['OL_0360_01_0930_CXI046.dat', 'OL_0360_02_0930_CXI046.dat', 'OL_0360_01_0930_CXI249.dat',
+                 'OL_0360_01_0930_CXI027.dat', 'OL_0360_01_0930_CXI046.trg', 'OL_0360_01_0930_CXI249.trg',
+                 'notes.txt']:
+        (tmp_path / name).touch()
+    config = receiver_config(tmp_path, tmp_path / 'dst')['receivers'][0]
+
+    matched_files, trg_stems = IStarCXReceiver(config).build_source_index(str(tmp_path), config['servers'][0]['files'])
+
+    assert [sorted(names) for names in matched_files] == [
+        ['OL_0360_01_0930_CXI046.dat', 'OL_0360_02_0930_CXI046.dat'], ['OL_0360_01_0930_CXI249.dat']]
+    assert trg_stems == {'OL_0360_01_0930_CXI046', 'OL_0360_01_0930_CXI249'}
+
+
+def test_only_triggered_files_are_copied(tmp_path):
+    source, destination = tmp_path / 'src', tmp_path / 'dst'
+    source.mkdir()
+    for name in ['OL_0360_01_0930_CXI046', 'OL_0360_02_0930_CXI046', 'OL_0360_01_0930_CXI249']:
+        (source / f'{name}.dat').write_bytes(name.encode())
+    (source / 'OL_0360_01_0930_CXI046.trg').touch()
+    (source / 'OL_0360_01_0930_CXI249.trg').touch()
+    plan = compile_receiver_plan(receiver_config(source, destination))
+
+    IStarCXReceiver(plan.config['receivers'][0], plan.matchers[0]).process_files()
+
+    assert sorted(path.name for path in destination.iterdir() if not path.name.startswith('.')) == \
+        ['OL_0360_01_0930_CXI046.dat', 'OL_0360_01_0930_CXI249.dat']
+    assert (destination / 'OL_0360_01_0930_CXI249.dat').read_bytes() == b'OL_0360_01_0930_CXI249'
+    # The untriggered file waits for its .trg
+    assert sorted(path.name for path in source.iterdir()) == ['OL_0360_01_0930_CXI046.dat',
+                                                             'OL_0360_01_0930_CXI249.dat',
+                                                             'OL_0360_02_0930_CXI046.dat']
@@ -0,0 +1,102 @@
+import logging
+import os
+
+import pytest
+
+from dispatcher.shared_drive_dispatcher import SharedDriveDispatcher
+from utils.scan_watermark import ScanWatermarks
+
+
+@pytest.fixture
+def listings(monkeypatch):
+    """The directories listed with os.scandir."""
+    listed = []
+    scandir = os.scandir
+    monkeypatch.setattr(os, 'scandir', lambda path='.': listed.append(str(path)) or scandir(path))
+    return listed
+
+
+def dispatcher(tmp_path, **settings):
+    source, destination = tmp_path / 'src', tmp_path / 'dst'
+    source.mkdir(exist_ok=True)
+    destination.mkdir(exist_ok=True)
+    return SharedDriveDispatcher({'source_directory': str(source),
+                                  'destination_details': {'shared_drive_path': str(destination)},
+                                  'file_extension': '.dat', 'trigger_extension': '.trg', **settings}, 'TEST')
+
+
+def test_a_directory_is_skipped_after_two_empty_listings_at_the_same_stamp(tmp_path):
+    watermarks = ScanWatermarks(str(tmp_path / 'watermarks.json'))
+    directory_stat = os.stat(tmp_path)
+
+    watermarks.record_empty('src', directory_stat)
+    assert not watermarks.unchanged('src', directory_stat)
+    watermarks.record_empty('src', directory_stat)
+    assert watermarks.unchanged('src', directory_stat)
+
+    # Persisted for the next run
+    assert ScanWatermarks(str(tmp_path / 'watermarks.json')).unchanged('src', directory_stat)
+    watermarks.clear('src')
+    assert not ScanWatermarks(str(tmp_path / 'watermarks.json')).unchanged('src', directory_stat)
+
+
+def test_a_changed_directory_starts_over(tmp_path):
+    watermarks = ScanWatermarks(str(tmp_path / 'watermarks.json'))
+    (tmp_path / 'src').mkdir()
+    before = os.stat(tmp_path / 'src')
+    watermarks.record_empty('src', before)
+    watermarks.record_empty('src', before)
+
+    (tmp_path / 'src' / 'F.dat').touch()
+    after = os.stat(tmp_path / 'src')
+    os.utime(tmp_path / 'src', ns=(after.st_atime_ns, before.st_mtime_ns + 1))
+    after = os.stat(tmp_path / 'src')
+
+    assert not watermarks.unchanged('src', after)
+    watermarks.record_empty('src', after)
+    assert not watermarks.unchanged('src', after)
+
+
+def test_the_dispatcher_skips_an_idle_directory_until_a_file_arrives(tmp_path, listings):
+    idle = dispatcher(tmp_path, watermark_path=str(tmp_path / 'watermarks.json'))
+    source = str(tmp_path / 'src')
+
+    for _ in range(4):
+        assert idle.find_files_to_transfer() == []
+    assert listings.count(source) == 2
+
+    (tmp_path / 'src' / 'F.dat').write_bytes(b'records')
+    (tmp_path / 'src' / 'F.trg').touch()
+    stat = os.stat(source)
+    # Also when the new files landed in the same timestamp tick
+    os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    idle.dispatch()
+
+    assert listings.count(source) == 3
+    assert os.listdir(tmp_path / 'dst') == ['F.dat']
+
+
+def test_claimed_directories_are_always_listed(tmp_path, listings):
+    claimed = dispatcher(tmp_path, watermark_path=str(tmp_path / 'watermarks.json'), claims={'node': 'node-a'})
+
+    for _ in range(3):
+        claimed.find_files_to_transfer()
+
+    assert listings.count(str(tmp_path / 'src')) == 3
+
+
+def test_files_are_discovered_in_batches_as_they_are_paired(tmp_path, caplog):
+    streaming = dispatcher(tmp_path)
+    for index in range(7):
+        (tmp_path / 'src' / f'F{index}.dat').touch()
+        (tmp_path / 'src' / f'F{index}.trg').touch()
+    (tmp_path / 'src' / 'UNTRIGGERED.dat').touch()
+    (tmp_path / 'src' / 'ORPHAN.trg').touch()
+    (tmp_path / 'src' / '.F9.dat.part').touch()
+
+    with caplog.at_level(logging.WARNING, logger='dispatcher_logger'):
+        batches = list(streaming.find_file_batches(batch_size=3))
+
+    assert [len(batch) for batch in batches] == [3, 3, 1]
+    assert sorted(file.name for batch in batches for file in batch) == [f'F{index}.dat' for index in range(7)]
+    assert 'Trigger file not found for UNTRIGGERED.dat' in caplog.text
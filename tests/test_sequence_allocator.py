@@ -0,0 +1,198 @@
+import json
+import subprocess
+import sys
+from datetime import datetime
+
+import pytest
+
+from receiver.transformers.rename_transformer import RenameTransformer
+from receiver.transformers.sequence_allocator import HOST_NAME, STATE_FILE_NAME, SequenceAllocator
+
+NOW = datetime(2026, 10, 18, 9, 30)
+DATE = '261018'
+PATTERN = 'CXI046_YYMMDD_<nnnnn>_01(MMDD).csv'
+
+
+def file_name(number, date=DATE):
+    return f'CXI046_{date}_{number:05}_01(1018).csv'
+
+
+def sequence_file(directory, number, date=DATE):
+    path = directory / file_name(number, date)
+    path.touch()
+    return path
+
+
+@pytest.fixture
+def allocator(tmp_path):
+    allocator = SequenceAllocator(tmp_path)
+    allocator.scans = 0
+    scan = allocator.scan_last_sequence_number
+
+    def counting_scan(*args):
+        allocator.scans += 1
+        return scan(*args)
+
+    allocator.scan_last_sequence_number = counting_scan
+    return allocator
+
+
+def state(directory):
+    return json.loads((directory / STATE_FILE_NAME).read_text())['CXI046']
+
+
+def test_numbers_follow_the_highest_one_in_the_directory(allocator, tmp_path):
+    sequence_file(tmp_path, 7)
+    sequence_file(tmp_path, 3)
+    sequence_file(tmp_path, 40, date='261017')
+
+    assert [allocator.next_sequence_number('CXI046', NOW) for _ in range(3)] == [8, 9, 10]
+    assert allocator.scans == 1
+
+
+def test_the_highest_released_number_goes_to_the_next_file(allocator, tmp_path):
+    allocator.next_sequence_number('CXI046', NOW)
+    second = allocator.next_sequence_number('CXI046', NOW)
+    allocator.release('CXI046', DATE, second)
+
+    assert state(tmp_path)['last'] == second - 1
+    assert allocator.next_sequence_number('CXI046', NOW) == second
+
+
+def test_a_lower_released_number_is_left_as_a_gap(allocator, tmp_path):
+    first = allocator.next_sequence_number('CXI046', NOW)
+    second = allocator.next_sequence_number('CXI046', NOW)
+    allocator.release('CXI046', DATE, first)
+
+    # The next file comes after the second one, so it never gets the first number
+    assert allocator.next_sequence_number('CXI046', NOW) == second + 1
+    assert state(tmp_path)['released'] == [first]
+
+
+def test_the_gap_closes_once_every_number_above_it_is_released(allocator, tmp_path):
+    first = allocator.next_sequence_number('CXI046', NOW)
+    second = allocator.next_sequence_number('CXI046', NOW)
+    third = allocator.next_sequence_number('CXI046', NOW)
+    allocator.commit('CXI046', DATE, first)
+    allocator.release('CXI046', DATE, second)
+    allocator.release('CXI046', DATE, third)
+
+    assert state(tmp_path)['last'] == first
+    assert state(tmp_path)['released'] == []
+    assert allocator.next_sequence_number('CXI046', NOW) == second
+
+
+def test_committed_numbers_are_kept(allocator, tmp_path):
+    number = allocator.next_sequence_number('CXI046', NOW)
+    allocator.commit('CXI046', DATE, number)
+    # Settling twice, or a number of another day, changes nothing
+    allocator.release('CXI046', DATE, number)
+    allocator.release('CXI046', '261017', number)
+
+    assert state(tmp_path) == {'date': DATE, 'last': number, 'released': [], 'reserved': {}}
+    assert allocator.next_sequence_number('CXI046', NOW) == number + 1
+
+
+def test_the_directory_is_not_scanned_while_only_this_state_changes_it(allocator, tmp_path):
+    for _ in range(5):
+        number = allocator.next_sequence_number('CXI046', NOW)
+        sequence_file(tmp_path, number)
+        allocator.commit('CXI046', DATE, number)
+
+    assert allocator.scans == 1
+
+
+def test_deleted_triggers_do_not_cause_a_rescan(allocator, tmp_path):
+    for _ in range(20):
+        number = allocator.next_sequence_number('CXI046', NOW, file_name)
+        sequence_file(tmp_path, number).with_suffix('.trg').touch()
+        allocator.commit('CXI046', DATE, number)
+        # The dispatcher picks the file up and deletes its trigger
+        (tmp_path / file_name(number)).with_suffix('.trg').unlink()
+
+    assert number == 20
+    assert allocator.scans == 1
+
+
+def test_a_file_numbered_behind_its_back_triggers_a_rescan(allocator, tmp_path):
+    number = allocator.next_sequence_number('CXI046', NOW, file_name)
+    allocator.commit('CXI046', DATE, number)
+    sequence_file(tmp_path, 2)
+    sequence_file(tmp_path, 20)
+
+    assert allocator.next_sequence_number('CXI046', NOW, file_name) == 21
+    assert allocator.scans == 2
+
+
+def test_a_rescan_never_goes_below_the_numbers_given_out(allocator, tmp_path):
+    process = subprocess.run([sys.executable, '-c', 'import os; print(os.getpid())'], capture_output=True, text=True)
+    (tmp_path / STATE_FILE_NAME).write_text(json.dumps({'CXI046': {
+        'date': DATE, 'last': 3, 'released': [], 'reserved': {'3': [HOST_NAME, int(process.stdout)]}}}))
+    # The dispatcher moved the published files on
+
+    assert allocator.next_sequence_number('CXI046', NOW) == 4
+    assert allocator.scans == 1
+
+
+def test_a_new_day_starts_again_from_the_directory(allocator, tmp_path):
+    allocator.next_sequence_number('CXI046', NOW)
+    allocator.next_sequence_number('CXI046', NOW)
+
+    assert allocator.next_sequence_number('CXI046', datetime(2026, 10, 19)) == 1
+    assert state(tmp_path)['date'] == '261019'
+
+
+def test_the_reservation_of_a_dead_process_triggers_a_rescan(allocator, tmp_path):
+    process = subprocess.run([sys.executable, '-c', 'import os; print(os.getpid())'], capture_output=True, text=True)
+    dead_pid = int(process.stdout)
+    (tmp_path / STATE_FILE_NAME).write_text(json.dumps({'CXI046': {
+        'date': DATE, 'last': 5, 'released': [], 'reserved': {'5': [HOST_NAME, dead_pid], '4': ['other-node', 1]}}}))
+    # The dead process got as far as publishing its file
+    sequence_file(tmp_path, 5)
+
+    assert allocator.next_sequence_number('CXI046', NOW) == 6
+    assert allocator.scans == 1
+    assert set(state(tmp_path)['reserved']) == {'4', '6'}
+
+
+def test_an_unreadable_state_is_rebuilt(allocator, tmp_path):
+    sequence_file(tmp_path, 12)
+    (tmp_path / STATE_FILE_NAME).write_text('{not json')
+
+    assert allocator.next_sequence_number('CXI046', NOW) == 13
+
+
+def test_rename_transformer_releases_the_number_of_a_failed_copy(tmp_path):
+    source = tmp_path / 'src'
+    source.mkdir()
+    (source / 'F.dat').write_bytes(b'data')
+    destination = tmp_path / 'ops'
+    transformer = RenameTransformer({'process_config': {'rename_pattern': PATTERN}})
+
+    # Planned, but the data file never made it into place
+    failed = transformer.plan_copies(source / 'F.dat', str(destination))
+    transformer.plan_copies(source / 'F.dat', str(destination))
+    transformer.settle_copies(failed, IOError("copy failed"))
+    assert state(destination)['released'] == [1]
+
+    (source / 'F.trg').touch()
+    transformer.transform(source / 'F.dat', str(destination))
+    data_file = transformer.build_filename(PATTERN, 3)
+    assert sorted(path.name for path in destination.iterdir() if not path.name.startswith('.')) == \
+        [data_file, data_file.replace('.csv', '.trg')]
+    assert set(state(destination)['reserved']) == {'2'}
+
+
+def test_rename_transformer_commits_a_published_data_file_even_if_its_trigger_failed(tmp_path):
+    source = tmp_path / 'src'
+    source.mkdir()
+    (source / 'F.dat').write_bytes(b'data')
+    destination = tmp_path / 'ops'
+    transformer = RenameTransformer({'process_config': {'rename_pattern': PATTERN}})
+
+    with pytest.raises(OSError):
+        transformer.transform(source / 'F.dat', str(destination))
+
+    assert (destination / transformer.build_filename(PATTERN, 1)).exists()
+    assert state(destination)['reserved'] == {}
+    assert state(destination)['released'] == []
@@ -0,0 +1,221 @@
+import gzip
+import os
+import threading
+
+import pytest
+
+pytest.importorskip('paramiko')
+
+from benchmarks.local_sftp_server import start_local_sftp_server
+from dispatcher.compression import Compression
+from dispatcher.sftp_dispatcher import SFTPDispatcher
+from dispatcher.sftp_helper import PARTIAL_SUFFIX, SFTPHelper
+from dispatcher.sftp_pool import SFTPConnectionPool, connection_pool
+
+
+@pytest.fixture(scope='module')
+def sftp_root(tmp_path_factory):
+    return tmp_path_factory.mktemp('sftp_root')
+
+
+@pytest.fixture(scope='module')
+def sftp_server(sftp_root):
+    """Server entry of the in-process SFTP server the benchmarks use, serving sftp_root."""
+    return start_local_sftp_server(str(sftp_root))
+
+
+@pytest.fixture
+def sftp_pool():
+    pool = SFTPConnectionPool()
+    yield pool
+    pool.close_all()
+
+
+@pytest.fixture
+def remote_dir(sftp_root, request):
+    """A directory of the test's own on the SFTP server: (local path, remote path)."""
+    local = sftp_root / request.node.name
+    local.mkdir()
+    return local, f"/{request.node.name}"
+
+
+def test_upload_files_in_parallel_over_one_pooled_connection(sftp_server, sftp_pool, remote_dir, tmp_path,
+                                                             monkeypatch):
+    local_dir, remote_path = remote_dir
+    files = []
+    for i in range(12):
+        files.append(tmp_path / f'F{i:02}.dat')
+        files[-1].write_bytes(b'%d' % i * 5000)
+    server_config = dict(sftp_server, max_channels=4)
+
+    active, peak = [0], [0]
+    lock = threading.Lock()
+    put = SFTPHelper.put
+
+    def counting_put(self, sftp, local_file, remote_file):
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        try:
+            put(self, sftp, local_file, remote_file)
+        finally:
+            with lock:
+                active[0] -= 1
+
+    monkeypatch.setattr(SFTPHelper, 'put', counting_put)
+
+    with SFTPHelper(server_config, 'pooled', pool=sftp_pool) as helper:
+        first_connection = helper.connection
+        assert helper.upload_files(files[:6], remote_path) == {}
+    with SFTPHelper(server_config, 'pooled', pool=sftp_pool) as helper:
+        assert helper.connection is first_connection
+        assert helper.upload_files(files[6:], remote_path) == {}
+
+    assert peak[0] > 1
+    for file in files:
+        assert (local_dir / file.name).read_bytes() == file.read_bytes()
+    assert not [name for name in os.listdir(local_dir) if name.endswith(PARTIAL_SUFFIX)]
+
+
+def test_a_lost_connection_is_replaced(sftp_server, sftp_pool):
+    connection = sftp_pool.get_connection('lost', sftp_server)
+    connection.client.close()
+
+    replacement = sftp_pool.get_connection('lost', sftp_server)
+
+    assert replacement is not connection
+    assert replacement.is_active()
+
+
+def test_resumes_a_partial_upload_whose_prefix_matches(sftp_server, sftp_pool, remote_dir, tmp_path, monkeypatch):
+    local_dir, remote_path = remote_dir
+    content = os.urandom(600 * 1024)
+    local_file = tmp_path / 'big.dat'
+    local_file.write_bytes(content)
+    (local_dir / f'big.dat{PARTIAL_SUFFIX}').write_bytes(content[:300 * 1024])
+
+    offsets = []
+    resume_offset = SFTPHelper.resume_offset
+    monkeypatch.setattr(SFTPHelper, 'resume_offset',
+                        lambda self, *args: offsets.append(resume_offset(self, *args)) or offsets[-1])
+
+    with SFTPHelper(sftp_server, 'resume', pool=sftp_pool) as helper:
+        helper.upload_file(local_file, f"{remote_path}/big.dat")
+
+    assert offsets == [300 * 1024]
+    assert (local_dir / 'big.dat').read_bytes() == content
+    assert not (local_dir / f'big.dat{PARTIAL_SUFFIX}').exists()
+
+
+@pytest.mark.parametrize('position', [0, 100 * 1024, 300 * 1024 - 1])
+def test_restarts_when_the_partial_upload_differs_anywhere(sftp_server, sftp_pool, remote_dir, tmp_path,
+                                                           monkeypatch, position):
+    # The local server has no sha256 'check-file', so it hashes the prefix through the exec channel
+    local_dir, remote_path = remote_dir
+    content = os.urandom(600 * 1024)
+    local_file = tmp_path / 'big.dat'
+    local_file.write_bytes(content)
+    partial = bytearray(content[:300 * 1024])
+    partial[position] ^= 0xff
+    (local_dir / f'big.dat{PARTIAL_SUFFIX}').write_bytes(bytes(partial))
+
+    offsets = []
+    resume_offset = SFTPHelper.resume_offset
+    monkeypatch.setattr(SFTPHelper, 'resume_offset',
+                        lambda self, *args: offsets.append(resume_offset(self, *args)) or offsets[-1])
+
+    with SFTPHelper(sftp_server, 'mismatch', pool=sftp_pool) as helper:
+        helper.upload_file(local_file, f"{remote_path}/big.dat")
+
+    assert offsets == [0]
+    assert (local_dir / 'big.dat').read_bytes() == content
+
+
+def test_restarts_when_the_partial_upload_is_longer_than_the_file(sftp_server, sftp_pool, remote_dir, tmp_path):
+    local_dir, remote_path = remote_dir
+    local_file = tmp_path / 'small.dat'
+    local_file.write_bytes(b'new content')
+    (local_dir / f'small.dat{PARTIAL_SUFFIX}').write_bytes(b'new content and more from an older file')
+
+    with SFTPHelper(sftp_server, 'longer', pool=sftp_pool) as helper:
+        helper.upload_file(local_file, f"{remote_path}/small.dat")
+
+    assert (local_dir / 'small.dat').read_bytes() == b'new content'
+
+
+def test_dispatcher_retries_an_interrupted_upload_and_resumes_it(sftp_server, remote_dir, tmp_path, monkeypatch):
+    local_dir, remote_path = remote_dir
+    (tmp_path / 'src').mkdir()
+    files = [tmp_path / 'src' / 'A.dat', tmp_path / 'src' / 'B.dat']
+    for file in files:
+        file.write_bytes(os.urandom(512 * 1024))
+        file.with_suffix('.trg').touch()
+    server_config = dict(sftp_server, block_size=64 * 1024)
+    config = {'source_directory': str(tmp_path / 'src'), 'destination_type': 'external_server',
+              'destination_details': {'server_name': 'retry', 'destination_path': remote_path},
+              'file_extension': '.dat', 'trigger_extension': '.trg', 'enabled': True,
+              'retry_attempts': 3, 'retry_backoff_seconds': 0}
+
+    # The first upload of A.dat dies after two blocks, leaving a '.part' behind
+    put = SFTPHelper.put
+    interrupted = []
+
+    def interrupted_put(self, sftp, local_file, remote_file):
+        if local_file.name == 'A.dat' and not interrupted:
+            interrupted.append(local_file)
+            with sftp.open(remote_file + PARTIAL_SUFFIX, 'w') as remote:
+                remote.write(local_file.read_bytes()[:2 * 64 * 1024])
+            raise IOError("connection reset")
+        put(self, sftp, local_file, remote_file)
+
+    offsets = []
+    resume_offset = SFTPHelper.resume_offset
+    monkeypatch.setattr(SFTPHelper, 'put', interrupted_put)
+    monkeypatch.setattr(SFTPHelper, 'resume_offset',
+                        lambda self, *args: offsets.append(resume_offset(self, *args)) or offsets[-1])
+
+    try:
+        SFTPDispatcher(config, 'TEST', server_config).dispatch()
+    finally:
+        connection_pool.close_all()
+
+    assert interrupted
+    assert 2 * 64 * 1024 in offsets
+    for file in files:
+        assert (local_dir / file.name).read_bytes() == file.read_bytes()
+        assert not file.with_suffix('.trg').exists()
+
+
+def test_restarts_when_the_server_cannot_hash_the_prefix(sftp_server, sftp_pool, remote_dir, tmp_path, monkeypatch):
+    local_dir, remote_path = remote_dir
+    content = os.urandom(600 * 1024)
+    local_file = tmp_path / 'big.dat'
+    local_file.write_bytes(content)
+    (local_dir / f'big.dat{PARTIAL_SUFFIX}').write_bytes(content[:300 * 1024])
+
+    with SFTPHelper(sftp_server, 'no-exec', pool=sftp_pool) as helper:
+        def no_exec(command):
+            raise IOError("Remote command exited with status 127")
+
+        monkeypatch.setattr(helper.connection, 'run', no_exec)
+        with helper.connection.channel() as sftp:
+            assert helper.resume_offset(sftp, local_file, f"{remote_path}/big.dat{PARTIAL_SUFFIX}", len(content)) == 0
+
+
+@pytest.mark.parametrize('remote_decompress', [False, True])
+def test_compressed_uploads_land_compressed_or_decompressed(sftp_server, sftp_pool, remote_dir, tmp_path,
+                                                             remote_decompress):
+    local_dir, remote_path = remote_dir
+    local_file = tmp_path / 'F.dat'
+    local_file.write_bytes(b'046 0360 20261018 ACC0000123456 GBP 0000001234.56\n' * 20000)
+    compression = Compression({'codec': 'gzip', 'remote_decompress': remote_decompress})
+
+    with SFTPHelper(sftp_server, 'compressed', pool=sftp_pool, compression=compression) as helper:
+        helper.upload_file(local_file, f"{remote_path}/F.dat")
+
+    if remote_decompress:
+        assert os.listdir(local_dir) == ['F.dat']
+        assert (local_dir / 'F.dat').read_bytes() == local_file.read_bytes()
+    else:
+        assert os.listdir(local_dir) == ['F.dat.gz']
+        assert gzip.decompress((local_dir / 'F.dat.gz').read_bytes()) == local_file.read_bytes()
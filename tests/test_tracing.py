@@ -0,0 +1,99 @@
+import argparse
+import json
+import threading
+import time
+
+import pytest
+
+from receiver.istar_cx_receiver import IStarCXReceiver
+from utils.tracing import StackSampler, Tracer, add_profile_arguments, profiling, stage, tracer
+
+
+@pytest.fixture
+def global_tracer(monkeypatch):
+    """The module tracer with no events of earlier tests, disabled again afterwards."""
+    monkeypatch.setattr(tracer, 'enabled', False)
+    monkeypatch.setattr(tracer, 'events', [])
+    monkeypatch.setattr(tracer, 'threads', {})
+    return tracer
+
+
+def test_a_disabled_tracer_records_nothing():
+    spans = Tracer()
+
+    with spans.span('F.dat', 'receiver'):
+        pass
+
+    assert spans.events == []
+
+
+def test_spans_are_written_as_chrome_trace_events(tmp_path):
+    spans = Tracer()
+    spans.enable()
+
+    with spans.span('F.dat', 'receiver', file=tmp_path / 'F.dat'):
+        with pytest.raises(OSError):
+            with spans.span('copy', 'receiver'):
+                raise OSError('disk full')
+    spans.write(str(tmp_path / 'trace.json'))
+
+    events = json.loads((tmp_path / 'trace.json').read_text())['traceEvents']
+    [thread] = [event for event in events if event['ph'] == 'M']
+    assert thread['args'] == {'name': threading.current_thread().name}
+    copy, file = [event for event in events if event['ph'] == 'X']
+    assert (copy['name'], copy['args']) == ('copy', {'error': "OSError('disk full')"})
+    assert (file['name'], file['args']) == ('F.dat', {'file': str(tmp_path / 'F.dat')})
+    # The copy is nested inside its file's span
+    assert file['ts'] <= copy['ts'] and copy['ts'] + copy['dur'] <= file['ts'] + file['dur']
+
+
+def test_stages_carry_their_feed_and_destination(global_tracer):
+    global_tracer.enable()
+
+    with stage('receiver', 'copy', feed='F', destination='/d', file='F.dat'):
+        pass
+    with stage('receiver', 'scan'):
+        pass
+
+    assert [(event['name'], event['args']) for event in global_tracer.events] == [
+        ('copy', {'file': 'F.dat', 'feed': 'F', 'destination': '/d'}), ('scan', {})]
+
+
+def test_the_stack_sampler_writes_collapsed_stacks(tmp_path):
+    def busy_wait():
+        deadline = time.monotonic() + 0.2
+        while time.monotonic() < deadline:
+            pass
+
+    worker = threading.Thread(target=busy_wait, name='receiver_0')
+    sampler = StackSampler(interval_ms=1)
+    sampler.start()
+    worker.start()
+    worker.join()
+    sampler.stop()
+    sampler.write(str(tmp_path / 'stacks.txt'))
+
+    stacks = (tmp_path / 'stacks.txt').read_text().splitlines()
+    assert any(line.startswith('receiver;') and 'busy_wait (test_tracing.py:' in line for line in stacks)
+    assert all(line.rsplit(' ', 1)[1].isdigit() for line in stacks)
+
+
+def test_profile_mode_traces_every_file_and_stage_of_a_run(tmp_path, global_tracer):
+    parser = argparse.ArgumentParser()
+    add_profile_arguments(parser)
+    args = parser.parse_args(['--profile', str(tmp_path / 'trace.json')])
+    source, destination = tmp_path / 'src', tmp_path / 'dst'
+    source.mkdir()
+    (source / 'OL_0360_01_0930_CXI046.dat').write_bytes(b'records')
+    (source / 'OL_0360_01_0930_CXI046.trg').touch()
+
+    with profiling(args, 'receiver_logger'):
+        IStarCXReceiver({'name': 'receiver', 'servers': [{
+            'server_name': 'i-star-cx', 'source_path': str(source),
+            'files': [{'file_name_pattern': 'OL_0360_nn_hhmm_CXI046.dat', 'destination': [
+                {'path': str(destination), 'should_process': 'None'}]}],
+        }]}).process_files()
+
+    events = json.loads((tmp_path / 'trace.json').read_text())['traceEvents']
+    names = {event['name'] for event in events if event['ph'] == 'X'}
+    assert {'scan', 'OL_0360_01_0930_CXI046.dat', 'copy', 'trigger_delete'} <= names
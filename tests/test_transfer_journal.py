@@ -0,0 +1,94 @@
+import os
+import time
+
+import pytest
+
+from receiver.istar_cx_receiver import IStarCXReceiver
+from utils.transfer_journal import STATE_DONE, STATE_FAILED, TransferJournal
+
+
+@pytest.fixture
+def journal(tmp_path):
+    return TransferJournal(str(tmp_path / 'journal.db'))
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / 'F.dat'
+    path.write_bytes(b'content')
+    return path
+
+
+def test_a_file_keeps_its_id_until_it_changes(journal, source):
+    file_id = journal.record_file(source)
+
+    assert journal.record_file(source) == file_id
+    source.write_bytes(b'other content')
+    assert journal.record_file(source) != file_id
+
+
+def test_hashed_identities_tell_same_sized_files_apart(tmp_path, source):
+    journal = TransferJournal(str(tmp_path / 'hashed.db'), hash_files=True)
+    file_id = journal.record_file(source)
+    stat = source.stat()
+
+    source.write_bytes(b'CONTENT')
+    os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+    assert journal.record_file(source) != file_id
+
+
+def test_destination_states(journal, source):
+    file_id = journal.record_file(source)
+    journal.mark_in_flight(file_id, '/ops', '/ops/F.csv')
+    journal.mark_in_flight(file_id, '/gc')
+
+    assert [row[2:4] for row in journal.in_flight()] == [('/ops', '/ops/F.csv'), ('/gc', None)]
+
+    journal.mark_done(file_id, '/ops')
+    journal.mark_failed(file_id, '/gc', IOError("disk full"))
+
+    assert journal.completed_destinations(file_id) == {'/ops'}
+    assert journal.is_done(file_id, '/ops') and not journal.is_done(file_id, '/gc')
+    # The target recorded in flight is kept once done
+    assert journal.query_state(STATE_DONE)[0][3] == '/ops/F.csv'
+    [(_, name, destination, state, error, _)] = journal.backlog()
+    assert (name, destination, state, error) == ('F.dat', '/gc', STATE_FAILED, 'disk full')
+
+
+def test_prune_forgets_old_files(journal, source, monkeypatch):
+    file_id = journal.record_file(source)
+    journal.mark_done(file_id, '/ops')
+
+    assert journal.prune(1) == 0
+    monkeypatch.setattr(time, 'time', lambda: 10 ** 10)
+    assert journal.prune(1) == 1
+    assert journal.completed_destinations(file_id) == set()
+
+
+def test_open_shares_one_journal_per_path(tmp_path):
+    path = str(tmp_path / 'shared.db')
+
+    assert TransferJournal.open(path) is TransferJournal.open(os.path.relpath(path))
+
+
+def test_a_rerun_after_a_crash_only_deletes_the_trigger(tmp_path):
+    source, destination = tmp_path / 'src', tmp_path / 'ops'
+    source.mkdir()
+    (source / 'OL_0360_01_0930_CXI046.dat').write_bytes(b'records')
+    (source / 'OL_0360_01_0930_CXI046.trg').touch()
+    config = {'name': 'receiver', 'journal_path': str(tmp_path / 'journal.db'), 'servers': [{
+        'server_name': 'i-star-cx', 'source_path': str(source),
+        'files': [{'file_name_pattern': 'OL_0360_nn_hhmm_CXI046.dat', 'destination': [
+            {'path': str(destination), 'should_process': 'Rename',
+             'process_config': {'rename_pattern': 'CXI046_YYMMDD_<nnnnn>_01(MMDD).csv'}}]}],
+    }]}
+    IStarCXReceiver(config).process_files()
+    published = sorted(os.listdir(destination))
+
+    # Crashed after the copy, before the trigger was deleted
+    (source / 'OL_0360_01_0930_CXI046.trg').touch()
+    IStarCXReceiver(config).process_files()
+
+    assert sorted(os.listdir(destination)) == published
+    assert not (source / 'OL_0360_01_0930_CXI046.trg').exists()
@@ -0,0 +1,68 @@
+import time
+from datetime import datetime, timedelta
+
+from receiver.istar_cx_receiver import IStarCXReceiver
+from utils.transfer_scheduler import DestinationLimits, TokenBucket, TransferScheduler, parse_size
+
+
+def test_files_are_ordered_by_priority_then_deadline_then_discovery():
+    soon = (datetime.now() + timedelta(minutes=5)).strftime('%H:%M')
+    scheduler = TransferScheduler([{'pattern': 'URGENT_*', 'priority': 1},
+                                   {'pattern': 'DUE_*', 'priority': 50, 'deadline': soon},
+                                   {'pattern': 'LATE_*', 'priority': 50}])
+    names = ['a.dat', 'LATE_1.dat', 'DUE_1.dat', 'URGENT_1.dat', 'b.dat', 'URGENT_2.dat']
+
+    assert scheduler.order(names, str) == ['URGENT_1.dat', 'URGENT_2.dat', 'DUE_1.dat', 'LATE_1.dat', 'a.dat', 'b.dat']
+
+
+def test_destinations_share_their_limits():
+    scheduler = TransferScheduler(destinations={'sftp:host:/in': {'max_concurrent': 2}})
+
+    limits = scheduler.destination_limits('sftp:host:/in', {'max_concurrent': 5})
+
+    assert scheduler.destination_limits('sftp:host:/in') is limits
+    assert limits.slots._initial_value == 2
+    assert scheduler.destination_limits('/share', {'bandwidth': {'rate': '1MiB'}}).bucket.rate == 1024 * 1024
+
+
+def test_sizes_are_parsed_in_binary_and_decimal_units():
+    assert [parse_size(value) for value in [512, '64KiB', '4 MiB', '1GiB', '2kb', '1000']] == \
+        [512, 64 * 1024, 4 * 1024 ** 2, 1024 ** 3, 2000, 1000]
+
+
+def test_the_bucket_sleeps_off_what_exceeds_the_burst(monkeypatch):
+    slept = []
+    monkeypatch.setattr(time, 'sleep', slept.append)
+    bucket = TokenBucket(1000, burst=500)
+
+    bucket.consume(400)
+    bucket.consume(600)
+
+    assert len(slept) == 1 and 0.45 < slept[0] <= 0.5
+
+
+def test_the_cap_only_applies_inside_its_hours():
+    bucket = TokenBucket(1000, hours='22:00-06:00')
+
+    assert bucket.active(datetime(2026, 10, 18, 23, 30)) and bucket.active(datetime(2026, 10, 18, 5, 59))
+    assert not bucket.active(datetime(2026, 10, 18, 12, 0))
+
+
+def test_the_receiver_charges_the_bandwidth_cap_chunk_by_chunk(tmp_path, monkeypatch):
+    source, capped, free = tmp_path / 'src', tmp_path / 'capped', tmp_path / 'free'
+    source.mkdir()
+    (source / 'OL_0360_01_0930_CXI046.dat').write_bytes(b'x' * (3 * 1024 * 1024 + 5))
+    (source / 'OL_0360_01_0930_CXI046.trg').touch()
+    charged = []
+    monkeypatch.setattr(DestinationLimits, 'throttle', lambda limits, amount: charged.append(amount))
+
+    IStarCXReceiver({'name': 'receiver', 'servers': [{
+        'server_name': 'i-star-cx', 'source_path': str(source),
+        'files': [{'file_name_pattern': 'OL_0360_nn_hhmm_CXI046.dat', 'destination': [
+            {'path': str(capped), 'should_process': 'None', 'bandwidth': {'rate': '1MiB'},
+             'copy_strategies': ['copy']},
+            {'path': str(free), 'should_process': 'None'}]}],
+    }]}).process_files()
+
+    assert charged == [1024 * 1024] * 3 + [5]
+    assert (capped / 'OL_0360_01_0930_CXI046.dat').stat().st_size == 3 * 1024 * 1024 + 5
@@ -0,0 +1,48 @@
+import os
+
+import pytest
+
+from receiver.istar_cx_receiver import IStarCXReceiver
+from utils.trigger_watcher import TriggerWatcher
+
+
+@pytest.fixture
+def watcher(tmp_path):
+    watcher = TriggerWatcher({str(tmp_path): '.trg'}, 'receiver_logger')
+    if watcher.fd is None:
+        pytest.skip("inotify is not available")
+    yield watcher
+    watcher.close()
+
+
+def test_triggers_written_or_moved_in_are_reported_once(watcher, tmp_path):
+    assert watcher.wait(0.05) == []
+
+    (tmp_path / 'A.dat').write_bytes(b'a')
+    (tmp_path / 'A.trg').write_bytes(b'')
+    (tmp_path / 'B.tmp').touch()
+    os.rename(tmp_path / 'B.tmp', tmp_path / 'B.trg')
+    (tmp_path / 'C.txt').touch()
+
+    assert watcher.wait(1) == [(str(tmp_path), 'A.trg'), (str(tmp_path), 'B.trg')]
+    assert watcher.wait(0.05) == []
+
+
+def test_the_receiver_processes_the_pair_a_trigger_announces(watcher, tmp_path):
+    destination = tmp_path / 'dst'
+    receiver = IStarCXReceiver({'name': 'receiver', 'servers': [{
+        'server_name': 'i-star-cx',
+        'source_path': str(tmp_path),
+        'files': [{'file_name_pattern': 'OL_0360_nn_hhmm_CXI046.dat',
+                   'destination': [{'path': str(destination), 'should_process': 'None'}]}],
+    }]})
+    (tmp_path / 'OL_0360_01_0930_CXI046.dat').write_bytes(b'records')
+    (tmp_path / 'OL_0360_02_0930_CXI046.dat').write_bytes(b'waiting')
+    (tmp_path / 'OL_0360_01_0930_CXI046.trg').touch()
+
+    for directory, trg_file in watcher.wait(1):
+        receiver.process_trigger(directory, trg_file)
+
+    assert os.listdir(destination) == ['OL_0360_01_0930_CXI046.dat']
+    assert (destination / 'OL_0360_01_0930_CXI046.dat').read_bytes() == b'records'
+    assert not (tmp_path / 'OL_0360_01_0930_CXI046.trg').exists()
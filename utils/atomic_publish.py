@@ -0,0 +1,242 @@
+import errno
+import os
+import re
+import threading
+import time
+from concurrent.futures import Future
+
+DEFAULT_BATCH_FILES = 64
+DEFAULT_BATCH_MS = 20
+# A .part file of a pid not running here is only swept once it was not written to for this long, since on a
+# shared drive it may belong to a live process of another node
+STALE_PART_SECONDS = 600
+PART_NAME = re.compile(r'\..+\.(\d+)\.part')
+
+# Directory fsync is not supported everywhere (SMB / CIFS mounts): the renames are then as durable as it gets
+UNSUPPORTED_DIRECTORY_FSYNC = {errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EBADF}
+
+
+def temp_path(dst):
+    """The hidden name a destination file is written under until it is published: .<name>.<pid>.part"""
+    directory, name = os.path.split(str(dst))
+    return os.path.join(directory, f".{name}.{os.getpid()}.part")
+
+
+def discard(tmp):
+    try:
+        os.remove(tmp)
+    except OSError:
+        pass
+
+
+def process_alive(pid):
+    """Whether a process with this pid runs on this host (one owned by another user counts as running)."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class PublishEntry:
+    __slots__ = ('tmp', 'dst', 'after', 'future', 'staged')
+
+    def __init__(self, tmp, dst, after):
+        self.tmp = tmp
+        self.dst = dst
+        self.after = after
+        self.future = Future()
+        self.staged = time.monotonic()
+
+
+class Publisher:
+    """
+    Publishes destination files crash-safely without an fsync per file.
+
+    Every file is written under its temp_path() and handed to publish(), which returns a Future. Staged
+    files are committed as a group, once 'batch_files' are waiting, the oldest has waited 'batch_ms'
+    milliseconds, or someone flushes: all of the group's temp files are fsynced, renamed into place and
+    their directories fsynced, so a crash leaves either the complete file or no file under the final name.
+    A file published 'after' another (a .trg after its data file, a sidecar's data file) is only renamed
+    once that rename is durable, and is dropped when that file failed, so a trigger never points at
+    missing data. With 'fsync: false' files are still renamed into place in order, right away. The first
+    publication into a directory sweeps it of the .part files crashed processes left (see sweep_parts).
+    """
+
+    _publishers = {}
+    _publishers_lock = threading.Lock()
+
+    def __init__(self, fsync=True, batch_files=DEFAULT_BATCH_FILES, batch_ms=DEFAULT_BATCH_MS):
+        self.fsync = fsync
+        self.batch_files = batch_files
+        self.batch_seconds = batch_ms / 1000
+        self.condition = threading.Condition()
+        self.pending = []
+        # Set by flush(): commit what is staged without waiting for the batch to fill up
+        self.urgent = False
+        self.thread = None
+        # Directories already swept of stale .part files
+        self.swept = set()
+        self.swept_lock = threading.Lock()
+
+    @classmethod
+    def shared(cls, config=None):
+        """Return the publisher for a 'publish' block ({'fsync': ..., 'batch_files': ..., 'batch_ms': ...})."""
+        config = config or {}
+        key = (config.get('fsync', True), config.get('batch_files', DEFAULT_BATCH_FILES),
+               config.get('batch_ms', DEFAULT_BATCH_MS))
+        with cls._publishers_lock:
+            publisher = cls._publishers.get(key)
+            if publisher is None:
+                publisher = cls._publishers[key] = cls(*key)
+            return publisher
+
+    def publish(self, tmp, dst, after=None):
+        """
+        Stage a completely written temp file for publication as dst, after the Future of another file
+        when given. Returns a Future resolved once dst is in place (and durable), or failed.
+        """
+        entry = PublishEntry(tmp, str(dst), after)
+        self.sweep_once(os.path.dirname(entry.dst) or '.')
+        if not self.fsync:
+            self.commit([entry])
+            return entry.future
+
+        with self.condition:
+            self.pending.append(entry)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='publish', daemon=True)
+                self.thread.start()
+            self.condition.notify()
+        return entry.future
+
+    def sweep_once(self, directory):
+        """Sweep a directory of stale .part files the first time this publisher publishes into it."""
+        with self.swept_lock:
+            if directory in self.swept:
+                return
+            self.swept.add(directory)
+            sweep_parts(directory)
+
+    def flush(self):
+        """Commit the staged files now, rather than once the batch is full or old enough."""
+        with self.condition:
+            self.urgent = True
+            self.condition.notify()
+
+    def wait(self, futures):
+        """Flush and wait for the Futures of publish(); returns {future: exception} of those that failed."""
+        futures = [future for future in futures if future is not None]
+        if any(not future.done() for future in futures):
+            self.flush()
+        return {future: future.exception() for future in futures if future.exception() is not None}
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+                deadline = self.pending[0].staged + self.batch_seconds
+                while not self.urgent and len(self.pending) < self.batch_files:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+                batch, self.pending = self.pending, []
+                self.urgent = False
+            self.commit(batch)
+
+    def commit(self, batch):
+        """
+        Make a group of staged files durable under their final names: one fsync per temp file, then the
+        renames and one fsync per directory, in rounds so a file staged after another one of the group
+        is only renamed once the earlier rename is durable.
+        """
+        if self.fsync:
+            for entry in batch:
+                try:
+                    fsync_path(entry.tmp)
+                except Exception as e:
+                    self.fail(entry, e)
+
+        remaining = [entry for entry in batch if not entry.future.done()]
+        while remaining:
+            ready = [entry for entry in remaining if entry.after is None or entry.after.done()]
+            if not ready:
+                # Only possible when a file was staged after one that was never published
+                for entry in remaining:
+                    self.fail(entry, IOError(f"{entry.dst} was staged after a file that is not being published"))
+                return
+            remaining = [entry for entry in remaining if entry not in ready]
+
+            directories = {}
+            for entry in ready:
+                if entry.after is not None and entry.after.exception() is not None:
+                    self.fail(entry, IOError(f"Not publishing {entry.dst}: the file it follows failed "
+                                             f"({entry.after.exception()})"))
+                    continue
+                try:
+                    os.replace(entry.tmp, entry.dst)
+                    directories.setdefault(os.path.dirname(entry.dst) or '.', []).append(entry)
+                except Exception as e:
+                    self.fail(entry, e)
+
+            for directory, entries in directories.items():
+                error = None
+                if self.fsync:
+                    try:
+                        fsync_directory(directory)
+                    except Exception as e:
+                        error = e
+                for entry in entries:
+                    if error is None:
+                        entry.future.set_result(entry.dst)
+                    else:
+                        entry.future.set_exception(error)
+
+    @staticmethod
+    def fail(entry, error):
+        discard(entry.tmp)
+        entry.future.set_exception(error)
+
+
+def sweep_parts(directory, stale_seconds=STALE_PART_SECONDS):
+    """
+    Remove the temp_path() files a crashed process left in directory: those whose pid is not running and
+    that were not modified for stale_seconds. Returns the number removed.
+    """
+    removed = 0
+    cutoff = time.time() - stale_seconds
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                match = PART_NAME.fullmatch(entry.name)
+                if match is None or int(match.group(1)) == os.getpid() or process_alive(int(match.group(1))):
+                    continue
+                try:
+                    if entry.stat().st_mtime < cutoff:
+                        os.remove(entry.path)
+                        removed += 1
+                except OSError:
+                    pass
+    except OSError:
+        pass
+    return removed
+
+
+def fsync_path(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def fsync_directory(directory):
+    try:
+        fsync_path(directory)
+    except OSError as e:
+        if e.errno not in UNSUPPORTED_DIRECTORY_FSYNC:
+            raise
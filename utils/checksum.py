@@ -0,0 +1,48 @@
+import hashlib
+import os
+
+from utils.atomic_publish import Publisher, temp_path
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+XXHASH_ALGORITHMS = ('xxh64', 'xxh3_64', 'xxh128')
+
+
+def new_hasher(algorithm):
+    """
+    Return a hash object for the checksum algorithm: anything hashlib provides (e.g. 'sha256'), or
+    'xxh64', 'xxh3_64' or 'xxh128' when the optional xxhash package is installed.
+    """
+    if algorithm in XXHASH_ALGORITHMS:
+        if xxhash is None:
+            raise ValueError(f"Checksum algorithm {algorithm} requires the 'xxhash' package")
+        return getattr(xxhash, algorithm)()
+    try:
+        return hashlib.new(algorithm)
+    except ValueError:
+        raise ValueError(f"Unknown checksum algorithm: {algorithm}")
+
+
+def sidecar_path(data_path, algorithm):
+    """The sidecar of data.csv with sha256 is data.csv.sha256."""
+    return f"{data_path}.{algorithm}"
+
+
+def sidecar_content(data_path, digest):
+    """One line in the '<digest>  <file name>' format of sha256sum, so `sha256sum -c` can check it."""
+    return f"{digest}  {os.path.basename(data_path)}\n"
+
+
+def write_sidecar(data_path, digest, algorithm, publisher=None, after=None):
+    """
+    Write the checksum sidecar next to a local data file under a temp name and publish it (see
+    utils.atomic_publish), after the Future of another file when given. Returns the Future of the publication.
+    """
+    path = sidecar_path(data_path, algorithm)
+    tmp_path = temp_path(path)
+    with open(tmp_path, 'w') as f:
+        f.write(sidecar_content(data_path, digest))
+    return (publisher or Publisher.shared()).publish(tmp_path, path, after)
@@ -0,0 +1,126 @@
+import hashlib
+import importlib.util
+import json
+import os
+import sys
+
+# Bump when the layout of the cached plans changes
+PLAN_CACHE_VERSION = 2
+
+
+def plan_cache_path(path):
+    """The validated config of 'config/x.yaml' is cached as 'config/.x.yaml.plan'."""
+    directory, name = os.path.split(path)
+    return os.path.join(directory, f".{name}.plan")
+
+
+def load_config(path, compile_plan=None):
+    """
+    Load a YAML config and compile it with compile_plan (validating it and precompiling what it can),
+    through an on-disk cache so that a cron run whose configs did not change skips the YAML parse (and
+    the yaml import) and the validation.
+
+    The cache is plain JSON holding the validated config, never code: on a hit the plan is rebuilt from it
+    with compile_plan(config, validate=False), which only precompiles (e.g. the file name regexes). It is
+    keyed by the config's mtime and size, falling back to its sha256 when those changed (a touched or
+    re-deployed but identical config), and by the source files of the module defining compile_plan and of
+    the modules its PLAN_DEPENDENCIES lists, so a code change revalidates. Without compile_plan the parsed
+    config itself is cached. A config JSON cannot hold unchanged (dates, non-string keys) is not cached.
+
+    :raises FileNotFoundError: When the config does not exist.
+    :raises ValueError: When the YAML cannot be parsed or compile_plan rejects the config.
+    """
+    stat = os.stat(path)
+    cache_path = plan_cache_path(path)
+    key = plan_key(compile_plan)
+    cached = read_plan_cache(cache_path)
+    if cached is not None and cached.get('key') != key:
+        cached = None
+
+    if cached is not None and (cached['mtime_ns'], cached['size']) == (stat.st_mtime_ns, stat.st_size):
+        return build_plan(compile_plan, cached['config'])
+
+    with open(path, 'rb') as f:
+        content = f.read()
+    digest = hashlib.sha256(content).hexdigest()
+
+    if cached is not None and cached['sha256'] == digest:
+        config = cached['config']
+        plan = build_plan(compile_plan, config)
+    else:
+        import yaml
+        try:
+            config = yaml.safe_load(content)
+        except yaml.YAMLError as e:
+            raise ValueError(f"Error parsing YAML file {path}: {str(e)}")
+        plan = compile_plan(config) if compile_plan is not None else config
+
+    write_plan_cache(cache_path, {'key': key, 'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size,
+                                  'sha256': digest, 'config': config})
+    return plan
+
+
+def build_plan(compile_plan, config):
+    return compile_plan(config, validate=False) if compile_plan is not None else config
+
+
+def plan_key(compile_plan):
+    """
+    The cache key of compile_plan: its name and a digest of the (mtime, size) of every source file of its
+    module and of the modules or packages named by that module's PLAN_DEPENDENCIES.
+    """
+    if compile_plan is None:
+        return [PLAN_CACHE_VERSION, None, None]
+    module = sys.modules.get(compile_plan.__module__)
+    digest = hashlib.sha256()
+    for name in (compile_plan.__module__, *getattr(module, 'PLAN_DEPENDENCIES', ())):
+        for source_file in module_sources(name):
+            source_stat = os.stat(source_file)
+            digest.update(f"{source_file}\0{source_stat.st_mtime_ns}\0{source_stat.st_size}\n".encode())
+    return [PLAN_CACHE_VERSION, f"{compile_plan.__module__}.{compile_plan.__qualname__}", digest.hexdigest()]
+
+
+def module_sources(name):
+    """The source file of a module, or every .py file under a package, in a stable order."""
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        return []
+    if spec.submodule_search_locations:
+        return sorted(os.path.join(root, file_name)
+                      for location in spec.submodule_search_locations
+                      for root, _, file_names in os.walk(location)
+                      for file_name in file_names if file_name.endswith('.py'))
+    return [spec.origin] if spec.origin and os.path.exists(spec.origin) else []
+
+
+def read_plan_cache(cache_path):
+    try:
+        with open(cache_path, 'r') as f:
+            cached = json.load(f)
+        return cached if isinstance(cached, dict) else None
+    except FileNotFoundError:
+        return None
+    except Exception:
+        # Corrupt or written by an incompatible version: compiled again
+        return None
+
+
+def write_plan_cache(cache_path, entry):
+    """Write the cache entry atomically; a read-only config directory just means no cache."""
+    try:
+        content = json.dumps(entry)
+    except (TypeError, ValueError):
+        return
+    if json.loads(content)['config'] != entry['config']:
+        return
+
+    partial_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        with open(partial_path, 'w') as f:
+            f.write(content)
+        os.replace(partial_path, cache_path)
+    except OSError:
+        try:
+            os.remove(partial_path)
+        except OSError:
+            pass
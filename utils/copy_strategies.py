@@ -0,0 +1,127 @@
+import errno
+import fcntl
+import os
+import shutil
+
+# ioctl request cloning a whole file (btrfs, XFS with reflink=1, bcachefs, OCFS2, ...)
+FICLONE = 0x40049409
+
+# 'copy' is the user-space copy done by utils.file_utils (sendfile, or one read fanned out to many writes)
+STRATEGIES = ('reflink', 'hardlink', 'copy_file_range', 'copy')
+# Hardlinks share the inode with the source, so they are only used where a destination lists them
+DEFAULT_STRATEGIES = ('reflink', 'copy_file_range', 'copy')
+SAME_DEVICE_STRATEGIES = ('reflink', 'hardlink')
+
+# Errors meaning "this strategy does not work between these filesystems" rather than a failed copy
+UNSUPPORTED_ERRNOS = {errno.EOPNOTSUPP, errno.ENOTSUP, errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.ENOTTY,
+                      errno.EPERM, errno.EBADF}
+
+
+def reflink(src, dst):
+    """Share the source's extents copy-on-write: a metadata-only copy."""
+    with open(src, 'rb') as src_file, open(dst, 'wb') as dst_file:
+        fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+    shutil.copystat(src, dst)
+
+
+def hardlink(src, dst):
+    """Link dst to the source inode, replacing an existing dst atomically."""
+    tmp_path = f"{dst}.link.tmp"
+    try:
+        os.remove(tmp_path)
+    except FileNotFoundError:
+        pass
+    os.link(src, tmp_path)
+    os.replace(tmp_path, dst)
+
+
+def copy_file_range(src, dst):
+    """Let the kernel copy the bytes without passing them through user space (and reflink where it can)."""
+    if not hasattr(os, 'copy_file_range'):
+        raise OSError(errno.ENOSYS, "copy_file_range is not available on this platform")
+
+    with open(src, 'rb') as src_file, open(dst, 'wb') as dst_file:
+        size = os.fstat(src_file.fileno()).st_size
+        copied = 0
+        while copied < size:
+            count = os.copy_file_range(src_file.fileno(), dst_file.fileno(), size - copied)
+            if count == 0:
+                break
+            copied += count
+
+    if copied != size:
+        raise IOError(f"copy_file_range copied {copied} of {size} bytes from {src} to {dst}")
+    shutil.copystat(src, dst)
+
+
+KERNEL_STRATEGIES = {
+    'reflink': reflink,
+    'hardlink': hardlink,
+    'copy_file_range': copy_file_range,
+}
+
+
+class CopyStrategy:
+    """
+    The ordered copy strategies allowed for a destination, from its 'copy_strategies' setting.
+    A single name pins that strategy; leaving a strategy out of the list forbids it.
+    """
+
+    def __init__(self, strategies=None):
+        if isinstance(strategies, str):
+            strategies = [strategies]
+        self.strategies = tuple(strategies or DEFAULT_STRATEGIES)
+        for name in self.strategies:
+            if name not in STRATEGIES:
+                raise ValueError(f"Unknown copy strategy: {name}")
+        # (strategy, source device, destination device) combinations that turned out to be unsupported
+        self.unsupported = set()
+        # Device of each directory seen, so a copy costs no extra stat calls for the device check
+        self.devices = {}
+
+    def same_device(self, src, dst):
+        return self.device(os.path.dirname(src) or '.') == self.device(os.path.dirname(dst) or '.')
+
+    def device(self, directory):
+        device = self.devices.get(directory)
+        if device is None:
+            device = self.devices[directory] = os.stat(directory).st_dev
+        return device
+
+    def clone(self, src, dst):
+        """
+        Copy src to dst with the first kernel-side strategy that works between the two filesystems.
+        Returns its name, or None when the remaining choice is the user-space 'copy'.
+        Raises when no allowed strategy can copy the file.
+        """
+        src_device = self.device(os.path.dirname(src) or '.')
+        dst_device = self.device(os.path.dirname(dst) or '.')
+
+        # Never write through a hardlink (e.g. one left by an earlier run): it would truncate the source
+        try:
+            if os.stat(dst).st_nlink > 1:
+                os.remove(dst)
+        except FileNotFoundError:
+            pass
+
+        for name in self.strategies:
+            if name == 'copy':
+                return None
+            if name in SAME_DEVICE_STRATEGIES and src_device != dst_device:
+                continue
+            key = (name, src_device, dst_device)
+            if key in self.unsupported:
+                continue
+            try:
+                KERNEL_STRATEGIES[name](src, dst)
+                return name
+            except OSError as e:
+                if e.errno not in UNSUPPORTED_ERRNOS:
+                    raise
+                self.unsupported.add(key)
+
+        raise IOError(f"None of the copy strategies {', '.join(self.strategies)} can copy {src} to {dst}")
+
+
+# Used for every destination without its own 'copy_strategies'
+default_copy_strategy = CopyStrategy()
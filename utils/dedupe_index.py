@@ -0,0 +1,225 @@
+import argparse
+import fnmatch
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+from utils.transfer_journal import HASH_BLOCK_SIZE
+
+DROP = 'drop'
+DELIVER = 'deliver'
+DUPLICATE_POLICIES = (DROP, DELIVER)
+
+# Bytes read from each end of a file for its fingerprint; files up to twice this are hashed whole instead
+FINGERPRINT_WINDOW = 64 * 1024
+DEFAULT_MAX_AGE_DAYS = 7
+DEFAULT_MAX_ENTRIES = 100000
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS contents (
+    destination TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    fingerprint TEXT NOT NULL,
+    sha256 TEXT,
+    source_path TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    delivered REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS contents_fingerprint ON contents (destination, size, fingerprint);
+CREATE INDEX IF NOT EXISTS contents_delivered ON contents (destination, delivered);
+CREATE TABLE IF NOT EXISTS aliases (
+    destination TEXT NOT NULL,
+    name TEXT NOT NULL,
+    original TEXT NOT NULL,
+    sha256 TEXT NOT NULL,
+    delivered INTEGER NOT NULL,
+    recorded REAL NOT NULL
+);
+'''
+
+# Size, head / tail fingerprint and (when known) the sha256 of a file's content
+ContentKey = namedtuple('ContentKey', 'size fingerprint sha256')
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class DedupeIndex:
+    """
+    SQLite index of the content delivered to each destination, so a file whose bytes were already sent
+    (ISTAR re-exporting under a new hhmm stamp, reruns after failures) is recognised without comparing it
+    against every earlier file.
+
+    A file is looked up by its size and a fingerprint of its first and last FINGERPRINT_WINDOW bytes. Only
+    when that matches an earlier delivery are the full sha256s compared: the candidate's is computed then,
+    and the earlier file's is computed from its source the first time it is needed (an earlier file that
+    changed or disappeared since can no longer be confirmed, and never counts as a duplicate). Most files
+    are therefore never hashed in full.
+    """
+
+    _indexes = {}
+    _indexes_lock = threading.Lock()
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+
+        self.connection = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('PRAGMA busy_timeout=30000')
+        self.connection.executescript(SCHEMA)
+
+    @classmethod
+    def open(cls, db_path):
+        """Return the index for db_path, shared by every dispatcher of the process."""
+        db_path = os.path.abspath(db_path)
+        with cls._indexes_lock:
+            index = cls._indexes.get(db_path)
+            if index is None:
+                index = cls._indexes[db_path] = cls(db_path)
+            return index
+
+    @staticmethod
+    def content_key(path):
+        """Return the ContentKey of a file; small files are hashed whole, as that reads no more bytes."""
+        size = os.path.getsize(path)
+        digest = hashlib.blake2b(size.to_bytes(8, 'little'), digest_size=16)
+        with open(path, 'rb') as f:
+            if size <= 2 * FINGERPRINT_WINDOW:
+                content = f.read()
+                digest.update(content)
+                return ContentKey(size, digest.hexdigest(), hashlib.sha256(content).hexdigest())
+            digest.update(f.read(FINGERPRINT_WINDOW))
+            f.seek(size - FINGERPRINT_WINDOW)
+            digest.update(f.read(FINGERPRINT_WINDOW))
+        return ContentKey(size, digest.hexdigest(), None)
+
+    def find(self, destination, path, key):
+        """
+        Return (key, name delivered earlier with the same content, or None). The returned key carries the
+        file's sha256 when it had to be computed, for record() to reuse.
+        """
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT rowid, sha256, source_path, mtime_ns, name FROM contents '
+                'WHERE destination = ? AND size = ? AND fingerprint = ? ORDER BY delivered DESC',
+                (destination, key.size, key.fingerprint)).fetchall()
+        if not rows:
+            return key, None
+
+        if key.sha256 is None:
+            key = key._replace(sha256=file_sha256(path))
+        for rowid, sha256, source_path, mtime_ns, name in rows:
+            if sha256 is None:
+                sha256 = self.resolve_sha256(rowid, source_path, mtime_ns, key.size)
+            if sha256 == key.sha256:
+                return key, name
+        return key, None
+
+    def resolve_sha256(self, rowid, source_path, mtime_ns, size):
+        """Hash an earlier delivery from its source, if that is still the file that was delivered."""
+        try:
+            stat = os.stat(source_path)
+            if (stat.st_size, stat.st_mtime_ns) != (size, mtime_ns):
+                return None
+            sha256 = file_sha256(source_path)
+        except OSError:
+            return None
+        with self.lock:
+            self.connection.execute('UPDATE contents SET sha256 = ? WHERE rowid = ?', (sha256, rowid))
+        return sha256
+
+    def record(self, destination, path, key):
+        """Record that the file's content was delivered to the destination."""
+        with self.lock:
+            self.connection.execute(
+                'INSERT INTO contents (destination, size, fingerprint, sha256, source_path, mtime_ns, name, '
+                'delivered) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (destination, key.size, key.fingerprint, key.sha256, os.path.abspath(path),
+                 os.stat(path).st_mtime_ns, os.path.basename(path), time.time()))
+
+    def record_alias(self, destination, path, key, original, delivered):
+        """Record that the file is a duplicate of original, and whether it was still delivered."""
+        with self.lock:
+            self.connection.execute(
+                'INSERT INTO aliases (destination, name, original, sha256, delivered, recorded) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (destination, os.path.basename(path), original, key.sha256, int(delivered), time.time()))
+
+    def evict(self, destination, max_age_days=DEFAULT_MAX_AGE_DAYS, max_entries=DEFAULT_MAX_ENTRIES):
+        """Forget the destination's deliveries older than max_age_days and all but its newest max_entries."""
+        cutoff = time.time() - max_age_days * 86400
+        with self.lock:
+            removed = self.connection.execute(
+                'DELETE FROM contents WHERE destination = ? AND delivered < ?', (destination, cutoff)).rowcount
+            removed += self.connection.execute(
+                'DELETE FROM contents WHERE destination = ? AND rowid NOT IN (SELECT rowid FROM contents '
+                'WHERE destination = ? ORDER BY delivered DESC LIMIT ?)',
+                (destination, destination, max_entries)).rowcount
+            self.connection.execute(
+                'DELETE FROM aliases WHERE destination = ? AND recorded < ?', (destination, cutoff))
+        return removed
+
+    def aliases(self, since=0):
+        """Return the (recorded, destination, name, original, delivered) of the duplicates seen since a time."""
+        with self.lock:
+            return self.connection.execute(
+                'SELECT recorded, destination, name, original, delivered FROM aliases WHERE recorded >= ? '
+                'ORDER BY recorded', (since,)).fetchall()
+
+
+class DedupePolicy:
+    """
+    A directory's 'dedupe' settings: the index, its eviction limits and, per feed, whether duplicates are
+    dropped (the trigger is deleted without sending anything) or still delivered.
+    """
+
+    def __init__(self, index, duplicates=DROP, feeds=(), max_age_days=DEFAULT_MAX_AGE_DAYS,
+                 max_entries=DEFAULT_MAX_ENTRIES):
+        self.index = index
+        self.duplicates = duplicates
+        # (fnmatch pattern on the file name, policy): the first match wins
+        self.feeds = [(feed.get('pattern', '*'), feed.get('duplicates', duplicates)) for feed in feeds]
+        self.max_age_days = max_age_days
+        self.max_entries = max_entries
+        for _, policy in [('*', duplicates)] + self.feeds:
+            if policy not in DUPLICATE_POLICIES:
+                raise ValueError(f"Unknown duplicates policy: {policy} (use one of {', '.join(DUPLICATE_POLICIES)})")
+
+    @classmethod
+    def from_config(cls, config):
+        """From a 'dedupe' block: {'index_path': ..., 'duplicates': 'drop', 'feeds': [...], 'max_age_days': ...}."""
+        return cls(DedupeIndex.open(config['index_path']), config.get('duplicates', DROP), config.get('feeds', []),
+                   config.get('max_age_days', DEFAULT_MAX_AGE_DAYS), config.get('max_entries', DEFAULT_MAX_ENTRIES))
+
+    def policy_for(self, name):
+        for pattern, policy in self.feeds:
+            if fnmatch.fnmatch(name, pattern):
+                return policy
+        return self.duplicates
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect the dispatcher content-hash dedupe index.")
+    parser.add_argument('db_path', help="Path of the dedupe index database")
+    parser.add_argument('--hours', type=float, default=24, help="Show the duplicates of the last hours (default: 24)")
+    args = parser.parse_args()
+
+    index = DedupeIndex(args.db_path)
+    for recorded, destination, name, original, delivered in index.aliases(time.time() - args.hours * 3600):
+        print(f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(recorded))}\t"
+              f"{'delivered' if delivered else 'dropped'}\t{destination}\t{name}\t= {original}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+import os
+import socket
+import threading
+import time
+
+from utils.logger import get_logger
+
+# A claimed trigger is renamed to '<trigger>.claim-<node>', which no scan takes for a trigger
+CLAIM_MARKER = '.claim-'
+DEFAULT_LEASE_SECONDS = 300
+
+
+class FileClaims:
+    """
+    Claims trigger files on a source directory shared by several nodes (batch servers).
+
+    A node claims a file by atomically renaming its trigger to '<trigger>.claim-<node>': of several nodes
+    racing for the same trigger exactly one rename succeeds, the others get FileNotFoundError and skip
+    the file. The claim's mtime is its lease. A heartbeat thread touches the held claims every third of
+    the lease, and a claim nobody touched for lease_seconds is renamed back to its trigger by the next
+    scan of any node, so the files of a dead node are picked up again. A claim whose file failed is
+    simply no longer renewed: it lapses and the file is retried by whichever node scans next.
+    """
+
+    def __init__(self, node=None, lease_seconds=DEFAULT_LEASE_SECONDS, logger_name='receiver_logger'):
+        # Host and pid, so two processes on one server are different nodes too
+        self.node = str(node or f"{socket.gethostname()}-{os.getpid()}")
+        if os.sep in self.node:
+            raise ValueError(f"Invalid claim node name: {self.node}")
+        self.lease_seconds = lease_seconds
+        self.held = set()
+        self.lock = threading.Lock()
+        self.heartbeat = None
+        self.logger = get_logger(logger_name)
+
+    @classmethod
+    def from_config(cls, config, logger_name):
+        """From a 'claims' block: {'node': ..., 'lease_seconds': ...}; true alone enables the defaults."""
+        config = config if isinstance(config, dict) else {}
+        return cls(config.get('node'), config.get('lease_seconds', DEFAULT_LEASE_SECONDS), logger_name)
+
+    @staticmethod
+    def trigger_path(claim_path):
+        """The trigger a claim was made from."""
+        return claim_path[:claim_path.rindex(CLAIM_MARKER)]
+
+    def claim(self, trigger_path):
+        """Claim the trigger for this node. Returns the claim path, or None when another node was first."""
+        claim_path = f"{trigger_path}{CLAIM_MARKER}{self.node}"
+        try:
+            # The rename keeps the mtime, so start the lease before it (an old trigger would look expired)
+            os.utime(trigger_path)
+            os.rename(trigger_path, claim_path)
+        except FileNotFoundError:
+            return None
+
+        with self.lock:
+            self.held.add(claim_path)
+            if self.heartbeat is None:
+                self.heartbeat = threading.Thread(target=self.renew_leases, name='claim-heartbeat', daemon=True)
+                self.heartbeat.start()
+        return claim_path
+
+    def release(self, claim_path):
+        """
+        Stop renewing a claim: once its file is done the claim has been deleted with it, otherwise it
+        lapses after the lease and the file is retried.
+        """
+        with self.lock:
+            self.held.discard(claim_path)
+
+    def renew_leases(self):
+        while True:
+            time.sleep(self.lease_seconds / 3)
+            with self.lock:
+                held = list(self.held)
+            for claim_path in held:
+                try:
+                    os.utime(claim_path)
+                except FileNotFoundError:
+                    with self.lock:
+                        lost = claim_path in self.held
+                        self.held.discard(claim_path)
+                    if lost:
+                        self.logger.warning(f"Lost the lease on {claim_path}: it was reclaimed by another node")
+                except OSError as e:
+                    self.logger.error(f"Failed to renew the lease on {claim_path}: {str(e)}")
+
+    def reclaim_expired(self, directory, claim_names):
+        """
+        Rename the claims in directory whose lease ran out back to their triggers.
+        Returns the names of the triggers restored.
+        """
+        restored = []
+        now = time.time()
+        for name in claim_names:
+            claim_path = os.path.join(directory, name)
+            with self.lock:
+                if claim_path in self.held:
+                    continue
+            try:
+                if now - os.stat(claim_path).st_mtime < self.lease_seconds:
+                    continue
+                os.rename(claim_path, self.trigger_path(claim_path))
+            except FileNotFoundError:
+                # Reclaimed or completed by another node in the meantime
+                continue
+            self.logger.warning(f"Reclaimed {name}: its lease expired")
+            restored.append(self.trigger_path(name))
+        return restored
@@ -1,34 +1,250 @@
+import errno
 import os
-import re
+import queue
 import shutil
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
-from pathlib import Path
+from utils.atomic_publish import Publisher, discard, temp_path
+from utils.copy_strategies import default_copy_strategy
 
+COPY_BUFFER_SIZE = 1024 * 1024
+PARALLEL_COPY_WORKERS = 4
+PARALLEL_COPY_CHUNK_SIZE = 8 * 1024 * 1024
 
-def copy_file(src, dst):
-    """Copy a file from source to destination."""
+
+def copy_file(src, dst, hasher=None, strategy=None, publisher=None, after=None):
+    """
+    Copy a file from source to destination through the destination's copy strategy (reflink,
+    copy_file_range, ... see utils.copy_strategies). With a hasher (see utils.checksum) the bytes are
+    fed to it on the same pass and the written size is checked.
+
+    The copy is written under a temp name and published through the publisher (see utils.atomic_publish),
+    after the Future of another file when given. Returns the Future of the publication.
+    """
+    publisher = publisher or Publisher.shared()
+    tmp = temp_path(dst)
+    failures = fan_out_copy(src, [tmp], hasher=hasher, strategies={tmp: strategy} if strategy else None)
+    if failures:
+        discard(tmp)
+        raise IOError(f"Failed to copy {src} to {dst}: {failures[tmp]}")
+    return publisher.publish(tmp, dst, after)
+
+
+def fan_out_copy(src, dsts, buffer_size=COPY_BUFFER_SIZE, hasher=None, strategies=None, throttles=None):
+    """
+    Copy one source file to several destinations while reading the source only once.
+
+    Each destination first tries the kernel-side strategies of its CopyStrategy (strategies maps a
+    destination to one), so a same-filesystem copy is usually a reflink. Without a configured strategy
+    only destinations on the source's device try default_copy_strategy: between filesystems a kernel
+    copy (copy_file_range on 5.3-5.18 kernels) reads the source once per destination, which on an NFS
+    source is what the single read below avoids. The destinations left to the user-space copy are
+    copied together: a single one through sendfile, several by reading each chunk once into a reused
+    buffer and writing it to every one.
+    With a hasher the source is hashed on that pass (or read once for it when every destination was
+    cloned). throttles maps a destination to a callable charging bytes to it (e.g. a bandwidth cap): a
+    user-space copy charges every chunk as it is read, a kernel-side copy, whose progress is not visible,
+    the size of the source once done.
+    A failing destination is dropped without affecting the others; the failures are
+    returned as a {destination: exception} dict. Errors reading the source are raised.
+    """
+    throttles = throttles or {}
+    failures = {}
+    cloned = []
+    remaining = []
+    for dst in dsts:
+        strategy = (strategies or {}).get(dst)
+        try:
+            if strategy is None:
+                strategy = default_copy_strategy
+                if not strategy.same_device(src, dst):
+                    remaining.append(dst)
+                    continue
+            if strategy.clone(src, dst) is None:
+                remaining.append(dst)
+            else:
+                cloned.append(dst)
+        except Exception as e:
+            failures[dst] = e
+
+    for dst in cloned:
+        if throttles.get(dst) is not None:
+            throttles[dst](os.path.getsize(src))
+    if not remaining:
+        if hasher is not None and cloned:
+            hash_file(src, hasher, buffer_size)
+        return failures
+
+    if len(remaining) == 1 and hasher is None and throttles.get(remaining[0]) is None:
+        try:
+            shutil.copy2(src, remaining[0])
+        except Exception as e:
+            failures[remaining[0]] = IOError(f"Failed to copy {src} to {remaining[0]}: {e}")
+        return failures
+
+    failures.update(stream_copy(src, remaining, buffer_size, hasher, throttles))
+    return failures
+
+
+def hash_file(src, hasher, buffer_size=COPY_BUFFER_SIZE):
+    """Feed the content of src to hasher."""
     try:
-        shutil.copy2(src, dst)
+        with open(src, 'rb') as src_file:
+            buffer = bytearray(buffer_size)
+            view = memoryview(buffer)
+            while True:
+                read = src_file.readinto(buffer)
+                if not read:
+                    break
+                hasher.update(view[:read])
     except Exception as e:
-        raise IOError(f"Failed to copy {src} to {dst}: {e}")
+        raise IOError(f"Failed to read {src} for its checksum: {e}")
 
 
-def match_file_pattern(pattern, filename):
-    """Check if the filename matches the given pattern with nn and hhmm."""
-    regex = pattern.replace('nn', r'\d{2}').replace('hhmm', r'\d{4}')
-    return re.match(regex, filename)
+def stream_copy(src, dsts, buffer_size=COPY_BUFFER_SIZE, hasher=None, throttles=None):
+    """
+    Copy src to every destination in user space: each chunk is read once into a reused buffer, fed to
+    the hasher and written to every destination (charged to its throttle, if any), and each destination's
+    size is checked against the bytes read. Returns the {destination: exception} failures; errors reading the source are raised.
+    """
+    failures = {}
+    outputs = {}
+    copied = 0
+    try:
+        with open(src, 'rb') as src_file:
+            expected_size = os.fstat(src_file.fileno()).st_size
+            for dst in dsts:
+                try:
+                    outputs[dst] = open(dst, 'wb')
+                except Exception as e:
+                    failures[dst] = e
 
+            buffer = bytearray(buffer_size)
+            view = memoryview(buffer)
+            while outputs:
+                read = src_file.readinto(buffer)
+                if not read:
+                    break
+                copied += read
+                if hasher is not None:
+                    hasher.update(view[:read])
+                for dst, out in list(outputs.items()):
+                    try:
+                        if (throttles or {}).get(dst) is not None:
+                            throttles[dst](read)
+                        out.write(view[:read])
+                    except Exception as e:
+                        failures[dst] = e
+                        out.close()
+                        del outputs[dst]
 
-def trg_file_exists(dat_file_path):
-    """Check if the corresponding .trg file exists for the .dat file."""
-    trg_file = dat_file_path.replace('.dat', '.trg')
-    return os.path.exists(trg_file)
+            if outputs and copied != expected_size:
+                raise IOError(f"{src} changed size while being copied ({expected_size} -> {copied} bytes)")
+    except Exception as e:
+        raise IOError(f"Failed to read {src} while copying to {len(dsts)} destinations: {e}")
+    finally:
+        for dst, out in outputs.items():
+            try:
+                out.close()
+            except Exception as e:
+                failures[dst] = e
 
+    for dst in outputs:
+        if dst not in failures:
+            try:
+                written = os.stat(dst).st_size
+                if written != copied:
+                    raise IOError(f"Size mismatch after copy to {dst}: read {copied}, written {written}")
+                shutil.copystat(src, dst)
+            except Exception as e:
+                failures[dst] = e
 
-def delete_trg_file(dat_file_path):
-    """Delete the .trg file after processing."""
-    trg_file = dat_file_path.replace('.dat', '.trg')
+    return failures
+
+
+def parallel_copy(src, dst, workers=PARALLEL_COPY_WORKERS, chunk_size=PARALLEL_COPY_CHUNK_SIZE, hasher=None,
+                  publisher=None):
+    """
+    Copy a large file as chunk_size ranges written by several threads with pread/pwrite, so a network
+    filesystem sees several requests in flight instead of one stream. The ranges go into a preallocated
+    temp file next to dst, which is published through the publisher once complete; returns the Future of
+    the publication. With a hasher the workers hand the blocks they read to the calling thread, which
+    hashes them in file order as they arrive, so the source is read only once.
+    """
+    tmp_path = temp_path(dst)
+    src_fd = os.open(src, os.O_RDONLY)
     try:
-        os.remove(trg_file)
-    except OSError:
-        raise IOError(f"Failed to delete trigger file: {trg_file}")
+        size = os.fstat(src_fd).st_size
+        dst_fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            preallocate(dst_fd, size)
+            offsets = range(0, size, chunk_size)
+
+            def copy_range(offset, blocks):
+                end = min(offset + chunk_size, size)
+                try:
+                    while offset < end:
+                        data = os.pread(src_fd, min(COPY_BUFFER_SIZE, end - offset), offset)
+                        if not data:
+                            raise IOError(f"{src} is shorter than {size} bytes")
+                        view = memoryview(data)
+                        while view:
+                            written = os.pwrite(dst_fd, view, offset)
+                            view = view[written:]
+                            offset += written
+                        if blocks is not None:
+                            blocks.put(data)
+                finally:
+                    if blocks is not None:
+                        blocks.put(None)
+
+            def hash_range(blocks):
+                for data in iter(blocks.get, None):
+                    hasher.update(data)
+
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='range-copy') as executor:
+                if hasher is None:
+                    futures = [executor.submit(copy_range, offset, None) for offset in offsets]
+                else:
+                    # The blocks of each range, ended by None; a range is only submitted once the hasher is
+                    # at most 2 * workers ranges behind, which bounds the memory held
+                    futures, ahead = [], deque()
+                    for offset in offsets:
+                        if len(ahead) == 2 * workers:
+                            hash_range(ahead.popleft())
+                        ahead.append(queue.SimpleQueue())
+                        futures.append(executor.submit(copy_range, offset, ahead[-1]))
+                    while ahead:
+                        hash_range(ahead.popleft())
+                for future in futures:
+                    future.result()
+
+            if os.fstat(dst_fd).st_size != size:
+                raise IOError(f"Size mismatch after copy to {tmp_path}: expected {size} bytes")
+        finally:
+            os.close(dst_fd)
+
+        shutil.copystat(src, tmp_path)
+    except Exception as e:
+        discard(tmp_path)
+        raise IOError(f"Failed to copy {src} to {dst} in parallel: {e}")
+    finally:
+        os.close(src_fd)
+    return (publisher or Publisher.shared()).publish(tmp_path, dst)
+
+
+def preallocate(fd, size):
+    """
+    Reserve size bytes for the file, falling back to only setting its length where fallocate is not
+    supported (SMB, NFS before 4.2).
+    """
+    if size and hasattr(os, 'posix_fallocate'):
+        try:
+            os.posix_fallocate(fd, 0, size)
+            return
+        except OSError as e:
+            if e.errno not in (errno.EOPNOTSUPP, errno.ENOTSUP, errno.EINVAL, errno.ENOSYS):
+                raise
+    os.ftruncate(fd, size)
+
@@ -1,15 +1,36 @@
+import atexit
+import json
 import logging
 import logging.config
-import yaml
+import logging.handlers
+import queue
+import threading
+import time
 import os
 
+from utils.config_loader import load_config
+from utils.metrics import LOG_RECORDS_DROPPED
+
+DEFAULT_QUEUE_SIZE = 10000
+# Seconds between the warnings reporting records dropped by a full logging queue
+DROPPED_REPORT_INTERVAL = 60
+
+# Attributes every LogRecord has; anything else on a record came in through 'extra'
+RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
 
 def setup_logging(path, default_level=logging.INFO):
+    """
+    Configure logging from a dictConfig YAML file. An optional top-level 'queue' block
+    ({enabled: true, size: 10000}) moves the configured handlers behind a queue (see start_queue_logging).
+    """
     try:
         if os.path.exists(path):
-            with open(path, 'r') as f:
-                config = yaml.safe_load(f.read())
-                logging.config.dictConfig(config)
+            config = load_config(path)
+            queue_config = config.pop('queue', None) or {}
+            logging.config.dictConfig(config)
+            if queue_config.get('enabled', False):
+                start_queue_logging(config, queue_config.get('size', DEFAULT_QUEUE_SIZE))
         else:
             logging.basicConfig(level=default_level)
     except Exception as e:
@@ -19,3 +40,148 @@ def setup_logging(path, default_level=logging.INFO):
 
 def get_logger(name):
     return logging.getLogger(name)
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to a QueueListener thread that does the formatting and the I/O. The record is queued as
+    it is, so its message is only formatted if a handler emits it. When the queue is full a record below
+    WARNING is dropped instead of blocking the caller, while warnings and errors wait for room. Drops are
+    counted in feed_log_records_dropped_total and reported by a warning at most every
+    DROPPED_REPORT_INTERVAL seconds, once the queue has room again.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self.unreported = 0
+        self.reported = time.monotonic()
+        self.dropped_lock = threading.Lock()
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        if record.levelno >= logging.WARNING:
+            self.queue.put(record)
+            return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self.dropped_lock:
+                self.dropped += 1
+                self.unreported += 1
+            LOG_RECORDS_DROPPED.inc(logger=record.name)
+            return
+        if self.unreported and time.monotonic() - self.reported >= DROPPED_REPORT_INTERVAL:
+            self.report_dropped(record.name)
+
+    def report_dropped(self, name):
+        with self.dropped_lock:
+            unreported, self.unreported = self.unreported, 0
+            self.reported = time.monotonic()
+        if not unreported:
+            return
+        try:
+            self.queue.put_nowait(logging.LogRecord(
+                name, logging.WARNING, __file__, 0, "Dropped %d log records below WARNING: the logging queue was full",
+                (unreported,), None))
+        except queue.Full:
+            # Reported with the next ones
+            with self.dropped_lock:
+                self.unreported += unreported
+
+
+def start_queue_logging(config, size=DEFAULT_QUEUE_SIZE):
+    """
+    Replace the handlers of the root logger and of every logger in the dictConfig config by a
+    NonBlockingQueueHandler, with one QueueListener thread per distinct set of handlers. The listeners
+    are stopped, and their queues drained, at exit.
+    """
+    loggers = [logging.getLogger()] + [logging.getLogger(name) for name in config.get('loggers', {})]
+    queue_handlers = {}
+    for logger in loggers:
+        handlers = tuple(logger.handlers)
+        if not handlers:
+            continue
+        if handlers not in queue_handlers:
+            log_queue = queue.Queue(size)
+            listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+            listener.start()
+            atexit.register(listener.stop)
+            queue_handlers[handlers] = NonBlockingQueueHandler(log_queue)
+        for handler in handlers:
+            logger.removeHandler(handler)
+        logger.addHandler(queue_handlers[handlers])
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line: time, level, logger, thread, message, the exception if any and every
+    field passed through 'extra' (file, destination, bytes, ...). Use with '()': utils.logger.JsonFormatter.
+    """
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        entry.update({key: value for key, value in vars(record).items() if key not in RECORD_ATTRIBUTES})
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class SampleFilter(logging.Filter):
+    """
+    Lets one in every 'every' records at or below max_level through, per logger; higher levels always pass.
+    Meant for per-file debug events on loggers that handle many files.
+    """
+
+    def __init__(self, every=100, max_level='DEBUG'):
+        super().__init__()
+        self.every = every
+        self.max_level = logging.getLevelName(max_level) if isinstance(max_level, str) else max_level
+        self.counts = {}
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno > self.max_level:
+            return True
+        with self.lock:
+            count = self.counts.get(record.name, 0)
+            self.counts[record.name] = count + 1
+        return count % self.every == 0
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets at most 'rate' records per second (in bursts of up to 'burst') at or below max_level through,
+    per logger; higher levels always pass. The number suppressed is added to the next record let through.
+    """
+
+    def __init__(self, rate=100, burst=None, max_level='INFO'):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst or rate
+        self.max_level = logging.getLevelName(max_level) if isinstance(max_level, str) else max_level
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno > self.max_level:
+            return True
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated, suppressed = self.buckets.get(record.name, (self.burst, now, 0))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens < 1:
+                self.buckets[record.name] = (tokens, now, suppressed + 1)
+                return False
+            self.buckets[record.name] = (tokens - 1, now, 0)
+        if suppressed:
+            record.suppressed = suppressed
+        return True
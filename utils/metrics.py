@@ -0,0 +1,171 @@
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300)
+
+
+def escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{escape_label_value(value)}"' for name, value in pairs) + '}'
+
+
+def format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    metric_type = None
+
+    def __init__(self, name, help_text, lock):
+        self.name = name
+        self.help_text = help_text
+        self.lock = lock
+        self.values = {}
+
+    @staticmethod
+    def key(labels):
+        return tuple(sorted(labels.items()))
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.metric_type}"]
+
+
+class Counter(Metric):
+    metric_type = 'counter'
+
+    def inc(self, value=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def lines(self):
+        return [f"{self.name}{format_labels(key)} {format_value(value)}" for key, value in self.values.items()]
+
+
+class Gauge(Counter):
+    metric_type = 'gauge'
+
+    def set(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = value
+
+
+class Histogram(Metric):
+    metric_type = 'histogram'
+
+    def __init__(self, name, help_text, lock, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, lock)
+        self.buckets = tuple(buckets) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                # One counter per bucket, then the sum and the count
+                counts = self.values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the block in seconds."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def lines(self):
+        lines = []
+        for key, counts in self.values.items():
+            for bound, count in zip(self.buckets, counts):
+                lines.append(f"{self.name}_bucket{format_labels(key, [('le', format_value(bound))])} {count}")
+            lines.append(f"{self.name}_sum{format_labels(key)} {format_value(counts[-2])}")
+            lines.append(f"{self.name}_count{format_labels(key)} {counts[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    """In-process metrics written out in the Prometheus text format for the node exporter textfile collector."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = []
+        self.last_written = 0.0
+
+    def counter(self, name, help_text):
+        return self.register(Counter(name, help_text, self.lock))
+
+    def gauge(self, name, help_text):
+        return self.register(Gauge(name, help_text, self.lock))
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help_text, self.lock, buckets))
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        with self.lock:
+            lines = []
+            for metric in self.metrics:
+                if metric.values:
+                    lines.extend(metric.header())
+                    lines.extend(metric.lines())
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, path):
+        """Write atomically (temp file + rename), as the textfile collector may read at any moment."""
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+        self.last_written = time.monotonic()
+
+    def write_textfile_every(self, path, interval):
+        """Write the textfile unless it was written less than interval seconds ago (long-running mode)."""
+        if time.monotonic() - self.last_written >= interval:
+            self.write_textfile(path)
+
+
+registry = MetricsRegistry()
+
+STAGE_SECONDS = registry.histogram(
+    'feed_stage_duration_seconds', 'Time spent per pipeline stage (scan, sequence_lookup, copy, ...), feed and destination.')
+FILES = registry.counter(
+    'feed_files_total', 'Files handled per feed pattern and destination, by outcome.')
+BYTES = registry.counter(
+    'feed_bytes_total', 'Bytes moved per feed pattern and destination.')
+BACKLOG = registry.gauge(
+    'feed_backlog_files', 'Files with a trigger waiting at the last scan, per feed pattern or source directory.')
+DEADLINE_MISSED = registry.counter(
+    'feed_deadline_missed_total', 'Files scheduled after the daily deadline of their feed.')
+LAST_RUN = registry.gauge(
+    'feed_last_run_timestamp_seconds', 'Unix time at which the pipeline last completed a pass.')
+LOG_RECORDS_DROPPED = registry.counter(
+    'feed_log_records_dropped_total', 'Log records below WARNING dropped because the logging queue was full.')
+
+
+def write_metrics(path, interval=None):
+    """Write the process metrics to the textfile at path, at most every interval seconds when given."""
+    if interval is None:
+        registry.write_textfile(path)
+    else:
+        registry.write_textfile_every(path, interval)
@@ -0,0 +1,69 @@
+import json
+import os
+import threading
+
+
+class ScanWatermarks:
+    """
+    Persisted (device, inode, mtime) watermarks of source directories, so a pass can skip listing a
+    directory nothing was added to (or removed from) since a pass that found no work in it.
+
+    A directory is only skipped once two successive empty listings saw the same stamp: a file created
+    in the same timestamp tick as the first listing leaves the mtime unchanged, but is seen by the second
+    listing. Every listing that finds work, and every change of the stamp, resets the directory.
+    """
+
+    _watermarks = {}
+    _watermarks_lock = threading.Lock()
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        try:
+            with open(path, 'r') as f:
+                self.entries = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self.entries = {}
+
+    @classmethod
+    def open(cls, path):
+        """Return the watermarks stored at path, shared by every dispatcher of the process."""
+        path = os.path.abspath(path)
+        with cls._watermarks_lock:
+            watermarks = cls._watermarks.get(path)
+            if watermarks is None:
+                watermarks = cls._watermarks[path] = cls(path)
+            return watermarks
+
+    @staticmethod
+    def stamp(directory_stat):
+        return [directory_stat.st_dev, directory_stat.st_ino, directory_stat.st_mtime_ns]
+
+    def unchanged(self, key, directory_stat):
+        """Whether the directory was confirmed empty of work at exactly this stamp."""
+        with self.lock:
+            entry = self.entries.get(key)
+        return entry is not None and entry['confirmed'] and entry['stamp'] == self.stamp(directory_stat)
+
+    def record_empty(self, key, directory_stat):
+        """Record a listing, started at directory_stat, that found no work."""
+        stamp = self.stamp(directory_stat)
+        with self.lock:
+            entry = self.entries.get(key)
+            confirmed = entry is not None and entry['stamp'] == stamp
+            if entry == {'stamp': stamp, 'confirmed': confirmed}:
+                return
+            self.entries[key] = {'stamp': stamp, 'confirmed': confirmed}
+            self.save()
+
+    def clear(self, key):
+        """Forget the directory's watermark after a listing that found work."""
+        with self.lock:
+            if self.entries.pop(key, None) is not None:
+                self.save()
+
+    def save(self):
+        partial_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(partial_path, 'w') as f:
+            json.dump(self.entries, f)
+        os.replace(partial_path, self.path)
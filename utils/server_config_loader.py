@@ -1,8 +1,9 @@
 # utils/server_config_loader.py
 
-import yaml
 import os
 
+from utils.config_loader import load_config
+
 class ServerConfigLoader:
     """Class to load server configurations for different environments."""
 
@@ -21,8 +22,8 @@ class ServerConfigLoader:
         if not os.path.exists(server_config_path):
             raise FileNotFoundError(f"Server config file for {environment} not found: {server_config_path}")
 
-        with open(server_config_path, 'r') as file:
-            server_configs = yaml.safe_load(file)
+        # Parsed once and cached next to the file, like the dispatcher config
+        server_configs = load_config(server_config_path)
 
         server_info = server_configs.get('servers', {}).get(server_name)
 
@@ -0,0 +1,154 @@
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from utils.logger import get_logger
+from utils.metrics import STAGE_SECONDS
+
+DEFAULT_SAMPLE_INTERVAL_MS = 5
+
+
+class Tracer:
+    """
+    Records spans as Chrome trace events ('X' complete events, one track per thread) while enabled,
+    for Perfetto or chrome://tracing. Disabled, a span costs one attribute check.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.events = []
+        self.threads = {}
+        self.lock = threading.Lock()
+        self.origin = time.perf_counter()
+
+    def enable(self):
+        self.origin = time.perf_counter()
+        self.enabled = True
+
+    @contextmanager
+    def span(self, name, category, **args):
+        """Record the block as a span; args (file, destination, ...) show up in the trace viewer."""
+        if not self.enabled:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        except BaseException as e:
+            args['error'] = repr(e)
+            raise
+        finally:
+            self.record(name, category, started, time.perf_counter(), args)
+
+    def record(self, name, category, started, ended, args):
+        thread = threading.current_thread()
+        event = {'name': str(name), 'cat': category, 'ph': 'X', 'pid': os.getpid(), 'tid': thread.ident,
+                 'ts': (started - self.origin) * 1e6, 'dur': (ended - started) * 1e6, 'args': args}
+        with self.lock:
+            self.threads.setdefault(thread.ident, thread.name)
+            self.events.append(event)
+
+    def write(self, path):
+        """Write the trace-event JSON file."""
+        with self.lock:
+            events = [{'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': tid, 'args': {'name': name}}
+                      for tid, name in self.threads.items()] + self.events
+        with open(path, 'w') as f:
+            # Paths and other objects in the span args are written as strings
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f, default=str)
+
+
+tracer = Tracer()
+
+
+@contextmanager
+def stage(pipeline, name, feed='', destination='', **args):
+    """
+    Time a pipeline stage into feed_stage_duration_seconds per feed and destination (left empty by the
+    stages that are not tied to one) and, while tracing, record it as a span carrying them and args (file, ...).
+    """
+    labels = {'pipeline': pipeline, 'stage': name, 'feed': str(feed), 'destination': str(destination)}
+    if not tracer.enabled:
+        with STAGE_SECONDS.time(**labels):
+            yield
+        return
+    args.update((label, value) for label, value in (('feed', feed), ('destination', destination)) if value)
+    with tracer.span(name, pipeline, **args), STAGE_SECONDS.time(**labels):
+        yield
+
+
+class StackSampler:
+    """
+    Samples the stack of every thread each interval and counts them as collapsed stacks
+    ('thread;outer;...;inner count'), the input of flamegraph.pl, speedscope or Perfetto.
+    """
+
+    def __init__(self, interval_ms=DEFAULT_SAMPLE_INTERVAL_MS):
+        self.interval = interval_ms / 1000
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='stack-sampler', daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def run(self):
+        own_ident = threading.get_ident()
+        while not self.stopped.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                # Pool threads ('receiver_3') are merged into one root per pool
+                stack.append(re.sub(r'_\d+$', '', names.get(ident, str(ident))))
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+def add_profile_arguments(parser):
+    parser.add_argument('--profile', metavar='TRACE_JSON',
+                        help="Record a span per file and stage into a Chrome trace file (open in Perfetto)")
+    parser.add_argument('--profile-stacks', metavar='STACKS_TXT',
+                        help="Sample all thread stacks and write collapsed stacks for flamegraphs")
+    parser.add_argument('--profile-interval', type=float, default=DEFAULT_SAMPLE_INTERVAL_MS,
+                        help=f"Milliseconds between stack samples (default: {DEFAULT_SAMPLE_INTERVAL_MS})")
+
+
+@contextmanager
+def profiling(args, logger_name):
+    """Trace and / or sample the block as the --profile options ask, writing the files when it ends."""
+    logger = get_logger(logger_name)
+    sampler = None
+    if args.profile:
+        tracer.enable()
+    if args.profile_stacks:
+        sampler = StackSampler(args.profile_interval)
+        sampler.start()
+    try:
+        yield
+    finally:
+        if sampler is not None:
+            sampler.stop()
+            sampler.write(args.profile_stacks)
+            logger.info(f"Wrote collapsed stacks to {args.profile_stacks}")
+        if args.profile:
+            tracer.write(args.profile)
+            logger.info(f"Wrote trace to {args.profile}")
@@ -0,0 +1,184 @@
+import argparse
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+
+STATE_IN_FLIGHT = 'in_flight'
+STATE_DONE = 'done'
+STATE_FAILED = 'failed'
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    file_id INTEGER PRIMARY KEY,
+    source_dir TEXT NOT NULL,
+    name TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    sha256 TEXT NOT NULL DEFAULT '',
+    first_seen REAL NOT NULL,
+    UNIQUE (source_dir, name, size, mtime_ns, sha256)
+);
+CREATE TABLE IF NOT EXISTS destinations (
+    file_id INTEGER NOT NULL REFERENCES files (file_id),
+    destination TEXT NOT NULL,
+    state TEXT NOT NULL,
+    target TEXT,
+    error TEXT,
+    updated REAL NOT NULL,
+    PRIMARY KEY (file_id, destination)
+);
+CREATE INDEX IF NOT EXISTS destinations_state ON destinations (state);
+'''
+
+
+class TransferJournal:
+    """
+    SQLite journal of what the receiver and dispatchers have already done.
+
+    Every source file is identified by (directory, name, size, mtime[, sha256]) and the state of each of its
+    destinations is recorded as in_flight, done or failed. After a crash a rerun looks the file up by its
+    identity and skips the destinations that are already done instead of copying (and re-sequencing) again.
+    """
+
+    _journals = {}
+    _journals_lock = threading.Lock()
+
+    def __init__(self, db_path, hash_files=False):
+        self.db_path = db_path
+        self.hash_files = hash_files
+        self.lock = threading.Lock()
+
+        self.connection = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('PRAGMA busy_timeout=30000')
+        self.connection.executescript(SCHEMA)
+
+    @classmethod
+    def open(cls, db_path, hash_files=False):
+        """Return the journal for db_path, shared by every receiver/dispatcher of the process."""
+        db_path = os.path.abspath(db_path)
+        with cls._journals_lock:
+            journal = cls._journals.get(db_path)
+            if journal is None:
+                journal = cls._journals[db_path] = cls(db_path, hash_files)
+            return journal
+
+    def file_identity(self, file_path):
+        """Return the (source_dir, name, size, mtime_ns, sha256) identity of a file."""
+        stat = os.stat(file_path)
+        sha256 = ''
+        if self.hash_files:
+            digest = hashlib.sha256()
+            with open(file_path, 'rb') as f:
+                for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+                    digest.update(block)
+            sha256 = digest.hexdigest()
+        return (os.path.dirname(os.path.abspath(file_path)), os.path.basename(file_path),
+                stat.st_size, stat.st_mtime_ns, sha256)
+
+    def record_file(self, file_path):
+        """Record the file's identity (if new) and return its file_id."""
+        identity = self.file_identity(file_path)
+        with self.lock:
+            self.connection.execute(
+                'INSERT OR IGNORE INTO files (source_dir, name, size, mtime_ns, sha256, first_seen) '
+                'VALUES (?, ?, ?, ?, ?, ?)', identity + (time.time(),))
+            row = self.connection.execute(
+                'SELECT file_id FROM files WHERE source_dir = ? AND name = ? AND size = ? AND mtime_ns = ? '
+                'AND sha256 = ?', identity).fetchone()
+        return row[0]
+
+    def completed_destinations(self, file_id):
+        """Return the set of destinations already done for the file."""
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT destination FROM destinations WHERE file_id = ? AND state = ?',
+                (file_id, STATE_DONE)).fetchall()
+        return {row[0] for row in rows}
+
+    def is_done(self, file_id, destination):
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT 1 FROM destinations WHERE file_id = ? AND destination = ? AND state = ?',
+                (file_id, destination, STATE_DONE)).fetchone()
+        return row is not None
+
+    def mark_in_flight(self, file_id, destination, target=None):
+        self.set_state(file_id, destination, STATE_IN_FLIGHT, target)
+
+    def mark_done(self, file_id, destination, target=None):
+        self.set_state(file_id, destination, STATE_DONE, target)
+
+    def mark_failed(self, file_id, destination, error):
+        self.set_state(file_id, destination, STATE_FAILED, error=str(error))
+
+    def set_state(self, file_id, destination, state, target=None, error=None):
+        with self.lock:
+            self.connection.execute(
+                'INSERT INTO destinations (file_id, destination, state, target, error, updated) '
+                'VALUES (?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT (file_id, destination) DO UPDATE SET state = excluded.state, '
+                'target = COALESCE(excluded.target, destinations.target), error = excluded.error, '
+                'updated = excluded.updated',
+                (file_id, destination, state, target, error, time.time()))
+
+    def in_flight(self):
+        """Return the (directory, name, destination, target, updated) of every destination still in flight."""
+        return self.query_state(STATE_IN_FLIGHT)
+
+    def backlog(self):
+        """Return the (directory, name, destination, state, error, updated) of every destination not yet done."""
+        with self.lock:
+            return self.connection.execute(
+                'SELECT f.source_dir, f.name, d.destination, d.state, d.error, d.updated '
+                'FROM destinations d JOIN files f USING (file_id) WHERE d.state != ? '
+                'ORDER BY d.updated', (STATE_DONE,)).fetchall()
+
+    def query_state(self, state):
+        with self.lock:
+            return self.connection.execute(
+                'SELECT f.source_dir, f.name, d.destination, d.target, d.updated '
+                'FROM destinations d JOIN files f USING (file_id) WHERE d.state = ? '
+                'ORDER BY d.updated', (state,)).fetchall()
+
+    def prune(self, older_than_days):
+        """Forget files first seen more than older_than_days ago. Returns the number of files removed."""
+        cutoff = time.time() - older_than_days * 86400
+        with self.lock:
+            self.connection.execute(
+                'DELETE FROM destinations WHERE file_id IN (SELECT file_id FROM files WHERE first_seen < ?)',
+                (cutoff,))
+            return self.connection.execute('DELETE FROM files WHERE first_seen < ?', (cutoff,)).rowcount
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect the receiver/dispatcher transfer journal.")
+    parser.add_argument('db_path', help="Path of the journal database")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('backlog', help="Files with at least one destination not done")
+    subparsers.add_parser('in-flight', help="Destinations started but not finished (e.g. interrupted by a crash)")
+    prune_parser = subparsers.add_parser('prune', help="Forget old files")
+    prune_parser.add_argument('--days', type=float, default=30, help="Age in days (default: 30)")
+    args = parser.parse_args()
+
+    journal = TransferJournal(args.db_path)
+    if args.command == 'backlog':
+        for source_dir, name, destination, state, error, updated in journal.backlog():
+            print(f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(updated))}\t{state}\t"
+                  f"{os.path.join(source_dir, name)}\t{destination}\t{error or ''}")
+    elif args.command == 'in-flight':
+        for source_dir, name, destination, target, updated in journal.in_flight():
+            print(f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(updated))}\t"
+                  f"{os.path.join(source_dir, name)}\t{destination}\t{target or ''}")
+    elif args.command == 'prune':
+        print(f"Removed {journal.prune(args.days)} files from {args.db_path}")
+
+
+if __name__ == '__main__':
+    main()
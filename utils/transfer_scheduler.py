@@ -0,0 +1,210 @@
+import fnmatch
+import heapq
+import math
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from utils.logger import get_logger
+from utils.metrics import DEADLINE_MISSED
+
+DEFAULT_PRIORITY = 100
+SIZE_UNITS = {'kib': 1024, 'mib': 1024 ** 2, 'gib': 1024 ** 3, 'kb': 1000, 'mb': 1000 ** 2, 'gb': 1000 ** 3}
+
+
+def parse_size(value):
+    """Parse sizes such as 512, 64KiB, 4MiB or 1GiB into bytes (numbers are returned as they are)."""
+    if isinstance(value, (int, float)):
+        return int(value)
+    lowered = value.strip().lower()
+    for unit, factor in SIZE_UNITS.items():
+        if lowered.endswith(unit):
+            return int(float(lowered[:-len(unit)]) * factor)
+    return int(lowered)
+
+
+def parse_clock(value):
+    """Parse 'HH:MM' into minutes after midnight."""
+    hours, minutes = str(value).split(':')
+    return int(hours) * 60 + int(minutes)
+
+
+class TokenBucket:
+    """
+    Caps a destination's throughput at rate bytes per second with bursts of up to burst bytes. Callers
+    take what they send and sleep off any debt, so a large chunk simply waits longer afterwards.
+    With hours ('08:00-17:30', may wrap midnight) the cap only applies inside that window.
+    """
+
+    def __init__(self, rate, burst=None, hours=None):
+        self.rate = parse_size(rate)
+        self.burst = parse_size(burst) if burst else self.rate
+        self.window = tuple(parse_clock(part) for part in hours.split('-')) if hours else None
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def active(self, now=None):
+        if self.window is None:
+            return True
+        now = now or datetime.now()
+        minute = now.hour * 60 + now.minute
+        start, end = self.window
+        return start <= minute < end if start <= end else minute >= start or minute < end
+
+    def consume(self, amount):
+        if amount <= 0 or not self.active():
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+class DestinationLimits:
+    """
+    Concurrency limit ('max_concurrent') and bandwidth cap ('bandwidth') shared by everything sent to
+    one destination.
+    """
+
+    def __init__(self, max_concurrent=None, bandwidth=None):
+        self.slots = threading.BoundedSemaphore(max_concurrent) if max_concurrent else None
+        self.bucket = TokenBucket(bandwidth['rate'], bandwidth.get('burst'), bandwidth.get('hours')) \
+            if bandwidth else None
+
+    @contextmanager
+    def slot(self):
+        """Hold one of the destination's transfer slots for the duration of the block."""
+        if self.slots is None:
+            yield
+            return
+        with self.slots:
+            yield
+
+    def throttle(self, amount):
+        """Account amount bytes against the bandwidth cap, sleeping when it is exceeded."""
+        if self.bucket is not None:
+            self.bucket.consume(amount)
+
+
+class FeedPolicy:
+    """Priority (lower runs first) and optional daily deadline ('HH:MM') of the files matching a pattern."""
+
+    def __init__(self, pattern='*', priority=DEFAULT_PRIORITY, deadline=None):
+        self.pattern = pattern
+        self.priority = priority
+        self.deadline = parse_clock(deadline) if deadline else None
+
+    @classmethod
+    def from_config(cls, config, pattern=None):
+        """From a feed rule, or a receiver file entry ('priority', 'deadline') when pattern is given."""
+        return cls(pattern or config.get('pattern', '*'), config.get('priority', DEFAULT_PRIORITY),
+                   config.get('deadline'))
+
+    def deadline_at(self, now):
+        """Today's deadline as a timestamp, or infinity without one."""
+        if self.deadline is None:
+            return math.inf
+        hour, minute = divmod(self.deadline, 60)
+        return now.replace(hour=hour, minute=minute, second=0, microsecond=0).timestamp()
+
+
+class TransferScheduler:
+    """
+    Sits between discovery and transfer: orders the discovered work with a priority queue by feed
+    priority, then deadline, then discovery order, and hands out the shared per-destination limits.
+    """
+
+    def __init__(self, feeds=(), destinations=None, pipeline='dispatcher'):
+        self.feeds = [FeedPolicy.from_config(feed) for feed in feeds]
+        self.destination_configs = destinations or {}
+        self.limits = {}
+        self.lock = threading.Lock()
+        self.pipeline = pipeline
+        self.logger = get_logger(f'{pipeline}_logger')
+
+    @classmethod
+    def from_config(cls, config, pipeline='dispatcher'):
+        """Build from a 'scheduler' block: {'feeds': [...], 'destinations': {key: {...}}}."""
+        config = config or {}
+        return cls(config.get('feeds', []), config.get('destinations'), pipeline)
+
+    def policy_for(self, name):
+        """The first feed rule whose pattern matches the file name, or the default policy."""
+        for feed in self.feeds:
+            if fnmatch.fnmatch(name, feed.pattern):
+                return feed
+        return FeedPolicy()
+
+    def destination_limits(self, key, config=None):
+        """
+        The limits shared by everything sent to the destination key. They come from the scheduler's
+        'destinations' block, or from config ('max_concurrent', 'bandwidth') for the first caller.
+        """
+        with self.lock:
+            limits = self.limits.get(key)
+            if limits is None:
+                settings = self.destination_configs.get(key) or config or {}
+                limits = self.limits[key] = DestinationLimits(settings.get('max_concurrent'),
+                                                              settings.get('bandwidth'))
+            return limits
+
+    def schedule(self, items, name_of, policy_of=None):
+        """
+        Return (item, policy) pairs in scheduling order. name_of gives an item's file name; policy_of may
+        supply a FeedPolicy per item (e.g. from the receiver's file patterns), otherwise the feed rules decide.
+        """
+        now = datetime.now()
+        queue = []
+        for index, item in enumerate(items):
+            policy = (policy_of(item) if policy_of else None) or self.policy_for(name_of(item))
+            heapq.heappush(queue, (policy.priority, policy.deadline_at(now), index, item, policy))
+
+        scheduled = []
+        while queue:
+            _, deadline, _, item, policy = heapq.heappop(queue)
+            if deadline < now.timestamp():
+                self.logger.warning(f"{name_of(item)} is scheduled after its feed deadline")
+                DEADLINE_MISSED.inc(pipeline=self.pipeline, feed=policy.pattern)
+            scheduled.append((item, policy))
+        return scheduled
+
+    def order(self, items, name_of, policy_of=None):
+        """Return the items in scheduling order (see schedule)."""
+        return [item for item, _ in self.schedule(items, name_of, policy_of)]
+
+
+class WorkQueue:
+    """
+    Priority queue of work that is still being discovered: items are added as their directory is listed
+    and taken in batches of the best queued priority, so an urgent item listed late still overtakes the
+    less urgent items queued before it. Deadline misses are reported once, when an item is added.
+    """
+
+    def __init__(self, scheduler, name_of):
+        self.scheduler = scheduler
+        self.name_of = name_of
+        self.queue = []
+        self.added = 0
+
+    def __len__(self):
+        return len(self.queue)
+
+    def add(self, items):
+        now = datetime.now()
+        for item, policy in self.scheduler.schedule(items, self.name_of):
+            heapq.heappush(self.queue, (policy.priority, policy.deadline_at(now), self.added, item))
+            self.added += 1
+
+    def take(self, limit):
+        """Remove and return up to limit items of the best queued priority, in scheduling order."""
+        taken = []
+        priority = self.queue[0][0] if self.queue else None
+        while self.queue and self.queue[0][0] == priority and len(taken) < limit:
+            taken.append(heapq.heappop(self.queue)[3])
+        return taken
@@ -0,0 +1,139 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+
+from utils.logger import get_logger
+
+# inotify constants from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+EVENT_HEADER = struct.Struct('iIII')
+READ_SIZE = 64 * 1024
+
+
+class TriggerWatcher:
+    """
+    Watches directories for trigger files landing (created, written or moved in) using Linux inotify.
+
+    Where inotify is not available (e.g. macOS) the watcher reports no events and callers rely
+    on their periodic rescan only.
+    """
+
+    def __init__(self, directories, logger_name):
+        """
+        :param directories: Dictionary of directory path -> trigger extension to watch for (e.g. '.trg').
+        :param logger_name: Logger used to report watch problems.
+        """
+        self.logger = get_logger(logger_name)
+        self.extensions = {}
+        self.directories = {}
+        self.fd = None
+
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd < 0:
+                raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+        except (AttributeError, OSError) as e:
+            self.logger.warning(f"inotify is not available, falling back to periodic rescans only: {str(e)}")
+            return
+
+        self.fd = fd
+        for directory, extension in directories.items():
+            directory = os.path.abspath(directory)
+            wd = libc.inotify_add_watch(fd, os.fsencode(directory), IN_CREATE | IN_CLOSE_WRITE | IN_MOVED_TO)
+            if wd < 0:
+                errno = ctypes.get_errno()
+                self.logger.error(f"Unable to watch {directory}: {os.strerror(errno)}")
+                continue
+            self.directories[wd] = directory
+            self.extensions[wd] = extension
+            self.logger.info(f"Watching {directory} for *{extension} files")
+
+    def wait(self, timeout):
+        """
+        Waits up to timeout seconds for trigger events.
+
+        Returns a list of (directory, trigger file name) pairs, de-duplicated and in arrival order,
+        an empty list on timeout, or None when events were lost and a full rescan is needed.
+        """
+        if self.fd is None:
+            time.sleep(timeout)
+            return []
+
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+
+        triggers = {}
+        overflowed = False
+        while True:
+            try:
+                data = os.read(self.fd, READ_SIZE)
+            except BlockingIOError:
+                break
+
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+                offset += length
+
+                if mask & IN_Q_OVERFLOW:
+                    overflowed = True
+                elif wd in self.directories and not mask & IN_ISDIR and name.endswith(self.extensions[wd]):
+                    triggers[(self.directories[wd], name)] = None
+
+        if overflowed:
+            self.logger.warning("inotify event queue overflowed, a full rescan is needed")
+            return None
+        return list(triggers)
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+def run_watch_loop(directories, on_trigger, on_rescan, rescan_interval, logger_name):
+    """
+    Runs forever: calls on_trigger(directory, trigger_name) as soon as a trigger lands in one of the
+    watched directories, and on_rescan() at start-up, every rescan_interval seconds and after lost events.
+    """
+    logger = get_logger(logger_name)
+    watcher = TriggerWatcher(directories, logger_name)
+
+    def rescan():
+        try:
+            on_rescan()
+        except Exception as e:
+            logger.error(f"Error during periodic rescan: {str(e)}")
+        return time.monotonic() + rescan_interval
+
+    try:
+        next_rescan = rescan()
+
+        while True:
+            triggers = watcher.wait(max(0.0, next_rescan - time.monotonic()))
+
+            if triggers is None or time.monotonic() >= next_rescan:
+                next_rescan = rescan()
+                continue
+
+            for directory, trigger_name in triggers:
+                try:
+                    on_trigger(directory, trigger_name)
+                except Exception as e:
+                    logger.error(f"Error processing trigger {trigger_name} in {directory}: {str(e)}")
+    finally:
+        watcher.close()